@@ -2,6 +2,7 @@ from piml.config.base import BaseYAMLConfig
 from piml.config.dataset import DatasetConfig
 from piml.config.dim_vars import DimVarsConfig
 from piml.config.flaml import FLAMLConfig
+from piml.config.training import TrainingConfig
 
 
 class Config(BaseYAMLConfig):
@@ -10,3 +11,4 @@ class Config(BaseYAMLConfig):
     dataset: DatasetConfig
     flaml: FLAMLConfig
     n_members: int
+    training: TrainingConfig = TrainingConfig()
@@ -0,0 +1,65 @@
+import os
+import pathlib
+from typing import Optional
+
+from piml.config.base import BaseYAMLConfig
+
+# Estimated number of private copies of the training data held by each member in training: its own rows, FLAML's
+# train/validation split and the booster's internal matrix
+MEMBER_DATA_COPIES = 3
+
+
+class TrainingConfig(BaseYAMLConfig):
+    """ Settings of ensemble training. Except for `warm_start*` and `knowledge_base`, they do not affect the trained
+    models.
+    """
+    # Number of ensemble members trained at the same time (1: one after another)
+    n_parallel_members: int = 1
+
+    # Number of CPUs shared by all members trained at the same time. Defaults to all CPUs of the machine.
+    n_cpus: Optional[int] = None
+
+    # Directory for training data shared by parallel members. Defaults to RAM-backed `/dev/shm` if available.
+    tmp_dir: Optional[pathlib.Path] = None
+
+    # Memory budget in MB of all members trained at the same time. Fewer than `n_parallel_members` are trained at once,
+    # if their estimated memory exceeds it (see `parallel_members`).
+    max_memory: Optional[float] = None
+
+    # Warm start: The first member searches with the full FLAML time budget. All other members start their search from
+    # the best configurations of the first member and get `warm_start_budget_frac` of the time budget.
+    warm_start: bool = False
+    warm_start_budget_frac: float = 0.5
+
+    # Start FLAML's search from the best configurations of earlier ensembles of this workspace (also of other Pi sets)
+    # and record the best configurations of each new ensemble (see ``piml.ml.knowledge``)
+    knowledge_base: bool = False
+
+    # Permutation feature importance: stop shuffling a feature once the 95 % confidence interval of its relative score
+    # is narrower than `fi_tol` (at most 25 shuffles). Optionally, only use `fi_sample_frac` of the samples of each day.
+    fi_tol: Optional[float] = None
+    fi_sample_frac: Optional[float] = None
+
+    # Export members in slim native format (best estimator plus metadata) next to the full members after training
+    export_slim: bool = True
+
+    def parallel_members(self, data_bytes: int) -> int:
+        """ Number of members trained at the same time on training data of `data_bytes`. Every member holds about
+        `MEMBER_DATA_COPIES` private copies of the data, so the number is limited by `max_memory`, if set.
+        """
+        n_parallel = max(self.n_parallel_members, 1)
+        if self.max_memory is not None:
+            n_fit = int(self.max_memory * 1024 ** 2 // max(MEMBER_DATA_COPIES * data_bytes, 1))
+            n_parallel = min(n_parallel, max(n_fit, 1))
+        return n_parallel
+
+    def member_n_jobs(self, n_jobs: int, n_parallel: int = None) -> int:
+        """ Number of threads per member. In serial mode, FLAML's `n_jobs` is used as is. In parallel mode, CPUs are
+        split evenly between `n_parallel` (default: `n_parallel_members`) concurrent members.
+        """
+        if n_parallel is None:
+            n_parallel = self.n_parallel_members
+        if n_parallel <= 1:
+            return n_jobs
+        n_cpus = self.n_cpus or os.cpu_count()
+        return max(n_cpus // n_parallel, 1)
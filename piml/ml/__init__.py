@@ -1 +1,7 @@
-from .base import Experiment
+def __getattr__(name):
+    # Experiment is imported on first use only, so that the slim export and inference (``piml.ml.export``,
+    # ``piml.ml.inference``) work without importing FLAML
+    if name == "Experiment":
+        from .base import Experiment
+        return Experiment
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,8 +1,10 @@
 import pathlib
 from typing import Optional, Tuple
 import flaml
+import joblib
 import pydantic
 import numpy as np
+import sympy as sp
 
 from piml.config import Config
 from piml.pi import PiSet
@@ -29,6 +31,8 @@ class Experiment(pydantic.BaseModel):
     features: np.ndarray = None
     algo_fi: np.ndarray = None  # Feature importance according to algorithm
     perm_fi: np.ndarray = None  # Permutation feature importance
+    perm_fi_iters: np.ndarray = None  # Number of shuffles per feature
+    perm_fi_ci: np.ndarray = None  # Confidence interval width of permutation feature importance
 
     class Config:
         arbitrary_types_allowed = True
@@ -39,6 +43,20 @@ class Experiment(pydantic.BaseModel):
         algos = "_".join(self.config.flaml.estimator_list)
         return f"PiSet_{self.pi_set.id:03d}__{algos}__{dataset}"
 
+    def get_key(self, data_fingerprint: str) -> str:
+        """ Deterministic key of the ensemble trained by this experiment on data with `data_fingerprint`
+        (e.g., ``joblib.hash`` of the dimensional training data).
+        Settings, which do not affect the members, are ignored. Also `n_members` is ignored, because members are
+        drawn in the same order independent of the ensemble size, so a larger ensemble extends a smaller one.
+        """
+        config = self.config.yaml(exclude={
+            "training": {"n_parallel_members", "n_cpus", "tmp_dir", "max_memory", "export_slim"},
+            "n_members": True,
+            "flaml": {"n_jobs", "verbose"},
+        })
+        pi_set = [self.pi_set.id, self.pi_set.target_id] + [sp.srepr(pi) for pi in self.pi_set.all_exprs]
+        return joblib.hash([config, pi_set, self.target, data_fingerprint])[:12]
+
     @property
     def target_dim(self):
         """ Shortcut to target variable name in dimensional space """
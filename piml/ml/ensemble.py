@@ -1,18 +1,40 @@
-from typing import Union, List
+from typing import Union, List, Sequence, Dict, Optional
 
 import flaml
 import numpy as np
 import pandas as pd
+from sklearn.metrics import r2_score
+from joblib.externals.loky import get_reusable_executor
 
 from piml.ml import Experiment
 from piml.ml.fi import get_permutation_importance
 from piml.ml.splitter import RandomDaysSplitter
 from piml.utils.lazy_array import LazyArray
+from piml.utils.memmap import MemmapArray, shared_tmp_dir, remove_tmp_dir
 
 
 def train_ensemble(base_exp: Experiment, df_train: pd.DataFrame, features: np.ndarray,
-                   result_array: Union[List, LazyArray]) -> None:
-    """ Train ensemble of estimators based on `base_exp` on randomly selected subsets of days."""
+                   result_array: Union[List, LazyArray], n_members: int = None, time_budget: int = None,
+                   members: Sequence[int] = None, starting_points: Dict = None) -> List[int]:
+    """ Train ensemble of estimators based on `base_exp` on randomly selected subsets of days.
+
+    By default, `n_members` and FLAML `time_budget` are taken from the config. Members already in `result_array` are
+    kept and only the missing ones are trained. Splits only depend on the seed and the member index, so an ensemble
+    grown in several calls has the same splits as one trained at once.
+    Pass `members` (numbers starting at 1) to only train these members, e.g., one shard of a job array. They are
+    written to their position in `result_array` (has to be ``LazyArray``), so that several processes can fill the
+    same ensemble.
+    FLAML's search of all members starts from `starting_points` (see ``flaml.AutoML.fit``), if provided. With warm
+    start enabled in the config, members after the first one start from the best configurations of the first one
+    (pilot). The pilot has to be trained before or be among the members to train, otherwise a ``ValueError`` is
+    raised, so that warm- and cold-started members are never mixed in one ensemble.
+    Returns the numbers of the members trained by this call.
+    """
+    if n_members is None:
+        n_members = base_exp.config.n_members
+    if time_budget is None:
+        time_budget = base_exp.config.flaml.time_budget
+
     # Setup training data
     target = base_exp.target
     X_train = df_train[features]
@@ -26,56 +48,170 @@ def train_ensemble(base_exp: Experiment, df_train: pd.DataFrame, features: np.nd
     # Set up splitter for ensemble
     ensemble_splitter = RandomDaysSplitter(
         df_train["DAY_YEAR"],
-        n_splits=base_exp.config.n_members,
+        n_splits=n_members,
         n_intervals_per_split=2,
         n_days_per_interval=7,
         random_state=base_exp.config.flaml.seed,
     )
 
-    # Train one member of ensemble at a time
-    i = 1
-    for idx_train, idx_val in ensemble_splitter.split(X_train):
-        # Create Experiment instance for this member
-        exp = base_exp.copy(deep=True)
-        exp.train_idx = idx_train
-        exp.val_idx = idx_val
-
-        # Get train and validation data. Pandas needs to be converted to numpy for KFold CV to work
-        X_train_i = X_train.iloc[idx_train].to_numpy()
-        y_train_i = y_train.iloc[idx_train].to_numpy()
-        X_val_i = X_train.iloc[idx_val].to_numpy()
-        y_val_i = y_train.iloc[idx_val].to_numpy()
-
-        # If logging is enabled, create one log file per ensemble
-        log_file_name = base_exp.config.flaml.log_file_name
-        if log_file_name:
-            log_file_name = log_file_name.parent / f"{log_file_name.stem}_{i:03d}{log_file_name.suffix}"
-
-        # Get FLAML settings dict from config
-        automl_settings_dict = base_exp.config.flaml.copy(update={
-            "log_file_name": log_file_name
-        }).dict()
-
-        # Train it
-        print(f"Training model {i} of ensemble...", end=" ")
-        automl = flaml.AutoML(**automl_settings_dict)
-        automl.fit(X_train_i, y_train_i)
+    # Splits are drawn for all members (also already trained ones), so that they do not depend on the mode.
+    # Boolean masks of the samples are smaller than indices.
+    splits = list(ensemble_splitter.split_masks(X_train))
+    if members is None:
+        members = range(len(result_array) + 1, n_members + 1)
+    if isinstance(result_array, LazyArray):
+        members = [i for i in members if not result_array.exists(i - 1)]  # e.g., written by another process
+    tasks = [(i, *splits[i - 1]) for i in members]
+    trained = [i for i, _, _ in tasks]
+
+    # Settings shared by all members. Their config records the actually used time budget.
+    base_exp = base_exp.copy(deep=True)
+    base_exp.config.flaml.time_budget = time_budget
+    base_exp.features = features
 
-        # Store and evaluate it
-        exp.model = automl
-        exp.train_score = automl.best_loss
-        exp.val_score = automl.score(X=X_val_i, y=y_val_i)
-
-        # Rank features
-        print("Feature ranking...", end=" ")
-        exp.features = features
-        exp.algo_fi = automl.feature_importances_
-        exp.perm_fi = get_permutation_importance(
-            automl, X_train_i, y_train_i, n_jobs=base_exp.config.flaml.n_jobs, lower_is_better=True
+    # Pandas needs to be converted to numpy for KFold CV to work. Only one copy of the data is made.
+    X_train, y_train = X_train.to_numpy(), y_train.to_numpy()
+    days = df_train["DAY_YEAR"].to_numpy()
+
+    # Each member copies its training rows, so the number of concurrent members is limited by the memory budget
+    training = base_exp.config.training
+    n_parallel = training.parallel_members(X_train.nbytes + y_train.nbytes)
+    if n_parallel < training.n_parallel_members:
+        print(f"Training only {n_parallel} instead of {training.n_parallel_members} members at a time to stay within "
+              f"{training.max_memory} MB.")
+    n_jobs = training.member_n_jobs(base_exp.config.flaml.n_jobs, n_parallel=n_parallel)
+
+    # Warm start: Members start from best configurations of first member (pilot) with reduced budget
+    if base_exp.config.training.warm_start and tasks:
+        pilot = _load_member(result_array, 1)
+        if pilot is None and tasks[0][0] == 1:
+            i, idx_train, idx_val = tasks.pop(0)
+            pilot = train_member(base_exp, X_train, y_train, idx_train, idx_val, i, n_jobs, starting_points, days)
+            _store_member(result_array, i, pilot)
+        if pilot is None:
+            raise ValueError("Warm start requires the first member (pilot), which is not trained yet (e.g., assigned "
+                             "to another shard). Train the pilots first (step 4 with --pilots).")
+        starting_points = {
+            est: config for est, config in pilot.model.best_config_per_estimator.items() if config is not None
+        }
+        base_exp = base_exp.copy(deep=True)
+        base_exp.config.flaml.time_budget = max(
+            int(round(time_budget * base_exp.config.training.warm_start_budget_frac)), 1
         )
+        print(f"Warm-starting members from member 1 with {base_exp.config.flaml.time_budget} s budget.")
 
-        result_array.append(exp)
-        i += 1
-        print("Done!")
+    if n_parallel > 1:
+        # Train several members at once. The data are written once to a memory-mapped file, so workers only receive
+        # its path and indices instead of pickled copies. Each worker still builds private copies of its rows (see
+        # ``train_member``), so peak memory grows with `n_parallel` times the size of the training data. This is
+        # bounded by `n_parallel` above.
+        # Results are collected in order, so the ensemble is the same as in serial mode and every member is stored
+        # as soon as all previous ones are done.
+        print(f"Training {len(tasks)} members, {n_parallel} at a time with {n_jobs} threads each.")
+        tmp_dir = shared_tmp_dir(base_exp.config.training.tmp_dir)
+        try:
+            X_shared = MemmapArray.from_array(X_train, tmp_dir / "X.npy")
+            y_shared = MemmapArray.from_array(y_train, tmp_dir / "y.npy")
+            del X_train, y_train
+
+            executor = get_reusable_executor(max_workers=n_parallel)
+            futures = [
+                executor.submit(_train_member_shared, base_exp, X_shared, y_shared, idx_train, idx_val, i, n_jobs,
+                                starting_points, days)
+                for i, idx_train, idx_val in tasks
+            ]
+            for (i, _, _), future in zip(tasks, futures):
+                _store_member(result_array, i, future.result())
+        finally:
+            remove_tmp_dir(tmp_dir)
+    else:
+        # Train one member of ensemble at a time
+        for i, idx_train, idx_val in tasks:
+            exp = train_member(base_exp, X_train, y_train, idx_train, idx_val, i, n_jobs, starting_points, days)
+            _store_member(result_array, i, exp)
 
     print("Ensemble training done!")
+    return trained
+
+
+def _load_member(result_array: Union[List, LazyArray], i: int) -> Optional[Experiment]:
+    """ Member `i` (starting at 1) if already trained """
+    if isinstance(result_array, LazyArray):
+        if not result_array.exists(i - 1):
+            return None
+        result_array.refresh()
+    elif len(result_array) < i:
+        return None
+    return result_array[i - 1]
+
+
+def _store_member(result_array: Union[List, LazyArray], i: int, exp: Experiment) -> None:
+    """ Store member `i` (starting at 1) at its position """
+    if isinstance(result_array, LazyArray):
+        result_array.put(i - 1, exp)
+    else:
+        result_array.append(exp)
+
+
+def train_member(base_exp: Experiment, X_train: np.ndarray, y_train: np.ndarray, idx_train: np.ndarray,
+                 idx_val: np.ndarray, i: int, n_jobs: int, starting_points: Dict = None,
+                 days: np.ndarray = None) -> Experiment:
+    """ Train member `i` of ensemble on samples `idx_train` and evaluate it on `idx_val`.
+    FLAML's search starts from `starting_points` (best configuration per estimator), if provided. `days` (day of year
+    of each sample) are needed to subsample days for permutation feature importance.
+    """
+    # Create Experiment instance for this member
+    exp = base_exp.copy(deep=True)
+    exp.train_idx = idx_train
+    exp.val_idx = idx_val
+
+    # Get train and validation data. Indexing copies the rows, also from a memory map. Members train on all but a few
+    # days, so this is nearly a full copy of `X_train`. It cannot be avoided with views, because FLAML needs a single
+    # array and makes further copies itself (shuffling and splitting for its own validation).
+    X_train_i = X_train[idx_train]
+    y_train_i = y_train[idx_train]
+    X_val_i = X_train[idx_val]
+    y_val_i = y_train[idx_val]
+
+    # If logging is enabled, create one log file per ensemble
+    log_file_name = base_exp.config.flaml.log_file_name
+    if log_file_name:
+        log_file_name = log_file_name.parent / f"{log_file_name.stem}_{i:03d}{log_file_name.suffix}"
+
+    # Get FLAML settings dict from config
+    automl_settings_dict = exp.config.flaml.copy(update={
+        "log_file_name": log_file_name,
+        "n_jobs": n_jobs,
+    }).dict()
+
+    # Train it
+    print(f"Training model {i} of ensemble...", end=" ")
+    automl = flaml.AutoML(**automl_settings_dict)
+    if starting_points:
+        automl.fit(X_train_i, y_train_i, starting_points=starting_points)
+    else:
+        automl.fit(X_train_i, y_train_i)
+
+    # Store and evaluate it
+    exp.model = automl
+    exp.train_score = automl.best_loss
+    exp.val_score = automl.score(X=X_val_i, y=y_val_i)
+
+    # Rank features
+    print("Feature ranking...", end=" ")
+    exp.algo_fi = automl.feature_importances_
+    # FLAML's `score` is R2 for regression, so permutations are predicted and scored with `r2_score` (one at a time)
+    training = exp.config.training
+    exp.perm_fi, exp.perm_fi_iters, exp.perm_fi_ci = get_permutation_importance(
+        automl, X_train_i, y_train_i, n_jobs=n_jobs, lower_is_better=True, scoring=r2_score,
+        random_state=exp.config.flaml.seed + i, tol=training.fi_tol, sample_frac=training.fi_sample_frac,
+        groups=None if days is None else days[idx_train], return_stats=True
+    )
+
+    print("Done!")
+    return exp
+
+
+def _train_member_shared(base_exp: Experiment, X_train: MemmapArray, y_train: MemmapArray, *args) -> Experiment:
+    """ Worker entry point. The shared data are opened as memory map, rows of the member are copied from it. """
+    return train_member(base_exp, X_train.array, y_train.array, *args)
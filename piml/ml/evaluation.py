@@ -0,0 +1,275 @@
+"""
+Evaluation of trained ensembles on the test data with an on-disk cache.
+
+Scores of each ensemble are stored in ``evaluation.npz`` next to the ensemble together with a key of the member files,
+the test data and the transformer config. Predictions (members, samples) are stored in ``evaluation_pred.npy`` and
+opened as memory map. Only ensembles whose key changed are evaluated again.
+
+Streaming evaluation bounds memory for large test sets: Pi features are computed in row chunks and stored on disk,
+members are loaded and predicted one at a time, and scores are accumulated chunk by chunk.
+"""
+import json
+import os
+import pathlib
+from typing import List, Tuple, Union
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import r2_score, mean_squared_error
+
+import piml
+from piml.ml.export import load_ensemble, open_ensemble, slim_dir, pi_set_to_dict, pi_set_from_dict
+from piml.ml.inference import EnsemblePredictor
+from piml.ml.racing import is_eliminated
+from piml.ml.transform import DimToPiTransformer
+
+CACHE_FILE = "evaluation.npz"
+PRED_FILE = "evaluation_pred.npy"
+
+
+class EnsembleEvaluation:
+    """ Evaluation of one ensemble on the test data """
+
+    def __init__(self, pi_set: piml.PiSet, features: np.ndarray, scores: np.ndarray, y_dim_pred: np.ndarray,
+                 perm_fi: np.ndarray, dim_target: str, key: str = None):
+        self.pi_set = pi_set
+        self.features = features
+        self.scores = scores  # (members, 2) with R2 and RMSE of log10 target
+        self.y_dim_pred = y_dim_pred  # (members, samples), possibly memory-mapped
+        self.perm_fi = perm_fi  # (members, features)
+        self.dim_target = dim_target
+        self.key = key
+
+    def save(self, path: Union[str, pathlib.Path]) -> None:
+        """ Save scores to `path` and predictions to ``evaluation_pred.npy`` next to it (unless they are memory-mapped
+        from there already). Scores are written last and atomically, so that an interrupted run never leaves a
+        partial cache behind.
+        """
+        path = pathlib.Path(path)
+        pred_path = path.with_name(PRED_FILE)
+        if not is_mapped_from(self.y_dim_pred, pred_path):
+            np.save(pred_path, self.y_dim_pred)
+
+        tmp_path = path.with_name(f".{path.stem}.tmp.npz")
+        np.savez(
+            tmp_path,
+            pi_set=json.dumps(pi_set_to_dict(self.pi_set)),
+            features=np.asarray(self.features, dtype=str),
+            scores=self.scores,
+            perm_fi=self.perm_fi,
+            dim_target=self.dim_target,
+            key=self.key,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Union[str, pathlib.Path]) -> "EnsembleEvaluation":
+        path = pathlib.Path(path)
+        with np.load(path) as f:
+            return cls(
+                pi_set=pi_set_from_dict(json.loads(str(f["pi_set"]))),
+                features=f["features"],
+                scores=f["scores"],
+                y_dim_pred=np.load(path.with_name(PRED_FILE), mmap_mode="r"),
+                perm_fi=f["perm_fi"],
+                dim_target=str(f["dim_target"]),
+                key=str(f["key"]),
+            )
+
+
+def is_mapped_from(arr: np.ndarray, path: Union[str, pathlib.Path]) -> bool:
+    """ Whether `arr` is memory-mapped from file `path` (also if given as relative path or symlink). Such a file must
+    not be written again, because it would be truncated while still being read.
+    """
+    filename = getattr(arr, "filename", None)
+    return (isinstance(arr, np.memmap) and filename is not None and os.path.exists(path)
+            and os.path.samefile(filename, path))
+
+
+def cache_path(ensemble_dir: Union[str, pathlib.Path]) -> pathlib.Path:
+    """ Location of the cached evaluation of the ensemble in `ensemble_dir` (``LazyArray`` directory) """
+    return pathlib.Path(ensemble_dir).parent / CACHE_FILE
+
+
+def member_files_signature(ensemble_dir: Union[str, pathlib.Path]) -> List[Tuple[str, int, int]]:
+    """ Name, size and modification time of all full and exported member files. Changes whenever members are added or
+    rewritten, without reading the (possibly large) files.
+    """
+    files = []
+    for path in (pathlib.Path(ensemble_dir), slim_dir(ensemble_dir)):
+        if path.is_dir():
+            files += sorted(p for p in path.iterdir() if not p.name.startswith("."))
+    return [(f"{p.parent.name}/{p.name}", p.stat().st_size, p.stat().st_mtime_ns) for p in files]
+
+
+def evaluation_key(ws: piml.Workspace, ensemble_dir: Union[str, pathlib.Path], test_fingerprint: str) -> str:
+    """ Key of member files, test data (e.g., ``joblib.hash`` of the dimensional test data) and transformer config,
+    including the custom code providing the target transformers.
+    """
+    custom_code = ws.root / "custom_code.py"
+    transformer_config = [
+        ws.config.dim_vars.yaml(),
+        ws.config.dataset.target_transformers,
+        custom_code.read_text() if custom_code.exists() else None,
+    ]
+    return joblib.hash([member_files_signature(ensemble_dir), test_fingerprint, transformer_config])
+
+
+def evaluate_ensemble(ws: piml.Workspace, ensemble_dir: Union[str, pathlib.Path], df_dim_test: pd.DataFrame,
+                      n_jobs: int = -1) -> EnsembleEvaluation:
+    """ Predict test data with all members (`n_jobs` threads) and score them in dimensional space (R2 and RMSE of
+    log10 target)
+    """
+    ens = load_ensemble(ensemble_dir)
+    features = np.array(ens[0].features)  # ensure np array
+    pi_set = ens[0].pi_set
+
+    # Transform dimensional data to Pi space
+    pi_tf = DimToPiTransformer.from_workspace(ws=ws, pi_set=pi_set)
+    pi_tf.fit(df_dim=df_dim_test)
+    df_pi_test = pi_tf.transform_X_y()
+
+    # Make predictions using ensemble. All members are predicted at once in (members, samples) matrix.
+    X_pi_test = df_pi_test[features].to_numpy()
+    y_pi_pred_ens = EnsemblePredictor.from_members(ens, n_jobs=n_jobs).predict(X_pi_test)
+
+    # Inverse transform predictions of all members to dimensional space at once
+    y_dim_pred_ens = pi_tf.inverse_transform_y_ensemble(y_pi_pred_ens)
+
+    # Compute scores. Inverse transform includes pre-pi transform, so compare with untransformed target.
+    dim_target = pi_tf.dim_target
+    log_y_dim_test = np.log10(df_dim_test[dim_target].to_numpy())
+    scores = np.array([
+        [
+            r2_score(log_y_dim_test, log_y_i),
+            np.sqrt(mean_squared_error(log_y_dim_test, log_y_i))
+        ]
+        for log_y_i in np.log10(y_dim_pred_ens)
+    ])
+
+    return EnsembleEvaluation(
+        pi_set=pi_set,
+        features=features,
+        scores=scores,
+        y_dim_pred=y_dim_pred_ens,
+        perm_fi=np.array([m.perm_fi for m in ens]),
+        dim_target=dim_target,
+    )
+
+
+def chunk_size(max_memory_mb: float, n_columns: int, n_features: int, n_members: int) -> int:
+    """ Number of test rows per chunk, so that dimensional and Pi data and predictions of all members of one chunk
+    (including temporary copies) stay below `max_memory_mb`.
+    """
+    bytes_per_row = 8 * (2 * n_columns + 3 * n_features + 3 * n_members)
+    return max(int(max_memory_mb * 1024 ** 2 // bytes_per_row), 1)
+
+
+def stream_evaluate_ensemble(ws: piml.Workspace, ensemble_dir: Union[str, pathlib.Path], df_dim_test: pd.DataFrame,
+                             max_memory_mb: float = 1024., n_jobs: int = -1) -> EnsembleEvaluation:
+    """ Evaluate ensemble like ``evaluate_ensemble`` with bounded memory.
+    Pi features of the test data are computed in row chunks and written to a temporary file. Members are then loaded
+    one at a time and predict all chunks. Finally, predictions are inverse-transformed chunk by chunk (all members at
+    once) into ``evaluation_pred.npy``, while squared errors are accumulated for the scores.
+    """
+    ensemble_dir = pathlib.Path(ensemble_dir)
+    members = open_ensemble(ensemble_dir)
+    first = members[0]
+    features = np.array(first.features)  # ensure np array
+    pi_set = first.pi_set
+    n, n_members = len(df_dim_test), len(members)
+
+    size = chunk_size(max_memory_mb, len(df_dim_test.columns), len(features), n_members)
+    chunks = [slice(start, min(start + size, n)) for start in range(0, n, size)]
+    print(f"Streaming evaluation of {n_members} members in {len(chunks)} chunks of up to {size} rows.")
+
+    pi_tf = DimToPiTransformer.from_workspace(ws=ws, pi_set=pi_set)
+    x_path = ensemble_dir.parent / ".evaluation_X_pi.npy"
+    y_pi_path = ensemble_dir.parent / ".evaluation_y_pi.npy"
+    try:
+        # 1) Pi features of test data
+        X_pi = np.lib.format.open_memmap(x_path, mode="w+", shape=(n, len(features)))
+        for rows in chunks:
+            X_pi[rows] = pi_tf.fit(df_dim=df_dim_test.iloc[rows]).transform_X()[features].to_numpy()
+
+        # 2) Predictions of one member at a time
+        y_pi = np.lib.format.open_memmap(y_pi_path, mode="w+", shape=(n_members, n))
+        perm_fi = []
+        for i in range(n_members):
+            member = first if i == 0 else members[i]
+            predictor = EnsemblePredictor.from_members([member], chunk_size=size, n_jobs=n_jobs)
+            for rows in chunks:
+                y_pi[i, rows] = predictor.predict(X_pi[rows])[0]
+            perm_fi.append(member.perm_fi)
+            del member, predictor
+        del first
+
+        # 3) Inverse transform and scores chunk by chunk
+        dim_target = pi_tf.dim_target
+        y_dim = np.lib.format.open_memmap(ensemble_dir.parent / PRED_FILE, mode="w+", shape=(n_members, n))
+        sse = np.zeros(n_members)
+        log_y_dim_test = np.log10(df_dim_test[dim_target].to_numpy())
+        for rows in chunks:
+            y_dim[:, rows] = pi_tf.fit(df_dim=df_dim_test.iloc[rows]).inverse_transform_y_ensemble(y_pi[:, rows])
+            sse += np.sum((np.log10(y_dim[:, rows]) - log_y_dim_test[rows]) ** 2, axis=1)
+        y_dim.flush()
+    finally:
+        x_path.unlink(missing_ok=True)
+        y_pi_path.unlink(missing_ok=True)
+
+    # R2 and RMSE from accumulated squared errors
+    sst = np.sum((log_y_dim_test - log_y_dim_test.mean()) ** 2)
+    scores = np.stack([1 - sse / sst, np.sqrt(sse / n)], axis=1)
+
+    return EnsembleEvaluation(
+        pi_set=pi_set,
+        features=features,
+        scores=scores,
+        y_dim_pred=np.load(ensemble_dir.parent / PRED_FILE, mmap_mode="r"),
+        perm_fi=np.array(perm_fi),
+        dim_target=dim_target,
+    )
+
+
+def cached_evaluate_ensemble(ws: piml.Workspace, ensemble_dir: Union[str, pathlib.Path], df_dim_test: pd.DataFrame,
+                             test_fingerprint: str = None, stream: bool = False,
+                             max_memory_mb: float = 1024., n_jobs: int = -1) -> Tuple[EnsembleEvaluation, bool]:
+    """ Evaluation of ensemble from cache if its key is unchanged. Otherwise, ensemble is evaluated (with bounded
+    memory if `stream`, predictions with `n_jobs` threads) and cached. Returns evaluation and whether it was taken
+    from cache.
+    """
+    if test_fingerprint is None:
+        test_fingerprint = joblib.hash(df_dim_test)
+    key = evaluation_key(ws, ensemble_dir, test_fingerprint)
+
+    path = cache_path(ensemble_dir)
+    if path.exists() and path.with_name(PRED_FILE).exists():
+        evaluation = EnsembleEvaluation.load(path)
+        if evaluation.key == key:
+            return evaluation, True
+
+    # Invalidate old cache before predictions are overwritten
+    path.unlink(missing_ok=True)
+    if stream:
+        evaluation = stream_evaluate_ensemble(ws, ensemble_dir, df_dim_test, max_memory_mb=max_memory_mb, n_jobs=n_jobs)
+    else:
+        evaluation = evaluate_ensemble(ws, ensemble_dir, df_dim_test, n_jobs=n_jobs)
+    evaluation.key = key
+    evaluation.save(path)
+    return evaluation, False
+
+
+def find_ensembles(ws: piml.Workspace, include_eliminated: bool = False) -> List[pathlib.Path]:
+    """ ``LazyArray`` directories of all trained ensembles. Full members may have been deleted after slim export.
+    Partial ensembles of sets eliminated by racing (see ``piml.ml.racing``) are skipped, unless `include_eliminated`.
+    """
+    ensembles = [ens_path for ens_path in ws.data_trained.glob("*/ensemble") if ens_path.is_dir()]
+    ensembles += [ens_path.parent / "ensemble" for ens_path in ws.data_trained.glob("*/ensemble_slim")]
+    ensembles = sorted(set(ensembles))
+    if not include_eliminated:
+        eliminated = [ens_path for ens_path in ensembles if is_eliminated(ens_path.parent)]
+        if eliminated:
+            print(f"Skipping {len(eliminated)} ensembles eliminated by racing.")
+        ensembles = [ens_path for ens_path in ensembles if ens_path not in eliminated]
+    return ensembles
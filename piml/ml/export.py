@@ -0,0 +1,223 @@
+"""
+Slim export of ensemble members.
+
+Each member is stored as its best estimator in native format (XGBoost UBJSON, LightGBM text; other estimators as pickled
+sklearn estimator) plus a small JSON record with Pi set, features, scores, feature importances, validation days and
+seed. Loading and predicting only requires the estimator's library, not the pickled ``flaml.AutoML`` object with its
+search state.
+"""
+import json
+import os
+import pathlib
+from typing import Dict, List, Union, Sequence
+
+import joblib
+import numpy as np
+import sympy as sp
+
+from piml.pi import PiSet
+from piml.utils.lazy_array import LazyArray
+
+MEMBER_PATTERN = "member_*.json"
+MODEL_FORMATS = {".ubj": "xgboost", ".txt": "lightgbm", ".joblib": "joblib"}
+
+
+class SlimModel:
+    """ Native estimator loaded from disk with sklearn-like ``predict`` """
+
+    def __init__(self, path: Union[str, pathlib.Path], model_format: str):
+        self.path = pathlib.Path(path)
+        self.model_format = model_format
+        if model_format == "xgboost":
+            import xgboost as xgb
+            self.estimator = xgb.Booster(model_file=str(self.path))
+        elif model_format == "lightgbm":
+            import lightgbm as lgb
+            self.estimator = lgb.Booster(model_file=str(self.path))
+        elif model_format == "joblib":
+            self.estimator = joblib.load(self.path)
+        else:
+            raise ValueError(f"Unknown model format {model_format}.")
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        if self.model_format == "xgboost":
+            return self.estimator.inplace_predict(np.asarray(X))
+        return self.estimator.predict(np.asarray(X))
+
+
+class SlimMember:
+    """ Exported ensemble member. Provides the attributes of ``Experiment`` used for evaluation. """
+
+    def __init__(self, meta: Dict, model: SlimModel):
+        self.meta = meta
+        self.model = model
+        self.member = meta["member"]
+        self.estimator = meta["estimator"]
+        self.target = meta["target"]
+        self.features = np.array(meta["features"])
+        self.pi_set = pi_set_from_dict(meta["pi_set"])
+        self.train_score = meta["train_score"]
+        self.val_score = meta["val_score"]
+        self.algo_fi = _array_or_none(meta["algo_fi"])
+        self.perm_fi = _array_or_none(meta["perm_fi"])
+        self.perm_fi_iters = _array_or_none(meta["perm_fi_iters"])
+        self.perm_fi_ci = _array_or_none(meta["perm_fi_ci"])
+        self.val_days = _array_or_none(meta["val_days"])
+        self.seed = meta["seed"]
+
+
+def _array_or_none(values) -> Union[np.ndarray, None]:
+    return None if values is None else np.asarray(values)
+
+
+def _list_or_none(arr) -> Union[List, None]:
+    return None if arr is None else np.asarray(arr).tolist()
+
+
+def pi_set_to_dict(s: PiSet) -> Dict:
+    """ JSON-serializable Pi set with sympy expressions as ``srepr`` strings """
+    return {
+        "id": s.id,
+        "feature_exprs": [sp.srepr(pi) for pi in s.feature_exprs],
+        "target_id": s.target_id,
+        "target_expr": sp.srepr(s.target_expr),
+        "target_inv_expr": sp.srepr(s.target_inv_expr),
+    }
+
+
+def pi_set_from_dict(d: Dict) -> PiSet:
+    """ Pi set from ``pi_set_to_dict`` """
+    return PiSet(
+        id=d["id"],
+        feature_exprs=[sp.parse_expr(pi) for pi in d["feature_exprs"]],
+        target_id=d["target_id"],
+        target_expr=sp.parse_expr(d["target_expr"]),
+        target_inv_expr=sp.parse_expr(d["target_inv_expr"]),
+    )
+
+
+def _save_estimator(estimator, path: pathlib.Path) -> pathlib.Path:
+    """ Save estimator in native format if available. Returns path of model file including suffix. """
+    try:
+        import xgboost as xgb
+        if isinstance(estimator, xgb.XGBModel):
+            path = path.with_suffix(".ubj")
+            estimator.get_booster().save_model(str(path))
+            return path
+    except ImportError:
+        pass
+    try:
+        import lightgbm as lgb
+        if isinstance(estimator, lgb.LGBMModel):
+            path = path.with_suffix(".txt")
+            estimator.booster_.save_model(str(path))
+            return path
+    except ImportError:
+        pass
+    path = path.with_suffix(".joblib")
+    joblib.dump(estimator, path)
+    return path
+
+
+def member_path(path: Union[str, pathlib.Path], i: int) -> pathlib.Path:
+    """ Metadata file of member `i` (starting at 1) in export directory `path` """
+    return pathlib.Path(path) / f"member_{i:03d}.json"
+
+
+def export_member(exp, path: Union[str, pathlib.Path], i: int, days: np.ndarray = None) -> pathlib.Path:
+    """ Export ensemble member `i` (starting at 1, ``Experiment``) to directory `path`.
+    `days` (day of year of each training sample) are used to record the validation days of the member.
+    Metadata are written last and atomically, so an export is complete once its metadata file exists.
+    """
+    path = pathlib.Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    model_path = _save_estimator(exp.model.model.estimator, path / f"member_{i:03d}")
+    val_days = None
+    if days is not None and exp.val_idx is not None:
+        val_days = np.unique(np.asarray(days)[exp.val_idx])
+
+    meta = {
+        "member": i,
+        "estimator": exp.model.best_estimator,
+        "best_config": exp.model.best_config,
+        "model_file": model_path.name,
+        "model_format": MODEL_FORMATS[model_path.suffix],
+        "target": exp.target,
+        "features": _list_or_none(exp.features),
+        "pi_set": pi_set_to_dict(exp.pi_set),
+        "train_score": float(exp.train_score),
+        "val_score": float(exp.val_score),
+        "algo_fi": _list_or_none(exp.algo_fi),
+        "perm_fi": _list_or_none(exp.perm_fi),
+        "perm_fi_iters": _list_or_none(getattr(exp, "perm_fi_iters", None)),
+        "perm_fi_ci": _list_or_none(getattr(exp, "perm_fi_ci", None)),
+        "val_days": _list_or_none(val_days),
+        "seed": exp.config.flaml.seed,
+    }
+    meta_path = member_path(path, i)
+    tmp_path = meta_path.with_name(f".{meta_path.name}")
+    tmp_path.write_text(json.dumps(meta, indent=2))
+    os.replace(tmp_path, meta_path)
+    return meta_path
+
+
+def load_member(meta_path: Union[str, pathlib.Path]) -> SlimMember:
+    meta_path = pathlib.Path(meta_path)
+    meta = json.loads(meta_path.read_text())
+    return SlimMember(meta, SlimModel(meta_path.parent / meta["model_file"], meta["model_format"]))
+
+
+class SlimEnsemble(Sequence):
+    """ Exported members in directory `path` ordered by member number. Members are loaded on access. """
+
+    def __init__(self, path: Union[str, pathlib.Path]):
+        self.path = pathlib.Path(path)
+        self._meta_paths = sorted(self.path.glob(MEMBER_PATTERN))
+
+    def __len__(self) -> int:
+        return len(self._meta_paths)
+
+    def __getitem__(self, i: int) -> SlimMember:
+        return load_member(self._meta_paths[i])
+
+
+def load_slim_ensemble(path: Union[str, pathlib.Path]) -> List[SlimMember]:
+    """ Load all exported members in directory `path` ordered by member number """
+    return list(SlimEnsemble(path))
+
+
+def slim_dir(ensemble_dir: Union[str, pathlib.Path]) -> pathlib.Path:
+    """ Export directory next to the ``LazyArray`` directory of full members """
+    return pathlib.Path(ensemble_dir).parent / "ensemble_slim"
+
+
+def export_ensemble(la: LazyArray, days: np.ndarray = None) -> int:
+    """ Export all members of `la` not exported yet. Returns number of exported members. """
+    path = slim_dir(la.output_dir)
+    n_exported = 0
+    for i in range(len(la)):
+        if not member_path(path, i + 1).exists():
+            export_member(la[i], path, i + 1, days=days)
+            n_exported += 1
+    return n_exported
+
+
+def open_ensemble(ensemble_dir: Union[str, pathlib.Path]) -> Union[SlimEnsemble, LazyArray]:
+    """ Members of ensemble in `ensemble_dir` (``LazyArray`` directory), loaded one by one on access. The slim export
+    is used if it covers all members. Otherwise, the full ``Experiment`` members are unpickled.
+    """
+    ensemble_dir = pathlib.Path(ensemble_dir)
+    slim = SlimEnsemble(slim_dir(ensemble_dir))
+    if not ensemble_dir.is_dir():
+        return slim
+
+    la = LazyArray(ensemble_dir, overwrite=False)
+    if len(slim) >= len(la):
+        return slim
+    return la
+
+
+def load_ensemble(ensemble_dir: Union[str, pathlib.Path]) -> List:
+    """ Load all members of ensemble in `ensemble_dir` (see ``open_ensemble``) """
+    return list(open_ensemble(ensemble_dir))
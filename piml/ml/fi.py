@@ -1,9 +1,82 @@
+from typing import Callable, Sequence, Union, Tuple
+
 import joblib
 import numpy as np
+from scipy import stats
+
+from piml.utils.memmap import MemmapArray, shared_tmp_dir, remove_tmp_dir
+
+BACKENDS = ("threads", "processes")
+
+
+def stratified_subsample(groups: np.ndarray, frac: float, random_state=None) -> np.ndarray:
+    """ Sorted indices of a random fraction `frac` of the samples of each group (e.g., day), at least one per group """
+    groups = np.asarray(groups)
+    rng = np.random.default_rng(seed=random_state)
+    order = np.lexsort((rng.random(len(groups)), groups))
+    _, start, counts = np.unique(groups[order], return_index=True, return_counts=True)
+
+    # Position of each sample within its (shuffled) group
+    pos = np.arange(len(groups)) - np.repeat(start, counts)
+    n_keep = np.repeat(np.maximum(np.ceil(frac * counts), 1), counts)
+    return np.sort(order[pos < n_keep])
+
+
+def ci_width(rel_scores: np.ndarray, confidence: float = 0.95) -> float:
+    """ Width of the confidence interval of the mean of `rel_scores` (Student's t) """
+    n = len(rel_scores)
+    if n < 2:
+        return np.inf
+    return 2 * stats.t.ppf((1 + confidence) / 2, n - 1) * np.std(rel_scores, ddof=1) / np.sqrt(n)
+
+
+def _shuffled_scores(est, X: Union[np.ndarray, MemmapArray], y: Union[np.ndarray, MemmapArray],
+                     features: Sequence[int], seeds: Sequence[np.random.SeedSequence], iters: int, batch_size: int,
+                     score_ref: float, tol: float = None, min_iters: int = 3, confidence: float = 0.95,
+                     scoring: Callable = None, **score_kwargs) -> np.ndarray:
+    """ Average score after shuffling each of `features` (one worker). Returns array of shape (features, 3) with
+    average score, number of shuffles and confidence interval width of the relative score.
+
+    The worker owns a scratch buffer with `batch_size` stacked copies of `X`. Per batch, only the shuffled column is
+    overwritten in each copy and all copies are predicted at once. The column is restored before the next feature.
+    With `tol`, shuffling of a feature stops early once the confidence interval is narrower than `tol`.
+    """
+    if isinstance(X, MemmapArray):
+        X, y = X.array, y.array
+    n = len(X)
+    X_batch = np.tile(X, (batch_size, 1))
+
+    results = np.empty((len(features), 3))
+    for j, (p_i, seed) in enumerate(zip(features, seeds)):
+        rng = np.random.default_rng(seed)
+        scores = []
+        while len(scores) < iters:
+            b = min(batch_size, iters - len(scores))
+            for k in range(b):
+                X_batch[k * n:(k + 1) * n, p_i] = rng.permutation(X[:, p_i])
+
+            if scoring is None:
+                scores += [est.score(X_batch[k * n:(k + 1) * n], y, **score_kwargs) for k in range(b)]
+            else:
+                y_pred = est.predict(X_batch[:b * n])
+                scores += [scoring(y, y_pred[k * n:(k + 1) * n], **score_kwargs) for k in range(b)]
+
+            width = ci_width(np.array(scores) / score_ref, confidence)
+            if tol is not None and len(scores) >= min_iters and width < tol:
+                break
+
+        X_batch[:, p_i] = np.tile(X[:, p_i], batch_size)
+        results[j] = np.mean(scores), len(scores), width
+    return results
 
 
 def get_permutation_importance(est, X, y, iters: int = 25, random_state: int = None, n_jobs: int = None,
-                               lower_is_better: bool = True, **score_kwargs) -> np.ndarray:
+                               lower_is_better: bool = True, scoring: Callable = None, batch_size: int = None,
+                               max_batch_bytes: int = None,
+                               backend: str = "threads", tmp_dir: str = None, tol: float = None, min_iters: int = 3,
+                               confidence: float = 0.95, sample_frac: float = None, groups: np.ndarray = None,
+                               return_stats: bool = False,
+                               **score_kwargs) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
     """ Compute feature importance based on permutation
 
     Parameters
@@ -15,43 +88,101 @@ def get_permutation_importance(est, X, y, iters: int = 25, random_state: int = N
     y : array-like
         Target data
     iters : int
-        Number of permutation iterations per feature
+        Number of permutation iterations per feature (maximum number if `tol` is given)
     random_state : int
-        Set to integer for reproducibility.
+        Set to integer for reproducibility. Each feature gets its own random stream derived from it, so results do not
+        depend on `n_jobs` or `backend`.
     n_jobs : int
-        Number of parallel jobs to run. If None, all CPUs are used.
+        Number of parallel jobs to run (joblib semantics, i.e., -1 uses all CPUs). Features are split evenly between
+        jobs.
     lower_is_better : bool
         Whether lower scores are better. If True, the relative score will be > 1 for important features.
+    scoring : callable
+        Score function `scoring(y_true, y_pred, **score_kwargs)` equivalent to `est.score`. If given, several
+        permutations are predicted in one `est.predict` call. Otherwise, `est.score` is called per permutation.
+    batch_size : int
+        Number of permutations predicted at once with `scoring`. Each job holds `batch_size` copies of `X` (default: 1).
+    max_batch_bytes : int
+        Opt-in batching if `batch_size` is not given: as many permutations per batch as the copies of all jobs
+        together fit into `max_batch_bytes`. Without `scoring`, permutations are scored one by one anyway, so no
+        batching is done.
+    backend : str
+        "threads" or "processes". Processes share `X` through a memory-mapped file in `tmp_dir` (default: `/dev/shm`).
+    tol : float
+        Adaptive mode: stop shuffling a feature after at least `min_iters` iterations once the `confidence` interval
+        of its relative score is narrower than `tol`. Uninformative and dominant features typically converge fast.
+    sample_frac : float
+        Evaluate on this fraction of samples. With `groups` (e.g., days), the fraction is drawn from every group.
+    return_stats : bool
+        If True, also return number of iterations and confidence interval width of each feature.
     """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}. Has to be one of {BACKENDS}.")
+
+    X, y = np.asarray(X), np.asarray(y)
     n, p = X.shape
 
-    # Reproducible numpy randomness
-    rng = np.random.default_rng(seed=random_state)
+    # Reproducible numpy randomness with independent stream per feature (and one for subsampling)
+    seeds = np.random.SeedSequence(random_state).spawn(p + 1)
+    if sample_frac is not None:
+        groups = np.zeros(n) if groups is None else np.asarray(groups)
+        idx = stratified_subsample(groups, sample_frac, random_state=seeds[-1])
+        X, y = X[idx], y[idx]
+
+    n_workers = max(min(joblib.effective_n_jobs(n_jobs), p), 1)
+    if scoring is None:
+        batch_size = 1
+    elif batch_size is None:
+        # Budget is shared by all jobs, each of which holds its own batch
+        batch_size = 1 if max_batch_bytes is None else max_batch_bytes // max(n_workers * X.nbytes, 1)
+        if tol is not None:
+            # Check for convergence after few iterations
+            batch_size = min(batch_size, min_iters)
+    batch_size = int(np.clip(batch_size, 1, iters))
 
     # Reference score
-    score_ref = est.score(X, y, **score_kwargs)
-
-    def get_feature_fi(p_i: int) -> float:
-        score = 0.
-        for _ in range(iters):
-            X_i_shuff = np.copy(X)
-            X_i_shuff[:, p_i] = rng.permutation(X_i_shuff[:, p_i])
-            score_shuff = est.score(X_i_shuff, y, **score_kwargs)
-            score += score_shuff
-        return score / iters
-
-    # Randomly shuffle each feature and make prediction and compute score
-    scores_avg = joblib.Parallel(n_jobs=n_jobs)(
-        joblib.delayed(get_feature_fi)(p_i) for p_i in range(p)
-    )
-    scores_avg = np.array(scores_avg)
+    if scoring is None:
+        score_ref = est.score(X, y, **score_kwargs)
+    else:
+        score_ref = scoring(y, est.predict(X), **score_kwargs)
+
+    # Randomly shuffle each feature and make prediction and compute score. Each job handles a block of features.
+    blocks = np.array_split(np.arange(p), n_workers)
+    kwargs = dict(iters=iters, batch_size=batch_size, score_ref=score_ref, tol=tol, min_iters=min_iters,
+                  confidence=confidence, scoring=scoring, **score_kwargs)
+    if n_workers == 1:
+        scores_avg = _shuffled_scores(est, X, y, range(p), seeds, **kwargs)
+    elif backend == "threads":
+        scores_avg = joblib.Parallel(n_jobs=n_workers, backend="threading")(
+            joblib.delayed(_shuffled_scores)(est, X, y, block, [seeds[i] for i in block], **kwargs)
+            for block in blocks
+        )
+        scores_avg = np.concatenate(scores_avg)
+    else:
+        tmp_path = shared_tmp_dir(tmp_dir)
+        try:
+            X_shared = MemmapArray.from_array(X, tmp_path / "X.npy")
+            y_shared = MemmapArray.from_array(y, tmp_path / "y.npy")
+            scores_avg = joblib.Parallel(n_jobs=n_workers, backend="loky")(
+                joblib.delayed(_shuffled_scores)(est, X_shared, y_shared, block, [seeds[i] for i in block], **kwargs)
+                for block in blocks
+            )
+        finally:
+            remove_tmp_dir(tmp_path)
+        scores_avg = np.concatenate(scores_avg)
+
+    scores_avg, n_iters, ci_widths = scores_avg.T
 
     # Make average of collected shuffled scores relative to reference score
     scores_avg = scores_avg / score_ref
 
     if lower_is_better:
         # If lower is better, relative scores_avg will be > 1 for important features
-        return scores_avg - 1
+        fi = scores_avg - 1
     else:
         # If higher is better, relative scores_avg will be < 1 for important features
-        return 1 - scores_avg
+        fi = 1 - scores_avg
+
+    if return_stats:
+        return fi, n_iters.astype(int), ci_widths
+    return fi
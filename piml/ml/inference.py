@@ -0,0 +1,96 @@
+"""
+Batched inference of ensembles.
+
+``EnsemblePredictor`` holds the native estimators of all members (without FLAML wrappers) and predicts the full
+(members, samples) matrix in a single call. Rows are split into chunks and all (member, chunk) pairs are evaluated by a
+pool of threads. XGBoost and LightGBM release the GIL during prediction, so the run time is bounded by tree traversal.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Sequence, Union
+
+import numpy as np
+
+from piml.utils.lazy_array import LazyArray
+
+
+def native_estimator(member):
+    """ Native estimator of ensemble member (``Experiment`` or ``SlimMember``): XGBoost/LightGBM booster if available,
+    otherwise the estimator itself.
+    """
+    model = member.model
+    if hasattr(model, "model"):
+        # flaml.AutoML wraps the best estimator twice
+        model = model.model
+    estimator = model.estimator
+    if hasattr(estimator, "get_booster"):
+        return estimator.get_booster()
+    if hasattr(estimator, "booster_"):
+        return estimator.booster_
+    return estimator
+
+
+class EnsemblePredictor:
+    """ Predict all members of an ensemble at once """
+
+    def __init__(self, estimators: Sequence, chunk_size: int = 2 ** 16, n_jobs: int = -1):
+        self.estimators = list(estimators)
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+
+        # Boosters are evaluated by one thread each. Parallelism comes from evaluating several chunks at once.
+        # XGBoost's `inplace_predict` has no thread argument, so the setting is changed on a copy of the booster to
+        # leave the caller's booster unchanged. LightGBM gets the number of threads per call.
+        self._kinds = [type(est).__module__.split(".")[0] for est in self.estimators]
+        for i, kind in enumerate(self._kinds):
+            if kind == "xgboost":
+                self.estimators[i] = self.estimators[i].copy()
+                self.estimators[i].set_param({"nthread": 1})
+
+    @classmethod
+    def from_members(cls, members: Union[LazyArray, Sequence], **kwargs) -> "EnsemblePredictor":
+        """ Extract estimators of members (``Experiment`` or ``SlimMember``). Members of ``LazyArray`` are loaded one by
+        one, so only the estimators are kept in memory.
+        """
+        return cls([native_estimator(m) for m in members], **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.estimators)
+
+    def _predict_one(self, i: int, X: np.ndarray) -> np.ndarray:
+        est, kind = self.estimators[i], self._kinds[i]
+        if kind == "xgboost":
+            return est.inplace_predict(X)
+        if kind == "lightgbm":
+            return est.predict(X, num_threads=1)
+        return est.predict(X)
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """ Predictions of all members as array of shape (members, samples) """
+        X = np.ascontiguousarray(X)
+        n = len(X)
+        y_pred = np.empty((len(self), n))
+        chunks = [slice(start, min(start + self.chunk_size, n)) for start in range(0, n, self.chunk_size)]
+
+        # XGBoost works on float32 internally, so convert only once for all members
+        X_xgb = X.astype(np.float32) if "xgboost" in self._kinds else None
+
+        def predict_chunk(i: int, rows: slice) -> None:
+            X_i = X_xgb if self._kinds[i] == "xgboost" else X
+            y_pred[i, rows] = self._predict_one(i, X_i[rows])
+
+        n_workers = os.cpu_count() if self.n_jobs is None or self.n_jobs < 0 else self.n_jobs
+        tasks = [(i, rows) for i in range(len(self)) for rows in chunks]
+        if n_workers <= 1 or len(tasks) <= 1:
+            for i, rows in tasks:
+                predict_chunk(i, rows)
+        else:
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                # Raise errors of workers
+                list(executor.map(lambda task: predict_chunk(*task), tasks))
+        return y_pred
+
+
+def predict_ensemble(members: Union[LazyArray, Sequence], X: np.ndarray, **kwargs) -> np.ndarray:
+    """ Predictions of all members as array of shape (members, samples) """
+    return EnsemblePredictor.from_members(members, **kwargs).predict(X)
@@ -0,0 +1,133 @@
+"""
+Workspace-wide knowledge base of the best hyperparameter configurations found by FLAML.
+
+Configurations are stored in a SQLite file together with their loss and are indexed by estimator, Pi target, number of
+features and a fingerprint of the training data. Later ensembles (also of other Pi sets and runs) query the most similar
+entries and use them as FLAML starting points. SQLite handles concurrent writers of several processes on one machine
+(write-ahead log, busy timeout). Note that file locking is unreliable on some network file systems.
+"""
+import contextlib
+import json
+import pathlib
+import sqlite3
+import time
+from typing import Dict, List, Union, Iterable, Iterator
+
+import piml
+from piml.ml import Experiment
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS configs (
+    estimator TEXT NOT NULL,
+    target_id TEXT NOT NULL,
+    n_features INTEGER NOT NULL,
+    data_fingerprint TEXT NOT NULL,
+    pi_set_id INTEGER NOT NULL,
+    member INTEGER NOT NULL,
+    config TEXT NOT NULL,
+    loss REAL NOT NULL,
+    created REAL NOT NULL,
+    UNIQUE (estimator, target_id, n_features, data_fingerprint, pi_set_id, member, config)
+);
+CREATE INDEX IF NOT EXISTS configs_key ON configs (estimator, target_id, n_features, data_fingerprint);
+"""
+
+
+class HPOKnowledgeBase:
+    """ SQLite store of best FLAML configurations and their losses. """
+
+    def __init__(self, path: Union[str, pathlib.Path], timeout: float = 60.):
+        self.path = pathlib.Path(path)
+        self.timeout = timeout
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @classmethod
+    def from_workspace(cls, ws: piml.Workspace, **kwargs) -> "HPOKnowledgeBase":
+        """ Knowledge base located in `5_trained/hpo_knowledge.sqlite` """
+        return cls(ws.data_trained / "hpo_knowledge.sqlite", **kwargs)
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """ Connection, which commits on success (rolls back on error) and is closed afterwards. """
+        conn = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add(self, estimator: str, target_id: str, n_features: int, data_fingerprint: str, pi_set_id: int,
+            member: int, config: Dict, loss: float) -> None:
+        self.add_many([(estimator, target_id, n_features, data_fingerprint, pi_set_id, member, config, loss)])
+
+    def add_many(self, rows: Iterable[tuple]) -> None:
+        """ Add rows of (estimator, target_id, n_features, data_fingerprint, pi_set_id, member, config, loss) in one
+        transaction. Rows already in the knowledge base are ignored.
+        """
+        now = time.time()
+        rows = [(*row[:6], json.dumps(row[6], sort_keys=True), float(row[7]), now) for row in rows]
+        with self._connect() as conn:
+            conn.executemany("INSERT OR IGNORE INTO configs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def add_experiment(self, exp: Experiment, member: int, data_fingerprint: str) -> None:
+        """ Add best configuration of each estimator searched for ensemble member `exp` """
+        losses = exp.model.best_loss_per_estimator
+        self.add_many([
+            (est, exp.target, len(exp.features), data_fingerprint, exp.pi_set.id, member, config, losses[est])
+            for est, config in exp.model.best_config_per_estimator.items()
+            if config is not None
+        ])
+
+    def query(self, estimator: str, target_id: str, n_features: int, data_fingerprint: str,
+              k: int = 3) -> List[Dict]:
+        """ Up to `k` distinct configurations of `estimator` for the most similar setting.
+        Entries are ranked by similarity (same data, target and number of features first, then relaxing data,
+        target, and number of features) and then by loss.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT config, MIN(loss) AS best_loss,
+                       MAX((data_fingerprint = ?) + 2 * (target_id = ?) + 4 * (n_features = ?)) AS similarity
+                FROM configs WHERE estimator = ?
+                GROUP BY config
+                ORDER BY similarity DESC, best_loss ASC
+                LIMIT ?
+                """,
+                (data_fingerprint, target_id, n_features, estimator, k)
+            ).fetchall()
+        return [json.loads(config) for config, _, _ in rows]
+
+    def starting_points(self, estimators: List[str], target_id: str, n_features: int, data_fingerprint: str,
+                        k: int = 3) -> Dict[str, List[Dict]]:
+        """ FLAML `starting_points` for all `estimators` found in the knowledge base """
+        points = {est: self.query(est, target_id, n_features, data_fingerprint, k=k) for est in estimators}
+        return {est: configs for est, configs in points.items() if configs}
+
+    def prune(self, max_per_key: int = 20) -> int:
+        """ Keep only the `max_per_key` best entries per estimator, target, number of features and data.
+        Returns number of removed entries.
+        """
+        with self._connect() as conn:
+            n = conn.execute(
+                """
+                DELETE FROM configs WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid, ROW_NUMBER() OVER (
+                            PARTITION BY estimator, target_id, n_features, data_fingerprint ORDER BY loss
+                        ) AS rank FROM configs
+                    ) WHERE rank > ?
+                )
+                """,
+                (max_per_key,)
+            ).rowcount
+        with self._connect() as conn:
+            conn.execute("VACUUM")
+        return n
+
+    def __len__(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM configs").fetchone()[0]
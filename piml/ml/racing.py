@@ -0,0 +1,90 @@
+"""
+Successive-halving racing of Pi sets: train all sets with few members and a small budget, drop the worst sets, and
+continue with more members and budget until the remaining sets reach the full ensemble size.
+
+Ensembles of eliminated sets keep their members but are marked by ``racing_eliminated.json`` next to the ensemble,
+so that the evaluation (step 5) skips them.
+"""
+from __future__ import annotations
+
+import copy
+import json
+import math
+import pathlib
+from typing import List, Tuple, Dict, Sequence, Union, TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_squared_error
+
+from piml.ml.transform import DimToPiTransformer
+
+if TYPE_CHECKING:
+    from piml.ml import Experiment
+
+ELIMINATED_FILE = "racing_eliminated.json"
+
+
+def halving_schedule(n_members: int, time_budget: int, eta: int = 2,
+                     min_members: int = 2) -> List[Tuple[int, int]]:
+    """ Number of members and FLAML time budget (in seconds) of each round.
+    Members grow by factor `eta` per round until `n_members` is reached. Budget grows by the same factor and reaches
+    `time_budget` in the last round.
+    """
+    members = [min(min_members, n_members)]
+    while members[-1] < n_members:
+        members.append(min(members[-1] * eta, n_members))
+
+    n_rounds = len(members)
+    return [
+        (m, max(int(round(time_budget / eta ** (n_rounds - 1 - r))), 1))
+        for r, m in enumerate(members)
+    ]
+
+
+def select_survivors(scores: Dict[int, float], eta: int = 2) -> List[int]:
+    """ Ids of the best `1 / eta` fraction (at least one) of sets according to `scores` (lower is better). """
+    n_keep = max(math.ceil(len(scores) / eta), 1)
+    return sorted(scores, key=lambda k: scores[k])[:n_keep]
+
+
+def member_scores(ensemble: Sequence[Experiment], dim_to_pi_tf: DimToPiTransformer,
+                  df_train: pd.DataFrame) -> np.ndarray:
+    """ RMSE of log10 dimensional target on validation days of each member.
+    Scores are computed in dimensional space, so that sets with different Pi targets are comparable.
+    `dim_to_pi_tf` has to be fitted on the dimensional data `df_train` was derived from. Each member only predicts
+    and inverse-transforms its own validation rows.
+    """
+    df_dim = dim_to_pi_tf.df_dim_
+    log_y_dim = np.log10(df_dim[dim_to_pi_tf.dim_target].to_numpy())
+
+    # Copies, so that the fitted data of the caller's transformers are unchanged
+    val_tf = copy.copy(dim_to_pi_tf)
+    val_tf.pi_target_tf = copy.copy(dim_to_pi_tf.pi_target_tf)
+
+    scores = []
+    for exp in ensemble:
+        rows = np.arange(len(df_train))[exp.val_idx]
+        y_pi_pred = exp.model.predict(df_train[exp.features].iloc[rows].to_numpy())
+        y_dim_pred = val_tf.fit(df_dim=df_dim.iloc[rows]).inverse_transform_y_ensemble(y_pi_pred)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_y_dim_pred = np.log10(y_dim_pred)
+        if not np.all(np.isfinite(log_y_dim_pred)):
+            scores.append(np.inf)
+        else:
+            scores.append(np.sqrt(mean_squared_error(log_y_dim[rows], log_y_dim_pred)))
+    return np.array(scores)
+
+
+def mark_eliminated(path: Union[str, pathlib.Path], i_round: int, rmse: float) -> None:
+    """ Mark ensemble in directory `path` (next to ``ensemble``) as eliminated in round `i_round` """
+    (pathlib.Path(path) / ELIMINATED_FILE).write_text(json.dumps({"round": i_round, "rmse": rmse}))
+
+
+def clear_eliminated(path: Union[str, pathlib.Path]) -> None:
+    """ Remove elimination mark, e.g., if ensemble is trained again """
+    (pathlib.Path(path) / ELIMINATED_FILE).unlink(missing_ok=True)
+
+
+def is_eliminated(path: Union[str, pathlib.Path]) -> bool:
+    return (pathlib.Path(path) / ELIMINATED_FILE).exists()
@@ -0,0 +1,131 @@
+"""
+Headless evaluation report of all trained ensembles.
+
+Ensembles are evaluated by a pool of processes. Each worker writes metrics and figures of its ensemble to ``report/``
+next to the ensemble using matplotlib's object-oriented API (no GUI backend needed) and returns only the scores. The
+overview of all ensembles (RMSE and complexity) is built from the collected scores afterwards.
+"""
+import functools
+import os
+import pathlib
+from typing import Dict, List, Sequence, Union
+
+import joblib
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from matplotlib.figure import Figure
+
+import piml
+from piml.ml.evaluation import EnsembleEvaluation, cached_evaluate_ensemble
+from piml.pi.group import PiGroupSet
+
+REPORT_DIR = "report"
+REPORT_FILES = ("scores.csv", "predictions.png", "perm_fi.png")
+
+
+@functools.lru_cache(maxsize=1)
+def read_test_data(path: Union[str, pathlib.Path]) -> pd.DataFrame:
+    """ Dimensional test data. Cached, so that each worker reads the file only once. """
+    return pd.read_csv(path, parse_dates=["TIME"])
+
+
+def report_dir(ensemble_dir: Union[str, pathlib.Path]) -> pathlib.Path:
+    """ Report directory next to the ``LazyArray`` directory of the ensemble """
+    return pathlib.Path(ensemble_dir).parent / REPORT_DIR
+
+
+def plot_predictions(evaluation: EnsembleEvaluation, df_dim_test: pd.DataFrame) -> Figure:
+    """ Predictions of all members (gray) and observations (red) over time """
+    fig = Figure()
+    ax = fig.subplots()
+    ax.plot(df_dim_test["TIME"], np.asarray(evaluation.y_dim_pred).T, color="gray", alpha=0.5)
+    ax.plot(df_dim_test["TIME"], df_dim_test[evaluation.dim_target], color="red", linewidth=.75)
+    ax.set_ylabel(evaluation.dim_target)
+    ax.set_yscale("log")
+    ax.set_title(f"Set {evaluation.pi_set.id}")
+    return fig
+
+
+def plot_feature_importance(evaluation: EnsembleEvaluation) -> Figure:
+    """ Permutation feature importance of all members """
+    perm_fi_df = pd.DataFrame(
+        data=evaluation.perm_fi, columns=evaluation.features
+    ).melt(var_name="feature", value_name="perm_fi")
+
+    fig = Figure()
+    ax = fig.subplots()
+    sns.boxplot(perm_fi_df, x="feature", y="perm_fi", ax=ax)
+    ax.set_title(f"Set {evaluation.pi_set.id}")
+    return fig
+
+
+def report_ensemble(ws: piml.Workspace, ensemble_dir: Union[str, pathlib.Path], test_path: Union[str, pathlib.Path],
+                    test_fingerprint: str, **kwargs) -> Dict:
+    """ Evaluate ensemble (see ``cached_evaluate_ensemble`` for `kwargs`) and write member scores and figures to its
+    report directory. Files are only written again if the evaluation changed or files are missing.
+    Returns Pi set, scores and whether the evaluation was cached.
+    """
+    df_dim_test = read_test_data(test_path)
+    evaluation, is_cached = cached_evaluate_ensemble(ws, ensemble_dir, df_dim_test, test_fingerprint=test_fingerprint,
+                                                     **kwargs)
+
+    out_dir = report_dir(ensemble_dir)
+    if not is_cached or not all((out_dir / f).exists() for f in REPORT_FILES):
+        out_dir.mkdir(exist_ok=True)
+        pd.DataFrame({
+            "member": np.arange(1, len(evaluation.scores) + 1),
+            "r2": evaluation.scores[:, 0],
+            "rmse": evaluation.scores[:, 1],
+        }).to_csv(out_dir / "scores.csv", index=False)
+        plot_predictions(evaluation, df_dim_test).savefig(out_dir / "predictions.png", dpi=150)
+        plot_feature_importance(evaluation).savefig(out_dir / "perm_fi.png", dpi=150)
+
+    return {"pi_set": evaluation.pi_set, "scores": np.asarray(evaluation.scores), "is_cached": is_cached}
+
+
+def _report_ensemble(ws_root: pathlib.Path, ensemble_dir: pathlib.Path, *args, **kwargs) -> Dict:
+    """ Worker entry point. Workspace is opened again, because custom code cannot be pickled. """
+    return report_ensemble(piml.Workspace(ws_root), ensemble_dir, *args, **kwargs)
+
+
+def report_ensembles(ws: piml.Workspace, ensembles: Sequence[pathlib.Path], test_path: Union[str, pathlib.Path],
+                     n_jobs: int = -1, **kwargs) -> List[Dict]:
+    """ Report all `ensembles` with `n_jobs` processes (see ``report_ensemble``). CPUs are split evenly between
+    processes for the predictions. Results are returned in the order of `ensembles`.
+    """
+    test_fingerprint = joblib.hash(read_test_data(test_path))
+    n_workers = max(min(joblib.effective_n_jobs(n_jobs), len(ensembles)), 1)
+    n_threads = max((os.cpu_count() or 1) // n_workers, 1)
+    print(f"Evaluating {len(ensembles)} ensembles with {n_workers} processes ({n_threads} threads each).")
+
+    return joblib.Parallel(n_jobs=n_workers, verbose=5)(
+        joblib.delayed(_report_ensemble)(ws.root, ens_path, test_path, test_fingerprint, n_jobs=n_threads, **kwargs)
+        for ens_path in ensembles
+    )
+
+
+def plot_overview(ws: piml.Workspace, pi_sets: Sequence[piml.PiSet], ens_scores: Sequence[np.ndarray],
+                  fig: Figure = None) -> Figure:
+    """ RMSE of all members of each set (ensembles may differ in size) next to complexity of the set, i.e., number
+    of dimensional variables in each group. Draws into `fig` if given (e.g., from ``plt.figure`` to show it).
+    """
+    df_ens_scores = pd.concat([
+        pd.DataFrame({"Set": f"Set {s.id}", "RMSE": scores[:, 1]})
+        for s, scores in zip(pi_sets, ens_scores)
+    ])
+
+    cache = {}
+    complexity = np.array([
+        PiGroupSet.from_sympy(s.all_exprs, ws.config.dim_vars.all_strs, cache=cache).complexity
+        for s in pi_sets
+    ])
+
+    if fig is None:
+        fig = Figure(figsize=(10, 5))
+    ax_box, ax_complexity = fig.subplots(ncols=2)
+    sns.boxplot(data=df_ens_scores, x="RMSE", y="Set", ax=ax_box)
+    # Heatmap cells are centered at 0.5, 1.5, ..., so label rows explicitly instead of sharing the y-axis
+    sns.heatmap(complexity, yticklabels=[f"Set {s.id}" for s in pi_sets], ax=ax_complexity)
+    ax_complexity.set_xlabel("Group")
+    return fig
@@ -0,0 +1,99 @@
+"""
+Cheap screening of Pi sets before the expensive ensemble training.
+
+Every set is scored with a histogram gradient boosting model with fixed hyperparameters on a subsample of days.
+Predictions are obtained by day-blocked cross-validation and scored in dimensional space (RMSE of log10 target), so
+that sets with different Pi targets are comparable.
+"""
+import pathlib
+from typing import Sequence, Set, Dict
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.metrics import mean_squared_error
+from sklearn.model_selection import GroupKFold, cross_val_predict
+
+import piml
+from piml.ml.transform import DimToPiTransformer
+
+# Fixed hyperparameters of the screening model
+SCREENING_PARAMS = dict(max_iter=100, learning_rate=0.1, max_leaf_nodes=31, early_stopping=False)
+
+
+def sample_days(days_of_year: np.ndarray, frac: float, random_state: int = None) -> np.ndarray:
+    """ Indices of all samples of a random fraction `frac` of days. Days are kept complete to retain diurnal cycles. """
+    rng = np.random.default_rng(seed=random_state)
+    days = np.unique(days_of_year)
+    n_days = max(int(round(frac * len(days))), 1)
+    selected = rng.choice(days, size=n_days, replace=False)
+    return np.flatnonzero(np.isin(days_of_year, selected))
+
+
+def screen_pi_set(ws: piml.Workspace, s: piml.PiSet, df_dim: pd.DataFrame, n_splits: int = 5,
+                  random_state: int = None) -> Dict:
+    """ Score Pi set `s` on `df_dim` by cross-validated predictions of screening model. Returns row of result table. """
+    dim_to_pi_tf = DimToPiTransformer.from_workspace(ws=ws, pi_set=s)
+    df_pi = dim_to_pi_tf.fit(df_dim=df_dim).transform_X_y()
+    X = df_pi[dim_to_pi_tf.features_].to_numpy()
+    y = df_pi[dim_to_pi_tf.pi_target].to_numpy()
+
+    # Out-of-fold predictions with complete days in validation folds
+    model = HistGradientBoostingRegressor(**SCREENING_PARAMS, random_state=random_state)
+    y_pi_pred = cross_val_predict(model, X, y, groups=df_dim["DAY_YEAR"], cv=GroupKFold(n_splits=n_splits))
+
+    # Score in dimensional space
+    y_dim_pred = np.asarray(dim_to_pi_tf.inverse_transform_y(pd.Series(y_pi_pred, index=df_dim.index)))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_y_dim_pred = np.log10(y_dim_pred)
+    log_y_dim = np.log10(df_dim[dim_to_pi_tf.dim_target].to_numpy())
+    if not np.all(np.isfinite(log_y_dim_pred)):
+        rmse = np.inf
+    else:
+        rmse = np.sqrt(mean_squared_error(log_y_dim, log_y_dim_pred))
+
+    return {"id": s.id, "target_id": s.target_id, "rmse": rmse}
+
+
+def _screen_pi_set(ws_root: pathlib.Path, s: piml.PiSet, df_dim: pd.DataFrame, **kwargs) -> Dict:
+    """ Worker entry point. Workspace is opened again, because custom code cannot be pickled. """
+    try:
+        return screen_pi_set(piml.Workspace(ws_root), s, df_dim, **kwargs)
+    except ValueError as e:
+        print(f"Screening of Pi set {s.id} failed: {e}")
+        return {"id": s.id, "target_id": s.target_id, "rmse": np.inf}
+
+
+def screen_pi_sets(ws: piml.Workspace, pi_sets: Sequence[piml.PiSet], df_dim_train: pd.DataFrame,
+                   frac_days: float = 0.25, n_splits: int = 5, n_jobs: int = -1) -> pd.DataFrame:
+    """ Screen all sets in parallel on the same subsample of days. Returns table sorted by score (best first). """
+    seed = ws.config.flaml.seed
+    idx = sample_days(df_dim_train["DAY_YEAR"].to_numpy(), frac=frac_days, random_state=seed)
+    df_dim = df_dim_train.iloc[idx].reset_index(drop=True)
+    print(f"Screening {len(pi_sets)} Pi sets on {len(df_dim)} samples ({frac_days:.0%} of days).")
+
+    rows = joblib.Parallel(n_jobs=n_jobs, verbose=5)(
+        joblib.delayed(_screen_pi_set)(ws.root, s, df_dim, n_splits=n_splits, random_state=seed) for s in pi_sets
+    )
+    df = pd.DataFrame(rows).sort_values("rmse", kind="stable").reset_index(drop=True)
+    df["rank"] = np.arange(1, len(df) + 1)
+    return df
+
+
+def select_pi_sets(df_screen: pd.DataFrame, top_k: int = None, tolerance: float = None) -> Set[int]:
+    """ Ids of screened sets to train: the `top_k` best and/or those with RMSE within `tolerance` (relative) of the
+    best one. If both are given, sets need to satisfy both criteria.
+    """
+    df = df_screen.sort_values("rmse", kind="stable")
+    is_selected = np.isfinite(df["rmse"].to_numpy())
+    if top_k is not None:
+        is_selected &= np.arange(len(df)) < top_k
+    if tolerance is not None:
+        is_selected &= (df["rmse"] <= df["rmse"].min() * (1 + tolerance)).to_numpy()
+    return set(df["id"].to_numpy()[is_selected].tolist())
+
+
+def screening_path(ws: piml.Workspace) -> pathlib.Path:
+    """ Location of ranked table of screened sets. """
+    return ws.data_train_test / "pi_sets_screening.csv"
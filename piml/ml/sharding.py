@@ -0,0 +1,56 @@
+"""
+Deterministic split of the grid of (Pi set, ensemble member) training tasks into shards, e.g., for HPC job arrays.
+
+Every shard computes the same assignment independently, so shards only need to agree on the list of Pi sets and the
+config. Tasks are balanced by estimated cost using the longest-processing-time-first heuristic.
+"""
+import heapq
+import os
+from typing import List, Tuple, Dict, Sequence, Optional
+
+import piml
+
+
+def shard_from_env() -> Tuple[Optional[int], Optional[int]]:
+    """ Shard index and number of shards from environment variables `PIML_SHARD` and `PIML_NUM_SHARDS`. """
+    shard = os.environ.get("PIML_SHARD")
+    num_shards = os.environ.get("PIML_NUM_SHARDS")
+    if shard is None or num_shards is None:
+        return None, None
+    return int(shard), int(num_shards)
+
+
+def estimate_cost(s: piml.PiSet, time_budget: float, fi_cost_per_feature: float = 1.0) -> float:
+    """ Estimated seconds to train one member of `s`: FLAML time budget plus permutation importance of each feature. """
+    return time_budget + fi_cost_per_feature * len(s.feature_exprs)
+
+
+def assign_shards(costs: Sequence[float], num_shards: int) -> List[int]:
+    """ Shard of each task, greedily assigning the most expensive remaining task to the least loaded shard.
+    Ties are broken by task and shard index, so the assignment is deterministic.
+    """
+    order = sorted(range(len(costs)), key=lambda t: (-costs[t], t))
+    loads = [(0., k) for k in range(num_shards)]
+    shards = [0] * len(costs)
+    for t in order:
+        load, k = heapq.heappop(loads)
+        shards[t] = k
+        heapq.heappush(loads, (load + costs[t], k))
+    return shards
+
+
+def shard_tasks(pi_sets: Sequence[piml.PiSet], n_members: int, time_budget: float, shard: int,
+                num_shards: int) -> Dict[int, List[int]]:
+    """ Members (numbers starting at 1) of each Pi set (by id) to be trained by `shard` of `num_shards`. """
+    if not 0 <= shard < num_shards:
+        raise ValueError(f"Shard {shard} out of range for {num_shards} shards.")
+
+    tasks = [(s.id, i) for s in pi_sets for i in range(1, n_members + 1)]
+    costs = [estimate_cost(s, time_budget) for s in pi_sets for _ in range(n_members)]
+    shards = assign_shards(costs, num_shards)
+
+    members = {}
+    for (set_id, i), k in zip(tasks, shards):
+        if k == shard:
+            members.setdefault(set_id, []).append(i)
+    return members
@@ -1,3 +1,5 @@
+from typing import Iterator, Tuple
+
 import numpy as np
 
 
@@ -7,46 +9,69 @@ class RandomDaysSplitter:
         """
         Split input data `n_splits` times. Each split will draw `n_intervals_per_split` of length `n_days_per_interval`
         from input data. In other words, each split contains `n_intervals` * `n_days` days in total.
+        Intervals are consecutive in the unique days of the data (which can be non-continuous) and do not overlap.
         """
-        # Get number of unique days
-        self.days = np.unique(days_of_year)
-        self.days_idxs = np.arange(len(self.days))
-        self.days_of_year = days_of_year
+        days_of_year = np.asarray(days_of_year)
         self.n_samples = len(days_of_year)
 
-        # Reproducible numpy randomness
-        self.rng = np.random.default_rng(seed=random_state)
+        # Index from days to rows (CSR-style): rows of day `k` are `order[offsets[k]:offsets[k + 1]]`.
+        # Sorting is skipped if the data is already ordered by day (e.g., time series).
+        if np.all(days_of_year[1:] >= days_of_year[:-1]):
+            self.order = None
+            sorted_days = days_of_year
+        else:
+            self.order = np.argsort(days_of_year, kind="stable")
+            sorted_days = days_of_year[self.order]
+        self.days, counts = np.unique(sorted_days, return_counts=True)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
 
         self.n_splits = n_splits
         self.n_intervals = n_intervals_per_split
         self.n_days = n_days_per_interval
+        self.random_state = random_state
 
-    def split(self, X, y=None, groups=None):
-        def get_random_interval() -> np.ndarray:
-            # Draw from day index. Don't draw days directly because they can be non-continuous
-            random_day_idx = self.rng.choice(self.days_idxs[:-self.n_days], size=1)[0]
-            interval_idxs = [random_day_idx + i for i in range(self.n_days)]
-            return self.days[interval_idxs]
+        if self.n_intervals * self.n_days > len(self.days):
+            raise ValueError(f"Cannot draw {self.n_intervals} non-overlapping intervals of {self.n_days} days from "
+                             f"{len(self.days)} days.")
 
-        # Input has to match days of years provided in constructor
-        assert len(X) == self.n_samples
+    def get_n_splits(self, X=None, y=None, groups=None) -> int:
+        return self.n_splits
 
-        # Indices of X
-        X_ind = np.arange(len(X))
+    def _draw_interval_starts(self, rng: np.random.Generator) -> np.ndarray:
+        """ Uniformly draw start day indices of non-overlapping intervals without rejection.
+        Placing `k` intervals of length `L` in `D` days leaves `D - k * L` free days. Choosing `k` of the
+        `D - k * L + k` slots (free days and intervals) for the intervals determines one placement.
+        """
+        n_slots = len(self.days) - self.n_intervals * self.n_days + self.n_intervals
+        slots = np.sort(rng.choice(n_slots, size=self.n_intervals, replace=False))
+        return slots + np.arange(self.n_intervals) * (self.n_days - 1)
 
-        for _ in range(self.n_splits):
-            selected_days = []
-            for _ in range(self.n_intervals):
-                # Draw random interval of length `n_days` and repeat if any of the days in interval was already selected
-                days = get_random_interval()
-                while np.any(np.isin(selected_days, days)):
-                    days = get_random_interval()
-                selected_days += days.tolist()
+    def split_masks(self, X=None, y=None, groups=None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """ Like ``split`` but yields boolean masks of train and test samples, which need 1/8 of the memory of indices.
+        """
+        if X is not None:
+            # Input has to match days of years provided in constructor
+            assert len(X) == self.n_samples
+
+        # Splits only depend on `random_state`, so that repeated calls yield the same splits and the first splits do
+        # not depend on `n_splits`
+        rng = np.random.default_rng(seed=self.random_state)
+        day_counts = np.diff(self.offsets)
 
-            is_selected = np.isin(self.days_of_year, selected_days)
+        for _ in range(self.n_splits):
+            starts = self._draw_interval_starts(rng)
+            is_selected_day = np.zeros(len(self.days), dtype=bool)
+            is_selected_day[(starts[:, np.newaxis] + np.arange(self.n_days)).ravel()] = True
 
-            train = X_ind[~is_selected]
-            test = X_ind[is_selected]
+            is_selected = np.repeat(is_selected_day, day_counts)
+            if self.order is not None:
+                # Back from sorted to original order of rows
+                is_selected_sorted, is_selected = is_selected, np.empty_like(is_selected)
+                is_selected[self.order] = is_selected_sorted
 
-            yield train, test
+            yield ~is_selected, is_selected
 
+    def split(self, X=None, y=None, groups=None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """ Yield indices of train and test samples of each split (sklearn CV splitter interface). """
+        for is_train, is_test in self.split_masks(X, y, groups):
+            yield np.flatnonzero(is_train), np.flatnonzero(is_test)
@@ -1,10 +1,12 @@
 from typing import Protocol
+import numpy as np
 import pandas as pd
 
 import piml
 from piml.config.dataset import DatasetConfig
 from piml.config.dim_vars import DimVarsConfig
 from piml.ml.utils import get_custom_tf
+from piml.pi.store import PiFeatureStore
 from piml.pi.transform import apply_pi_set, PiTargetTransformer
 
 
@@ -36,14 +38,21 @@ class DimToPiTransformer:
     If `pre_pi_tf` is **not** specified, `dim_target` and `dim_target_tf` are the same and
     `y` is directly transformed to Pi space.
 
+    If `store` is specified, Pi features are read from this shared feature store instead. It has to be set up for the
+    same dimensional data which are later passed to `.fit()`.
+    `backend` selects how Pi features and target are evaluated: "numpy" (reference), "numexpr" or "numba" (see
+    ``piml.pi.kernels``). The store is only used by the "numpy" backend.
     """
     def __init__(self, pi_set: piml.PiSet, dim_vars: DimVarsConfig, dataset: DatasetConfig,
-                 pre_pi_tf: InvertableTransformer = None, pre_train_tf: InvertableTransformer = None):
+                 pre_pi_tf: InvertableTransformer = None, pre_train_tf: InvertableTransformer = None,
+                 store: PiFeatureStore = None, backend: str = "numpy"):
         self.pi_set = pi_set
         self.dim_vars = dim_vars
         self.dataset = dataset
         self.pre_pi_tf = pre_pi_tf
         self.pre_train_tf = pre_train_tf
+        self.store = store
+        self.backend = backend
 
         if self.pre_pi_tf:
             # If pre_pi_tf is configured, we expect the dim target to have `_tf` suffix
@@ -57,6 +66,9 @@ class DimToPiTransformer:
         # This is the variable name the regression expects
         self.pi_target = self.pi_set.target_id
 
+        # Compile target transform only once and reuse it for forward and inverse transforms
+        self.pi_target_tf = PiTargetTransformer(pi_set=self.pi_set, dim_vars=self.dim_vars, backend=self.backend)
+
     def fit(self, *, df_dim: pd.DataFrame) -> "DimToPiTransformer":
         """ Provide dimensional data that serve as basis for transform and inverse transform. """
         self.df_dim_ = df_dim.copy()
@@ -65,7 +77,8 @@ class DimToPiTransformer:
     def transform_X(self) -> pd.DataFrame:
         """ Transform dimensional INPUT (X) into Pi space (e.g., for predictions). """
         # Evaluate features/inputs but NOT target.
-        df_X_pi = apply_pi_set(df_dim=self.df_dim_, s=self.pi_set, dim_vars=self.dim_vars, with_y=False)
+        df_X_pi = apply_pi_set(df_dim=self.df_dim_, s=self.pi_set, dim_vars=self.dim_vars, with_y=False,
+                               store=self.store, backend=self.backend)
         df_X_pi["DAY_YEAR"] = self.df_dim_["DAY_YEAR"]  # Retain for ensemble splitting
         self.features_ = df_X_pi.columns[:-1]
         return df_X_pi
@@ -88,9 +101,7 @@ class DimToPiTransformer:
             ], axis=1)
 
         # 2) Transform target from dimensional to Pi/non-dim space
-        y_pi = PiTargetTransformer(
-            pi_set=self.pi_set, dim_vars=self.dim_vars
-        ).fit(
+        y_pi = self.pi_target_tf.fit(
             df_dim=df_dim
         ).transform(
             y_non_log=y_dim
@@ -117,37 +128,41 @@ class DimToPiTransformer:
         """ Inverse-transform TARGET (y) from Pi space to original space (e.g., prediction result).
         All transforms are inverted in reverse order.
         """
-        def to_series(y) -> pd.Series:
-            """ Make sure y is a series after transform. """
-            if not isinstance(y, pd.Series):
-                return pd.Series(y_pi, index=self.df_dim_.index)
-            return y
+        return pd.Series(self.inverse_transform_y_ensemble(np.asarray(y_pi)), index=self.df_dim_.index)
+
+    def inverse_transform_y_ensemble(self, y_pi: np.ndarray) -> np.ndarray:
+        """ Inverse-transform predictions of shape (..., samples), e.g., of all ensemble members (members, samples),
+        from Pi space to original space. Transforms are applied to the whole array at once, which requires the custom
+        transformers to be element-wise (e.g., ``FunctionTransformer``).
+        """
+        y_pi = np.asarray(y_pi, dtype=float)
+
+        def apply_flat(tf_fn, y: np.ndarray) -> np.ndarray:
+            """ Apply transform to all elements as single 1D target and restore shape """
+            return np.asarray(tf_fn(y.ravel())).reshape(y.shape)
 
         # 3) Invert pre-train transform
         if self.pre_train_tf:
             print("Inverting pre-train transform: ", self.pre_train_tf)
-            y_pi = self.pre_train_tf.inverse_transform(y_pi)
-        y_pi = to_series(y_pi)
+            y_pi = apply_flat(self.pre_train_tf.inverse_transform, y_pi)
 
-        # 2) Invert pi set
-        y_dim = PiTargetTransformer(
-            pi_set=self.pi_set, dim_vars=self.dim_vars
-        ).fit(
+        # 2) Invert pi set. The factor of the dimensional inputs is evaluated once and broadcast over all members.
+        y_dim = self.pi_target_tf.fit(
             df_dim=self.df_dim_
-        ).inverse_transform(
+        ).inverse_transform_array(
             y_pi=y_pi
         )
 
         # 1) Invert pre-pi transform
         if self.pre_pi_tf:
             print("Inverting pre-pi transform: ", self.pre_pi_tf)
-            y_dim = self.pre_pi_tf.inverse_transform(y_dim)
-        y_dim = to_series(y_dim)
+            y_dim = apply_flat(self.pre_pi_tf.inverse_transform, y_dim)
 
         return y_dim
 
     @classmethod
-    def from_workspace(cls, ws: piml.Workspace, pi_set: piml.PiSet) -> "DimToPiTransformer":
+    def from_workspace(cls, ws: piml.Workspace, pi_set: piml.PiSet,
+                       store: PiFeatureStore = None, backend: str = "numpy") -> "DimToPiTransformer":
         """Create transformer from config contained in workspace"""
         dim_vars = ws.config.dim_vars
         dataset = ws.config.dataset
@@ -162,4 +177,5 @@ class DimToPiTransformer:
         if pre_train_tf:
             pre_train_tf = get_custom_tf(ws, pre_train_tf)
 
-        return cls(pre_pi_tf=pre_pi_tf, pre_train_tf=pre_train_tf, pi_set=pi_set, dim_vars=dim_vars, dataset=dataset)
+        return cls(pre_pi_tf=pre_pi_tf, pre_train_tf=pre_train_tf, pi_set=pi_set, dim_vars=dim_vars, dataset=dataset,
+                   store=store, backend=backend)
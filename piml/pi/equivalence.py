@@ -0,0 +1,112 @@
+"""
+Equivalence of Pi sets under strictly monotone transforms of their feature groups.
+
+Gradient boosted trees choose their splits from quantile bins of the feature values, i.e., only from their order. So
+replacing a feature group ``pi`` by ``pi**k`` does not change how the training data are partitioned if ``x -> x**k``
+is strictly monotone on the range of ``pi``. This is an approximation for unseen data: split thresholds lie between two
+training values (e.g., at their midpoint), so test samples in between may be assigned differently. Random forests
+(midpoint thresholds of bootstrapped samples) and extremely randomized trees (thresholds drawn uniformly between
+minimum and maximum of the feature) are excluded, since their splits depend on the feature values themselves.
+
+- **Unsigned** groups (only positive variables) are positive, so any rational ``k != 0`` is allowed, e.g., ``1/pi`` or
+  ``pi**3``. Decreasing transforms only mirror the splits.
+- **Signed** groups can be negative. On the whole real axis, only ``k = p/q > 0`` with odd ``p`` and ``q`` is
+  strictly monotone, e.g., ``pi**3``. ``1/pi`` is not.
+
+Each group ``x**(n/d)`` is written as ``(x**v)**c`` with primitive integer vector ``v`` and ``c = gcd(n) / d > 0``.
+Two groups are then equivalent iff their ``v`` agree up to sign (unsigned) or agree exactly and the 2-adic valuations
+of their ``c`` match (signed). Sets are equivalent if their targets are identical and their feature groups are
+equivalent up to order.
+"""
+from typing import Sequence, Dict, Iterable
+
+import numpy as np
+import pandas as pd
+
+import piml
+
+# FLAML estimators with rank-based (quantile) split candidates, which are invariant to strictly monotone transforms of
+# features on the training data (see above)
+MONOTONE_INVARIANT_ESTIMATORS = ("xgboost", "xgb_limitdepth", "lgbm", "catboost")
+
+
+def is_monotone_invariant(estimator_list: Sequence[str]) -> bool:
+    """ True if all estimators FLAML may choose from have rank-based split candidates. Only then sets are deduplicated.
+    """
+    return all(est in MONOTONE_INVARIANT_ESTIMATORS for est in estimator_list)
+
+
+def _two_adic_valuation(x: np.ndarray) -> np.ndarray:
+    """ Exponent of the largest power of two dividing each positive integer in `x`. """
+    return np.log2(x & -x).astype(np.int64)
+
+
+def canonical_groups(num: np.ndarray, den: np.ndarray, signed: np.ndarray) -> np.ndarray:
+    """ Canonical key of each group with respect to strictly monotone power transforms.
+
+    Parameters
+    ----------
+    num : array of shape (..., variables)
+        Integer exponent numerators
+    den : array of shape (...)
+        Common exponent denominator of each group
+    signed : bool array of shape (variables, )
+        Whether variable is signed
+
+    Returns
+    -------
+    Integer array of shape (..., variables + 1) with primitive exponent vector and 2-adic valuation of its power.
+    """
+    g = np.gcd.reduce(num, axis=-1)
+    g = np.where(g == 0, 1, g)
+    v = num // g[..., np.newaxis]
+
+    is_signed = np.any(signed & (num != 0), axis=-1)
+
+    # Unsigned: v and -v are equivalent, so make first non-zero entry positive
+    first_nonzero = np.take_along_axis(v, np.argmax(v != 0, axis=-1)[..., np.newaxis], axis=-1)
+    v = np.where(~is_signed[..., np.newaxis] & (first_nonzero < 0), -v, v)
+
+    # Signed: only odd/odd powers are equivalent, i.e., powers with the same 2-adic valuation
+    nu = np.where(is_signed, _two_adic_valuation(g) - _two_adic_valuation(np.asarray(den)), 0)
+    return np.concatenate([v, nu[..., np.newaxis]], axis=-1)
+
+
+def representative_ids(num: np.ndarray, den: np.ndarray, ids: np.ndarray, signed: np.ndarray,
+                       known: Dict[bytes, int] = None) -> np.ndarray:
+    """ Id of the representative (first seen set) of the equivalence class of each set.
+
+    `num` and `den` of shape (sets, groups, variables) and (sets, groups) must hold the target as last group.
+    Pass the same `known` dict for consecutive chunks of a collection to find equivalent sets across chunks.
+    """
+    if known is None:
+        known = {}
+
+    keys = canonical_groups(num[:, :-1], den[:, :-1], signed)  # (sets, features, variables + 1)
+    target = np.concatenate([num[:, -1], den[:, -1, np.newaxis]], axis=-1)
+
+    # Feature order within a set does not matter
+    order = np.lexsort(np.moveaxis(keys, -1, 0)[::-1], axis=-1)
+    keys = np.take_along_axis(keys, order[..., np.newaxis], axis=1)
+    keys = np.concatenate([keys.reshape(len(keys), -1), target], axis=-1)
+
+    rep_ids = np.empty(len(ids), dtype=np.int64)
+    for i, (set_id, key) in enumerate(zip(ids, keys)):
+        rep_ids[i] = known.setdefault(key.tobytes(), int(set_id))
+    return rep_ids
+
+
+def save_equivalence(path, ids: Iterable[int], rep_ids: Iterable[int]) -> None:
+    """ Save mapping of set ids to ids of their representative as csv. """
+    pd.DataFrame({"id": list(ids), "representative_id": list(rep_ids)}).to_csv(path, index=False)
+
+
+def load_equivalence(ws: piml.Workspace) -> Dict[int, int]:
+    """ Map each set id to the id of the representative set, which is actually trained.
+    Without equivalence file (e.g., step 2 of an older version), every set represents itself.
+    """
+    path = ws.data_extracted / "pi_sets_equivalence.csv"
+    if not path.exists():
+        return {}
+    df = pd.read_csv(path)
+    return dict(zip(df["id"].astype(int), df["representative_id"].astype(int)))
@@ -0,0 +1,171 @@
+"""
+Compact representation of Pi groups as rational exponent vectors over the dimensional variables.
+
+A Pi group ``x_1**(n_1/d) * ... * x_p**(n_p/d)`` is stored as integer numerator vector ``(n_1, ..., n_p)`` and common
+positive denominator ``d``. Validation, target inversion and complexity then reduce to integer array operations
+instead of walking sympy expression trees. The functions at module level work on stacks of arbitrary leading shape,
+e.g., numerators of shape (sets, groups, variables), so that many sets are processed at once.
+"""
+from __future__ import annotations
+
+from typing import List, Tuple, Dict, Sequence
+
+import numpy as np
+import sympy as sp
+
+from piml.pi.base import PI_Y_expr
+from piml.pi.monomial import monomial_exponents
+
+
+def sign_valid(num: np.ndarray, den: np.ndarray, signed: np.ndarray) -> np.ndarray:
+    """ False for groups with a **signed** variable raised to an **even** or **non-integer** power.
+
+    E.g. sqrt(shfx) would cause NaN in unstable conditions and shfx**2 would lose information.
+
+    Parameters
+    ----------
+    num : array of shape (..., variables)
+        Integer exponent numerators
+    den : array of shape (...)
+        Common exponent denominator of each group
+    signed : bool array of shape (variables, )
+        Whether variable is signed
+    """
+    den = np.asarray(den)[..., np.newaxis]
+    is_int = num % den == 0
+    is_odd = is_int & ((num // den) % 2 != 0)
+    invalid = signed & (num != 0) & ~is_odd
+    return ~np.any(invalid, axis=-1)
+
+
+def count_target_groups(num: np.ndarray, target_idx: int) -> np.ndarray:
+    """ Number of groups in each set (second to last axis) which are function of variable `target_idx`. """
+    return np.count_nonzero(num[..., target_idx] != 0, axis=-1)
+
+
+def complexity(num: np.ndarray) -> np.ndarray:
+    """ Number of dimensional variables in each group, i.e., number of free symbols. """
+    return np.count_nonzero(num, axis=-1)
+
+
+def _reduce(num: np.ndarray, den: int) -> Tuple[np.ndarray, int]:
+    """ Cancel common factors of numerators and denominator. """
+    g = np.gcd.reduce(np.append(num, den))
+    if g == 0:
+        return num, 1
+    return num // g, int(den // g)
+
+
+class PiGroup:
+    """ Pi group (monomial) as rational exponent vector over `symbols`. """
+
+    def __init__(self, num: Sequence[int], den: int, symbols: Sequence[str]):
+        num = np.asarray(num, dtype=np.int64)
+        if len(num) != len(symbols):
+            raise ValueError(f"Got {len(num)} exponents for {len(symbols)} symbols.")
+        if den <= 0:
+            raise ValueError("Denominator has to be positive.")
+        self.num, self.den = _reduce(num, den)
+        self.symbols = tuple(symbols)
+
+    @classmethod
+    def from_sympy(cls, expr: sp.Expr, symbols: Sequence[str]) -> PiGroup:
+        coeff, exps = monomial_exponents(expr, list(symbols))
+        if coeff != 1:
+            raise ValueError(f"Pi group {expr} has coefficient {coeff} but only 1 is supported.")
+        den = int(np.lcm.reduce([e.q for e in exps]))
+        return cls([int(e * den) for e in exps], den, symbols)
+
+    def to_sympy(self) -> sp.Expr:
+        return sp.Mul(*[
+            sp.Symbol(s) ** sp.Rational(int(n), self.den)
+            for s, n in zip(self.symbols, self.num) if n != 0
+        ])
+
+    @property
+    def complexity(self) -> int:
+        return int(complexity(self.num))
+
+    def invert(self, target: str, signed: bool = False) -> PiGroup:
+        """ Solve ``PI_Y = self`` for `target` in closed form.
+        The result is a group over ``PI_Y`` and all other symbols. For target exponent ``a``, the solution is
+        ``target = PI_Y**(1/a) * rest**(-1/a)``. It is unique for ``a = +/-1`` and for unsigned (positive) targets with
+        any other exponent (positive real root). Signed targets with other exponents raise ValueError.
+        """
+        t = self.symbols.index(target)
+        a_num, a_den = self.num[t], self.den
+        if a_num == 0:
+            raise ValueError(f"{self.to_sympy()} does not depend on {target}.")
+        if abs(a_num) != a_den and signed:
+            raise ValueError(f"Inversion of {self.to_sympy()} for signed {target} with exponent "
+                             f"{sp.Rational(int(a_num), int(a_den))} is not supported (only +1 or -1).")
+        sign = int(np.sign(a_num))
+
+        # PI_Y = target**(a_num/den) * rest  =>  target = PI_Y**(den/a_num) * rest**(-1/a_num)
+        others = [i for i in range(len(self.symbols)) if i != t]
+        num = np.concatenate([[sign * self.den], -sign * self.num[others]])
+        symbols = [PI_Y_expr.name] + [self.symbols[i] for i in others]
+        return PiGroup(num, abs(int(a_num)), symbols)
+
+    def _key(self) -> Tuple:
+        return self.symbols, self.den, self.num.tobytes()
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, PiGroup) and self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    def __repr__(self) -> str:
+        return f"PiGroup({self.to_sympy()})"
+
+
+class PiGroupSet:
+    """ Set of Pi groups stored as exponent matrix (groups x symbols) with one denominator per group. """
+
+    def __init__(self, num: np.ndarray, den: np.ndarray, symbols: Sequence[str]):
+        self.num = np.asarray(num, dtype=np.int64).reshape(len(den), len(symbols))
+        self.den = np.asarray(den, dtype=np.int64)
+        self.symbols = tuple(symbols)
+
+    @classmethod
+    def from_groups(cls, groups: List[PiGroup]) -> PiGroupSet:
+        symbols = groups[0].symbols
+        return cls(np.array([g.num for g in groups]).reshape(len(groups), len(symbols)),
+                   np.array([g.den for g in groups]), symbols)
+
+    @classmethod
+    def from_sympy(cls, exprs: List[sp.Expr], symbols: Sequence[str],
+                   cache: Dict[sp.Expr, PiGroup] = None) -> PiGroupSet:
+        """ Convert list of sympy expressions. Provide `cache` to parse groups shared between sets only once. """
+        if cache is None:
+            cache = {}
+        groups = []
+        for pi in exprs:
+            if pi not in cache:
+                cache[pi] = PiGroup.from_sympy(pi, symbols)
+            groups.append(cache[pi])
+        return cls.from_groups(groups)
+
+    def __len__(self) -> int:
+        return len(self.den)
+
+    def __getitem__(self, i: int) -> PiGroup:
+        return PiGroup(self.num[i], int(self.den[i]), self.symbols)
+
+    @property
+    def groups(self) -> List[PiGroup]:
+        return [self[i] for i in range(len(self))]
+
+    def to_sympy(self) -> List[sp.Expr]:
+        return [g.to_sympy() for g in self.groups]
+
+    @property
+    def complexity(self) -> np.ndarray:
+        return complexity(self.num)
+
+    def sign_valid(self, signed: np.ndarray) -> np.ndarray:
+        return sign_valid(self.num, self.den, signed)
+
+    def count_target_groups(self, target: str) -> int:
+        return int(count_target_groups(self.num, self.symbols.index(target)))
@@ -0,0 +1,208 @@
+"""
+Chunked on-disk format for Pi sets based on exponent arrays (see ``piml.pi.group``).
+
+A collection is a directory with one ``chunk_XXXXX.npz`` file per chunk of sets and a ``meta.json`` file listing
+symbols, chunks and additional attributes. Each chunk holds numerators of shape (sets, groups, symbols), denominators
+of shape (sets, groups) and optional per-set arrays. Collections can be written incrementally and read lazily, chunk
+by chunk, or by random access to a single set without loading the whole collection.
+"""
+from __future__ import annotations
+
+import json
+import os
+import pathlib
+from typing import List, Sequence, Union, Iterator, Tuple, Dict, Any
+
+import joblib
+import numpy as np
+import sympy as sp
+
+from piml.pi.base import PiSet
+from piml.pi.group import PiGroup, PiGroupSet
+
+META_FILE = "meta.json"
+
+
+def _compact_int(arr: np.ndarray) -> np.ndarray:
+    """ Store integers with the smallest dtype that fits all values. """
+    arr = np.asarray(arr)
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if arr.size == 0 or (arr.min() >= info.min and arr.max() <= info.max):
+            return arr.astype(dtype)
+    return arr.astype(np.int64)
+
+
+class PiSetWriter:
+    """ Append sets to a new collection at `path`. Sets are buffered and written once `chunk_size` sets are collected.
+    Use as context manager or call ``.close()`` to write remaining sets and the metadata.
+    """
+
+    def __init__(self, path: Union[str, pathlib.Path], symbols: Sequence[str], chunk_size: int = 10_000,
+                 attrs: Dict[str, Any] = None):
+        self.path = pathlib.Path(path)
+        self.symbols = list(symbols)
+        self.chunk_size = chunk_size
+        self.attrs = attrs if attrs is not None else {}
+
+        # Start from empty directory
+        self.path.mkdir(parents=True, exist_ok=True)
+        for f in self.path.glob("chunk_*.npz"):
+            f.unlink()
+        (self.path / META_FILE).unlink(missing_ok=True)
+
+        self._chunks: List[Dict] = []
+        self._buffer: List[Dict[str, np.ndarray]] = []
+        self._n_buffered = 0
+        self.n_groups = None
+
+    def __enter__(self) -> PiSetWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+    def append(self, num: np.ndarray, den: np.ndarray, **extra: np.ndarray) -> None:
+        """ Append sets with numerators (sets, groups, symbols), denominators (sets, groups) and per-set arrays. """
+        num, den = np.asarray(num), np.asarray(den)
+        if num.ndim != 3 or num.shape[2] != len(self.symbols) or den.shape != num.shape[:2]:
+            raise ValueError(f"Expected numerators (sets, groups, {len(self.symbols)}) and matching denominators "
+                             f"but got {num.shape} and {den.shape}.")
+        if self.n_groups is None:
+            self.n_groups = num.shape[1]
+        if num.shape[1] != self.n_groups:
+            raise ValueError(f"All sets need to have {self.n_groups} groups but got {num.shape[1]}.")
+
+        self._buffer.append({"num": num, "den": den, **{k: np.asarray(v) for k, v in extra.items()}})
+        self._n_buffered += len(num)
+        while self._n_buffered >= self.chunk_size:
+            self._flush(self.chunk_size)
+
+    def append_sets(self, sets: List[PiGroupSet], **extra: np.ndarray) -> None:
+        self.append(np.stack([s.num for s in sets]), np.stack([s.den for s in sets]), **extra)
+
+    def _flush(self, n: int) -> None:
+        """ Write first `n` buffered sets as one chunk. """
+        data = {k: np.concatenate([b[k] for b in self._buffer]) for k in self._buffer[0]}
+        chunk, rest = {k: v[:n] for k, v in data.items()}, {k: v[n:] for k, v in data.items()}
+        self._buffer = [rest] if len(rest["num"]) else []
+        self._n_buffered = len(rest["num"])
+
+        name = f"chunk_{len(self._chunks):05d}.npz"
+        np.savez(self.path / name, **{k: _compact_int(v) for k, v in chunk.items()})
+        self._chunks.append({"file": name, "n_sets": len(chunk["num"])})
+
+    def close(self) -> None:
+        if self._n_buffered:
+            self._flush(self._n_buffered)
+
+        # Write metadata last and atomically. A collection without metadata is incomplete.
+        meta = {"symbols": self.symbols, "n_groups": self.n_groups, "chunks": self._chunks, "attrs": self.attrs}
+        tmp_path = self.path / f".{META_FILE}"
+        tmp_path.write_text(json.dumps(meta, indent=2))
+        os.replace(tmp_path, self.path / META_FILE)
+
+
+class PiSetReader:
+    """ Lazily read collection written by ``PiSetWriter``. Indexing returns ``PiGroupSet`` of a single set. """
+
+    def __init__(self, path: Union[str, pathlib.Path]):
+        self.path = pathlib.Path(path)
+        meta = json.loads((self.path / META_FILE).read_text())
+        self.symbols: List[str] = meta["symbols"]
+        self.n_groups: int = meta["n_groups"]
+        self.attrs: Dict[str, Any] = meta["attrs"]
+        self._chunk_files = [c["file"] for c in meta["chunks"]]
+        self._offsets = np.cumsum([0] + [c["n_sets"] for c in meta["chunks"]])
+        self._last_chunk = (None, None)  # Most recently loaded chunk for fast consecutive random access
+
+    @staticmethod
+    def exists(path: Union[str, pathlib.Path]) -> bool:
+        return (pathlib.Path(path) / META_FILE).exists()
+
+    def __len__(self) -> int:
+        return int(self._offsets[-1])
+
+    def load_chunk(self, i_chunk: int) -> Dict[str, np.ndarray]:
+        if self._last_chunk[0] == i_chunk:
+            return self._last_chunk[1]
+        with np.load(self.path / self._chunk_files[i_chunk]) as f:
+            data = {k: f[k].astype(np.int64) for k in f.files}
+        self._last_chunk = (i_chunk, data)
+        return data
+
+    def iter_chunks(self) -> Iterator[Dict[str, np.ndarray]]:
+        """ Iterate over chunks. Each chunk is dict with `num`, `den` and additional per-set arrays. """
+        for i in range(len(self._chunk_files)):
+            yield self.load_chunk(i)
+
+    def _locate(self, i: int) -> Tuple[int, int]:
+        """ Chunk and position within chunk of set `i`. """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"Set {i} out of range for collection with {len(self)} sets.")
+        i_chunk = int(np.searchsorted(self._offsets, i, side="right") - 1)
+        return i_chunk, i - int(self._offsets[i_chunk])
+
+    def _get(self, i: int) -> Dict[str, np.ndarray]:
+        i_chunk, j = self._locate(i)
+        return {k: v[j] for k, v in self.load_chunk(i_chunk).items()}
+
+    def __getitem__(self, i: int):
+        return self._item(self._get(i))
+
+    def __iter__(self) -> Iterator:
+        for data in self.iter_chunks():
+            for j in range(len(data["num"])):
+                yield self._item({k: v[j] for k, v in data.items()})
+
+    def _item(self, data: Dict[str, np.ndarray]):
+        return PiGroupSet(data["num"], data["den"], self.symbols)
+
+
+class ConstrainedPiSetReader(PiSetReader):
+    """ Lazily read constrained sets. Indexing returns ``PiSet``.
+
+    Each set stores its feature groups first (in order) and the target group last, the per-set arrays `id` and
+    `target` (index into ``attrs["target_names"]``), and the name of the dimensional output in ``attrs["output"]``
+    (signed if ``attrs["output_signed"]``).
+    Sympy expressions of groups are cached, since groups are shared by many sets.
+    """
+
+    def __init__(self, path: Union[str, pathlib.Path]):
+        super().__init__(path)
+        self._exprs: Dict[PiGroup, sp.Expr] = {}
+        self._inv_exprs: Dict[PiGroup, sp.Expr] = {}
+
+    def _to_sympy(self, group: PiGroup) -> sp.Expr:
+        if group not in self._exprs:
+            self._exprs[group] = group.to_sympy()
+        return self._exprs[group]
+
+    def _item(self, data: Dict[str, np.ndarray]) -> PiSet:
+        groups = PiGroupSet(data["num"], data["den"], self.symbols).groups
+        target = groups[-1]
+        if target not in self._inv_exprs:
+            signed = self.attrs.get("output_signed", False)
+            self._inv_exprs[target] = target.invert(self.attrs["output"], signed=signed).to_sympy()
+
+        return PiSet(
+            id=int(data["id"]),
+            feature_exprs=[self._to_sympy(g) for g in groups[:-1]],
+            target_id=self.attrs["target_names"][int(data["target"])],
+            target_expr=self._to_sympy(target),
+            target_inv_expr=self._inv_exprs[target],
+        )
+
+
+def load_pi_sets(path: Union[str, pathlib.Path]) -> Sequence:
+    """ Open collection at `path` lazily. Falls back to legacy ``<path>.joblib`` list, which is fully loaded. """
+    path = pathlib.Path(path)
+    if PiSetReader.exists(path):
+        meta = json.loads((path / META_FILE).read_text())
+        if "target_names" in meta["attrs"]:
+            return ConstrainedPiSetReader(path)
+        return PiSetReader(path)
+    return joblib.load(path.with_suffix(".joblib"))
@@ -0,0 +1,154 @@
+"""
+Fused evaluation kernels for Pi sets with selectable backend.
+
+All backends return bit-identical results. The reference is ``MonomialEvaluator`` (numpy): groups with integer and
+half-integer exponents are evaluated by multiplications, one division and square roots in the order defined by
+``MonomialEvaluator.direct_factors``. The other backends only fuse exactly these operations:
+
+- ``numpy``: reference implementation, one vectorized pass per group.
+- ``numexpr``: every direct group is evaluated in a single pass by numexpr without full-size temporaries.
+- ``numba``: all direct groups of a set are compiled into one parallel loop over samples, with square roots shared
+  between all groups of the set.
+
+Groups with other exponents (log-space) and expressions which are not monomials (``sympy.lambdify``) are evaluated
+by the same numpy code in all backends.
+numexpr and numba are optional dependencies and only imported when their backend is requested.
+"""
+import functools
+from typing import List, Tuple, Callable, Mapping
+
+import numpy as np
+import sympy as sp
+
+from piml.pi.lambdify import cached_lambdify
+from piml.pi.monomial import MonomialEvaluator, Factor
+
+BACKENDS = ("numpy", "numexpr", "numba")
+
+
+class PiKernel:
+    """ Evaluate list of expressions `exprs` of variables `args` at once. Returns array of shape (samples, exprs). """
+
+    def __init__(self, exprs: List[sp.Expr], args: List[str], backend: str = "numpy"):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend}. Choose one of {BACKENDS}.")
+
+        # Sanity check that kernel can only access provided variables
+        arg_symbols = set(sp.symbols(args))
+        for expr in exprs:
+            if not expr.free_symbols <= arg_symbols:
+                raise ValueError(f"{expr} depends on {expr.free_symbols - arg_symbols}, which are not in {args}.")
+
+        self.exprs = list(exprs)
+        self.args = list(args)
+        self.backend = backend
+
+        # Split into monomials (evaluator) and other expressions (lambdify)
+        monomials, self._other = [], []
+        for i, expr in enumerate(self.exprs):
+            try:
+                MonomialEvaluator([expr], symbols=self.args)
+                monomials.append(i)
+            except ValueError:
+                self._other.append(i)
+        self.evaluator = MonomialEvaluator([self.exprs[i] for i in monomials], symbols=self.args)
+        rows = self.evaluator.rows([self.exprs[i] for i in monomials])
+        is_direct = self.evaluator.is_direct[rows]
+        self._direct = [(i, row) for i, row, d in zip(monomials, rows, is_direct) if d]
+        self._log = [i for i, d in zip(monomials, is_direct) if not d]
+        self._other_fns = [cached_lambdify(self.args, self.exprs[i], "numpy") for i in self._other]
+
+        self._eval_direct = None
+        if backend != "numpy" and self._direct:
+            self._eval_direct = getattr(self, f"_compile_{backend}")()
+
+    def __call__(self, data: Mapping) -> np.ndarray:
+        """ Evaluate kernel on `data`, e.g., a dataframe or a dict with one array per argument. """
+        arrays = [np.asarray(data[v], dtype=float) for v in self.args]
+        n = np.broadcast_shapes(*[a.shape for a in arrays])[0] if arrays else 0
+        arrays = [np.broadcast_to(a, (n,)) for a in arrays]
+        out = np.empty((n, len(self.exprs)), dtype=float, order="F")
+
+        # Monomials of the reference (numpy) backend, or those which are not fused by the other backends
+        ref = [i for i, _ in self._direct] + self._log if self._eval_direct is None else self._log
+        if ref:
+            out[:, ref] = self.evaluator.evaluate(dict(zip(self.args, arrays)), [self.exprs[i] for i in ref])
+        if self._eval_direct is not None:
+            self._eval_direct(arrays, out)
+        for i, fn in zip(self._other, self._other_fns):
+            out[:, i] = fn(*arrays)
+        return out
+
+    def _direct_terms(self, var: Callable[[int, bool], str]) -> List[Tuple[int, str]]:
+        """ Column and expression string of each direct group, with factors in the order of the reference. `var`
+        names variable `j` or its square root.
+        """
+        terms = []
+        for i, row in self._direct:
+            coeff, num, den = self.evaluator.direct_factors(row)
+            ex_str = _product(repr(coeff), [var(*f) for f in num])
+            if den:
+                ex_str = f"({ex_str}) / ({_product(var(*den[0]), [var(*f) for f in den[1:]])})"
+            terms.append((i, ex_str))
+        return terms
+
+    def _compile_numexpr(self) -> Callable:
+        try:
+            import numexpr as ne
+        except ImportError:
+            raise ImportError("Backend 'numexpr' requires the numexpr package.")
+
+        # numexpr compiles each expression string once and caches it internally
+        terms = self._direct_terms(lambda j, is_sqrt: f"sqrt(_arr{j})" if is_sqrt else f"_arr{j}")
+
+        def evaluate(arrays, out):
+            local_dict = {f"_arr{j}": a for j, a in enumerate(arrays)}
+            for i, ex_str in terms:
+                # Columns of out are contiguous, so numexpr can write into them directly
+                ne.evaluate(ex_str, local_dict=local_dict, global_dict={}, out=out[:, i])
+        return evaluate
+
+    def _compile_numba(self) -> Callable:
+        try:
+            import numba
+        except ImportError:
+            raise ImportError("Backend 'numba' requires the numba package.")
+
+        terms = self._direct_terms(lambda j, is_sqrt: f"_sqrt{j}" if is_sqrt else f"_x{j}")
+        factors: List[Factor] = sorted({
+            f for _, row in self._direct for fs in self.evaluator.direct_factors(row)[1:] for f in fs
+        })
+
+        # Load each variable once per sample and share its square root between all groups
+        params = [f"_arr{j}" for j in range(len(self.args))]
+        lines = [f"def _pi_kernel({', '.join(params)}, _out):",
+                 f"    for _i in numba.prange(_out.shape[0]):"]
+        lines += [f"        _x{j} = _arr{j}[_i]" for j in sorted({j for j, _ in factors})]
+        lines += [f"        _sqrt{j} = numpy.sqrt(_x{j})" for j, is_sqrt in factors if is_sqrt]
+        lines += [f"        _out[_i, {i}] = {ex_str}" for i, ex_str in terms]
+
+        namespace = {"numba": numba, "numpy": np}
+        exec("\n".join(lines), namespace)
+        kernel = numba.njit(parallel=True, error_model="numpy")(namespace["_pi_kernel"])
+
+        def evaluate(arrays, out):
+            kernel(*arrays, out)
+        return evaluate
+
+
+def _product(first: str, factors: List[str]) -> str:
+    """ Left-associative product ``((first * f_1) * f_2) * ...`` """
+    ex_str = first
+    for f in factors:
+        ex_str = f"({ex_str} * {f})"
+    return ex_str
+
+
+@functools.lru_cache(maxsize=128)
+def _get_kernel(exprs: Tuple[sp.Expr], args: Tuple[str], backend: str) -> PiKernel:
+    return PiKernel(list(exprs), list(args), backend=backend)
+
+
+def get_kernel(exprs: List[sp.Expr], args: List[str], backend: str = "numpy") -> PiKernel:
+    """ Compile kernel or reuse already compiled one for the same expressions, arguments and backend. """
+    return _get_kernel(tuple(exprs), tuple(args), backend)
@@ -0,0 +1,167 @@
+"""
+Process-wide and on-disk cache of functions compiled by ``sympy.lambdify``.
+
+The disk cache lives in the workspace (``.cache/lambdify``, set when the workspace is opened) or in `PIML_CACHE_DIR`.
+Each file starts with a header holding its key and a checksum of the source code. Files with a foreign key or
+checksum are never executed.
+"""
+import collections
+import hashlib
+import inspect
+import os
+import pathlib
+import threading
+import uuid
+from typing import Callable, List, Optional, Union, Dict
+
+import sympy as sp
+
+CacheInfo = collections.namedtuple("CacheInfo", ["hits", "disk_hits", "misses", "maxsize", "currsize"])
+
+
+HEADER_PREFIX = "# piml-lambdify"
+
+
+def _env_cache_dir() -> Optional[pathlib.Path]:
+    """ Cache directory from `PIML_CACHE_DIR` environment variable, if set (empty string disables disk cache) """
+    cache_dir = os.environ.get("PIML_CACHE_DIR")
+    if not cache_dir:
+        return None
+    return pathlib.Path(cache_dir) / "lambdify"
+
+
+def _header(key: str, source: str) -> str:
+    return f"{HEADER_PREFIX} key={key} sha256={hashlib.sha256(source.encode()).hexdigest()}\n"
+
+
+class LambdifyCache:
+    """ LRU cache of lambdified expressions keyed by ``srepr`` of the expression, its arguments, and modules.
+
+    Compiled functions are kept in memory (at most `maxsize`). Additionally, the generated source code is written to
+    `cache_dir`, so that other processes (e.g., later pipeline steps) can skip code generation, too. The disk cache
+    is pruned to `max_disk_entries` files, evicting the least recently used ones.
+    """
+
+    def __init__(self, maxsize: int = 256, cache_dir: Union[str, pathlib.Path, None] = None,
+                 max_disk_entries: int = 4096):
+        self.maxsize = maxsize
+        self.cache_dir = pathlib.Path(cache_dir) if cache_dir is not None else None
+        self.max_disk_entries = max_disk_entries
+
+        self._fns: collections.OrderedDict[str, Callable] = collections.OrderedDict()
+        self._namespaces: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(args: List[str], expr: sp.Expr, modules: str) -> str:
+        key = "\n".join([sp.srepr(expr), repr(list(args)), modules, sp.__version__])
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def lambdify(self, args: List[str], expr: sp.Expr, modules: str = "numpy") -> Callable:
+        """ Drop-in replacement for ``sp.lambdify(args, expr, modules)``. """
+        key = self.key(args, expr, modules)
+
+        with self._lock:
+            if key in self._fns:
+                self.hits += 1
+                self._fns.move_to_end(key)
+                return self._fns[key]
+
+        fn = self._load(key, modules)
+        if fn is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            fn = sp.lambdify(args, expr, modules)
+            self._dump(key, fn)
+
+        with self._lock:
+            self._fns[key] = fn
+            while len(self._fns) > self.maxsize:
+                self._fns.popitem(last=False)
+        return fn
+
+    def _namespace(self, modules: str) -> Dict:
+        """ Global namespace sympy uses for functions generated for `modules`. """
+        if modules not in self._namespaces:
+            self._namespaces[modules] = sp.lambdify([], 0, modules).__globals__
+        return self._namespaces[modules]
+
+    def _load(self, key: str, modules: str) -> Optional[Callable]:
+        """ Compile function from cached source code, if available. """
+        if self.cache_dir is None:
+            return None
+        path = self.cache_dir / f"{key}.py"
+        try:
+            source = path.read_text()
+        except OSError:
+            return None
+
+        header, _, source = source.partition("\n")
+        if header + "\n" != _header(key, source):
+            return None  # Stale or foreign file, will be overwritten by lambdify
+
+        # Execute in copy of sympy's namespace, just like lambdify does
+        namespace = dict(self._namespace(modules))
+        fn_locals = {}
+        try:
+            exec(compile(source, str(path), "exec"), namespace, fn_locals)
+        except Exception:  # noqa Corrupt cache file, fall back to lambdify
+            return None
+        os.utime(path)  # Mark as recently used
+        return fn_locals["_lambdifygenerated"]
+
+    def _dump(self, key: str, fn: Callable) -> None:
+        """ Write source code of lambdified function to disk cache (atomically). """
+        if self.cache_dir is None:
+            return
+        try:
+            source = inspect.getsource(fn)
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_dir / f".{key}_{uuid.uuid4().hex}.py"
+            tmp_path.write_text(_header(key, source) + source)
+            os.replace(tmp_path, self.cache_dir / f"{key}.py")
+        except OSError:
+            return  # Disk cache is optional, e.g., read-only file system
+        self._prune()
+
+    def _prune(self) -> None:
+        """ Remove least recently used files if disk cache grows too large. """
+        files = list(self.cache_dir.glob("*.py"))
+        if len(files) <= self.max_disk_entries:
+            return
+        files = sorted(files, key=lambda p: p.stat().st_mtime)
+        for p in files[:len(files) - self.max_disk_entries]:
+            p.unlink(missing_ok=True)
+
+    def set_cache_dir(self, cache_dir: Union[str, pathlib.Path, None]) -> None:
+        """ Change disk cache directory (None disables disk cache). In-memory cache is kept. """
+        self.cache_dir = pathlib.Path(cache_dir) if cache_dir is not None else None
+
+    def cache_info(self) -> CacheInfo:
+        """ Report cache statistics, similar to ``functools.lru_cache``. """
+        return CacheInfo(self.hits, self.disk_hits, self.misses, self.maxsize, len(self._fns))
+
+    def cache_clear(self) -> None:
+        """ Clear in-memory cache and statistics. Disk cache is kept. """
+        with self._lock:
+            self._fns.clear()
+            self.hits = self.disk_hits = self.misses = 0
+
+
+# Process-wide cache instance
+LAMBDIFY_CACHE = LambdifyCache(cache_dir=_env_cache_dir())
+
+
+def use_workspace_cache(ws_root: Union[str, pathlib.Path]) -> None:
+    """ Store disk cache in workspace at `ws_root`, unless `PIML_CACHE_DIR` is set """
+    if "PIML_CACHE_DIR" not in os.environ:
+        LAMBDIFY_CACHE.set_cache_dir(pathlib.Path(ws_root) / ".cache" / "lambdify")
+
+
+def cached_lambdify(args: List[str], expr: sp.Expr, modules: str = "numpy") -> Callable:
+    """ Lambdify `expr` using the process-wide cache. """
+    return LAMBDIFY_CACHE.lambdify(args, expr, modules)
@@ -0,0 +1,199 @@
+"""
+Evaluate Pi groups as monomials, i.e., as products of powers of dimensional variables.
+
+Every Pi group generated by BuckinghamPi has the form ``c * x_1**e_1 * ... * x_p**e_p`` with rational exponents
+``e_j``. Instead of lambdifying and evaluating each group separately, all groups are stacked into one exponent matrix
+``E`` (groups x variables) and evaluated in a single vectorized pass.
+
+Groups with integer and half-integer exponents (the common case) are evaluated exactly as defined by
+``MonomialEvaluator.direct_factors``: only multiplications, one division and square roots in a fixed order. These
+operations are correctly rounded in IEEE arithmetic, so the fused kernels of ``piml.pi.kernels`` reproduce the result
+bit by bit.
+"""
+from __future__ import annotations
+
+from typing import List, Tuple, Dict, Iterable, Optional, Mapping
+
+import numpy as np
+import pandas as pd
+import sympy as sp
+
+
+def monomial_exponents(expr: sp.Expr, symbols: List[str]) -> Tuple[float, List[sp.Rational]]:
+    """ Decompose monomial `expr` into its numerical coefficient and rational exponents of `symbols`.
+    Raises ValueError if `expr` is not a monomial of the provided symbols.
+    """
+    coeff, expr = expr.as_coeff_Mul()
+    exps = {s: sp.Integer(0) for s in symbols}
+
+    for factor in sp.Mul.make_args(expr):
+        base, exp = factor.as_base_exp()
+        if not base.is_Symbol or base.name not in exps:
+            raise ValueError(f"{expr} is not a monomial of {symbols}. Unexpected factor {factor}.")
+        if not exp.is_Rational:
+            raise ValueError(f"{expr} has non-rational exponent {exp}.")
+        exps[base.name] += exp
+
+    return float(coeff), [exps[s] for s in symbols]
+
+
+# Version of the evaluation scheme. Part of the fingerprint of stored features, so that changes never mix results.
+EVAL_VERSION = 2
+
+# Factor of a direct group: (variable index, whether square root of the variable is used)
+Factor = Tuple[int, bool]
+
+
+def n_samples(data: Mapping) -> int:
+    """ Number of samples of dataframe or mapping of 1-D arrays """
+    if isinstance(data, pd.DataFrame):
+        return len(data)
+    return len(next(iter(data.values()))) if len(data) else 0
+
+
+class MonomialEvaluator:
+    """ Evaluate many Pi groups at once based on their rational exponent matrix.
+
+    Groups with integer or half-integer exponents of at most `max_int_power` (absolute) are evaluated directly as
+    product of variables and their square roots (see ``direct_factors``). All others are evaluated in log-space as
+    ``sign * exp(E @ log|X|)``. The sign follows from the odd integer exponents of negative inputs, negative inputs
+    raised to non-integer powers result in NaN (like numpy does).
+    """
+
+    def __init__(self, exprs: Iterable[sp.Expr], symbols: List[str], max_int_power: int = 4):
+        # Deduplicate expressions but keep order of first occurrence for reproducible column order
+        self.exprs: List[sp.Expr] = list(dict.fromkeys(exprs))
+        self.symbols = list(symbols)
+        self.max_int_power = max_int_power
+        self.index: Dict[sp.Expr, int] = {pi: i for i, pi in enumerate(self.exprs)}
+
+        coeffs, exps = [], []
+        for pi in self.exprs:
+            c, e = monomial_exponents(pi, self.symbols)
+            coeffs.append(c)
+            exps.append(e)
+
+        # Store exponents exactly (numerator, denominator) and as float for evaluation
+        n_groups, n_symbols = len(self.exprs), len(self.symbols)
+        self.coeffs = np.array(coeffs, dtype=float)
+        self.exp_num = np.array([[e.p for e in row] for row in exps], dtype=np.int64).reshape(n_groups, n_symbols)
+        self.exp_den = np.array([[e.q for e in row] for row in exps], dtype=np.int64).reshape(n_groups, n_symbols)
+        self.exp = self.exp_num / self.exp_den
+
+        # Decide once which groups can be evaluated directly
+        is_half_int = (self.exp_den == 1) | (self.exp_den == 2)
+        self.is_direct = np.all(is_half_int & (np.abs(self.exp_num) <= max_int_power), axis=1)
+
+    def __len__(self) -> int:
+        return len(self.exprs)
+
+    def __contains__(self, pi: sp.Expr) -> bool:
+        return pi in self.index
+
+    def rows(self, exprs: Optional[List[sp.Expr]] = None) -> np.ndarray:
+        """ Row of each of `exprs` (default: all groups) in the exponent matrix """
+        if exprs is None:
+            return np.arange(len(self))
+        missing = [pi for pi in exprs if pi not in self.index]
+        if missing:
+            raise KeyError(f"Pi groups {missing} are unknown to this evaluator.")
+        return np.array([self.index[pi] for pi in exprs], dtype=int)
+
+    def direct_factors(self, row: int) -> Tuple[float, List[Factor], List[Factor]]:
+        """ Coefficient, numerator and denominator factors of direct group `row`. The group is evaluated as
+        ``(((coeff * n_1) * n_2) * ...) / ((d_1 * d_2) * ...)``, where a factor is a variable or its square root,
+        repeated as often as the (doubled, if half-integer) exponent says. Factors are ordered by variable.
+        """
+        num, den = [], []
+        for j in np.flatnonzero(self.exp_num[row]):
+            e, is_sqrt = int(self.exp_num[row, j]), bool(self.exp_den[row, j] == 2)
+            (num if e > 0 else den).extend([(int(j), is_sqrt)] * abs(e))
+        return float(self.coeffs[row]), num, den
+
+    def evaluate(self, df_dim: Mapping, exprs: Optional[List[sp.Expr]] = None) -> np.ndarray:
+        """ Evaluate `exprs` (default: all groups) on dimensional data (dataframe or mapping of 1-D arrays).
+        Returns array of shape (samples, groups).
+        """
+        rows = self.rows(exprs)
+        n = n_samples(df_dim)
+
+        # Only load variables that are actually used by requested groups
+        exp_num, exp_den, exp = self.exp_num[rows], self.exp_den[rows], self.exp[rows]
+        cols = np.flatnonzero(np.any(exp_num != 0, axis=0))
+        X = np.column_stack([
+            np.asarray(df_dim[self.symbols[j]], dtype=float) for j in cols
+        ]) if len(cols) else np.empty((n, 0))
+        exp_num, exp_den, exp = exp_num[:, cols], exp_den[:, cols], exp[:, cols]
+
+        # Fortran order so that each group (column) is contiguous in memory
+        out = np.empty((n, len(rows)), dtype=float, order="F")
+        coeffs = self.coeffs[rows]
+        is_direct = self.is_direct[rows]
+
+        # Square roots are shared between direct groups
+        col_of = {j: k for k, j in enumerate(cols)}
+        sqrts = {}
+        with np.errstate(divide="ignore", invalid="ignore"):  # NaN and inf as documented above
+            for i in np.flatnonzero(is_direct):
+                out[:, i] = self._eval_direct(X, col_of, sqrts, *self.direct_factors(rows[i]))
+
+        i_log = np.flatnonzero(~is_direct)
+        if len(i_log):
+            out[:, i_log] = self._eval_log(X, exp_num[i_log], exp_den[i_log], exp[i_log], coeffs[i_log])
+
+        return out
+
+    @staticmethod
+    def _eval_direct(X: np.ndarray, col_of: Dict[int, int], sqrts: Dict[int, np.ndarray], coeff: float,
+                     num: List[Factor], den: List[Factor]) -> np.ndarray:
+        """ Evaluate single direct group exactly as described by ``direct_factors`` """
+        def factor(j: int, is_sqrt: bool) -> np.ndarray:
+            if not is_sqrt:
+                return X[:, col_of[j]]
+            if j not in sqrts:
+                sqrts[j] = np.sqrt(X[:, col_of[j]])
+            return sqrts[j]
+
+        out = np.full(len(X), coeff)
+        for f in num:
+            out *= factor(*f)
+        if den:
+            d = factor(*den[0]).copy()
+            for f in den[1:]:
+                d *= factor(*f)
+            out /= d
+        return out
+
+    @staticmethod
+    def _eval_log(X: np.ndarray, exp_num: np.ndarray, exp_den: np.ndarray, exp: np.ndarray,
+                  coeffs: np.ndarray) -> np.ndarray:
+        """ Evaluate multiple groups at once in log-space including sign handling. """
+        uses = exp_num != 0
+        is_int = exp_den == 1
+
+        # Mask values that cannot be represented in log-space. They are set to 1 and fixed up afterwards.
+        is_zero = X == 0
+        is_bad = ~np.isfinite(X)
+        X_abs = np.where(is_zero | is_bad, 1., np.abs(X))
+        out = np.exp(np.log(X_abs) @ exp.T) * coeffs
+
+        # Sign: product of signs of negative inputs with odd integer exponents
+        is_neg = (X < 0).astype(float)
+        n_flip = is_neg @ (is_int & (exp_num % 2 != 0)).T.astype(float)
+        out[n_flip % 2 == 1] *= -1
+
+        # Negative inputs with non-integer exponents are undefined in real numbers
+        is_nan = (is_neg @ (uses & ~is_int).T.astype(float)) > 0
+        is_nan |= (is_bad.astype(float) @ uses.T.astype(float)) > 0
+
+        # Zeros: positive exponents give zero, negative exponents give infinity, both together are undefined
+        if np.any(is_zero):
+            is_zero = is_zero.astype(float)
+            zero_pos = (is_zero @ (exp > 0).T.astype(float)) > 0
+            zero_neg = (is_zero @ (exp < 0).T.astype(float)) > 0
+            out[zero_pos] = 0.
+            out[zero_neg] = np.copysign(np.inf, out[zero_neg])
+            is_nan |= zero_pos & zero_neg
+
+        out[is_nan] = np.nan
+        return out
@@ -0,0 +1,90 @@
+"""
+On-disk store of evaluated Pi feature groups shared by all Pi sets of a workspace.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import pathlib
+import uuid
+from typing import List, Union, Iterable, Dict
+
+import joblib
+import numpy as np
+import pandas as pd
+import sympy as sp
+
+import piml
+from piml.config.dim_vars import DimVarsConfig
+from piml.pi.monomial import MonomialEvaluator, EVAL_VERSION
+
+
+class PiFeatureStore:
+    """ Evaluate each unique Pi feature group once per dataset and persist it as memory-mappable ``.npy`` file.
+
+    Columns are keyed by the canonical (sympy) expression of the group, so Pi sets sharing groups also share columns.
+    The store is bound to one dimensional dataset. Its directory name contains a fingerprint of the dimensional
+    inputs and the evaluation scheme, so that changed data never pick up stale columns.
+    Only inputs are available to the store, so target groups cannot be evaluated (no leakage into features).
+    """
+
+    def __init__(self, root: Union[str, pathlib.Path], df_dim: pd.DataFrame, dim_vars: DimVarsConfig,
+                 chunk_size: int = 32):
+        self.df_dim = df_dim
+        self.dim_vars = dim_vars
+        self.n_samples = len(df_dim)
+        self.chunk_size = chunk_size  # max. number of groups evaluated at once to bound memory
+
+        fingerprint = joblib.hash([df_dim[dim_vars.input_strs], EVAL_VERSION])
+        self.root = pathlib.Path(root) / fingerprint[:16]
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        # Cache of opened memory maps
+        self._cols: Dict[sp.Expr, np.ndarray] = {}
+
+    @classmethod
+    def from_workspace(cls, ws: piml.Workspace, df_dim: pd.DataFrame, name: str, **kwargs) -> PiFeatureStore:
+        """ Store located in `4_train_test/pi_features/<name>`, e.g., with `name` being the train dataset name. """
+        return cls(ws.data_train_test / "pi_features" / name, df_dim=df_dim, dim_vars=ws.config.dim_vars, **kwargs)
+
+    @staticmethod
+    def key(pi: sp.Expr) -> str:
+        """ Unique key of Pi group based on its canonical sympy representation. """
+        return hashlib.sha1(sp.srepr(pi).encode()).hexdigest()
+
+    def path(self, pi: sp.Expr) -> pathlib.Path:
+        return self.root / f"{self.key(pi)}.npy"
+
+    def __contains__(self, pi: sp.Expr) -> bool:
+        return pi in self._cols or self.path(pi).exists()
+
+    def prefetch(self, exprs: Iterable[sp.Expr]) -> None:
+        """ Evaluate all groups in `exprs` which are not stored yet and write them to disk. """
+        missing = [pi for pi in dict.fromkeys(exprs) if pi not in self]
+        if not missing:
+            return
+
+        print(f"Evaluating {len(missing)} new Pi groups for feature store {self.root}.")
+        for i in range(0, len(missing), self.chunk_size):
+            chunk = missing[i:i + self.chunk_size]
+            X_pi = MonomialEvaluator(chunk, symbols=self.dim_vars.input_strs).evaluate(self.df_dim)
+            for j, pi in enumerate(chunk):
+                self._write(pi, X_pi[:, j])
+
+    def _write(self, pi: sp.Expr, col: np.ndarray) -> None:
+        """ Write column atomically, so that concurrent processes never read partially written files. """
+        path = self.path(pi)
+        tmp_path = path.with_name(f".{path.stem}_{uuid.uuid4().hex}.npy")
+        np.save(tmp_path, np.ascontiguousarray(col))
+        os.replace(tmp_path, path)
+
+    def get(self, exprs: List[sp.Expr]) -> List[np.ndarray]:
+        """ Return read-only memory maps of the requested groups. Missing groups are evaluated first. """
+        self.prefetch(exprs)
+
+        cols = []
+        for pi in exprs:
+            if pi not in self._cols:
+                self._cols[pi] = np.load(self.path(pi), mmap_mode="r")
+            cols.append(self._cols[pi])
+        return cols
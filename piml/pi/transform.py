@@ -2,33 +2,47 @@ from __future__ import annotations
 
 import numpy as np
 import pandas as pd
-import sympy as sp
 
 from piml.pi.base import PiSet, PI_Y_expr
+from piml.pi.kernels import get_kernel
+from piml.pi.monomial import MonomialEvaluator
+from piml.pi.store import PiFeatureStore
 from piml.config.dim_vars import DimVarsConfig
 
 
 class PiTargetTransformer:
-    """ Transform target variable between non-dimensional and dimensional form. """
-    def __init__(self, pi_set: PiSet, dim_vars: DimVarsConfig):
-        # Dimensional to non-dimensional (Pi_y -> y)
-        eval_fn = sp.lambdify(
-            args=dim_vars.all_strs,
-            expr=pi_set.target_expr,
-            modules="numpy"
-        )
+    """ Transform target variable between non-dimensional and dimensional form.
+    `backend` selects how expressions are evaluated (see ``piml.pi.kernels``). All backends give identical results.
+    """
+    def __init__(self, pi_set: PiSet, dim_vars: DimVarsConfig, backend: str = "numpy"):
+        # Dimensional to non-dimensional (y -> Pi_y)
+        kernel = get_kernel([pi_set.target_expr], args=dim_vars.all_strs, backend=backend)
         # Non-dimensional to dimensional (Pi_y -> y)
-        eval_inv_fn = sp.lambdify(
-            args=[PI_Y_expr.name, *dim_vars.input_strs],
-            expr=pi_set.target_inv_expr,
-            modules="numpy"
-        )
+        inv_kernel = get_kernel([pi_set.target_inv_expr], args=[PI_Y_expr.name, *dim_vars.input_strs],
+                                backend=backend)
+
+        def eval_fn(**kwargs):
+            return kernel(kwargs)[:, 0]
+
+        def eval_inv_fn(**kwargs):
+            return inv_kernel(kwargs)[:, 0]
 
         self.pi_set = pi_set
         self.dim_vars = dim_vars
+        self.backend = backend
         self.eval_fn = eval_fn
         self.eval_inv_fn = eval_inv_fn
 
+        # Split inverse into a factor of the inputs and a factor of Pi_y, e.g., S / u_st and PI_Y, so that the input
+        # factor is evaluated only once for predictions of all members. Not possible for sums, e.g., PI_Y + S.
+        input_factor, target_factor = pi_set.target_inv_expr.as_independent(PI_Y_expr, as_Add=False)
+        self.inv_input_kernel, self.inv_target_kernel = None, None
+        if target_factor.free_symbols <= {PI_Y_expr}:
+            self.inv_input_kernel = get_kernel([input_factor], args=dim_vars.input_strs, backend=backend)
+            # Most common factor PI_Y needs no evaluation
+            if target_factor != PI_Y_expr:
+                self.inv_target_kernel = get_kernel([target_factor], args=[PI_Y_expr.name], backend=backend)
+
     def fit(self, *, df_dim: pd.DataFrame) -> PiTargetTransformer:
         """ Provide dimensioned dataframe that will be base for transform or inverse transform. """
         self.df_dim_ = df_dim
@@ -49,48 +63,84 @@ class PiTargetTransformer:
         })
         return pd.Series(y_pi, index=y_non_log.index)
 
-    def inverse_transform(self, *, y_pi: pd.Series) -> pd.Series:
-        """ Transform non-dimensional target variable to dimensional form. """
+    def inverse_transform_array(self, *, y_pi: np.ndarray) -> np.ndarray:
+        """ Transform non-dimensional target variable of shape (..., samples), e.g., predictions of all ensemble
+        members (members, samples), to dimensional form. The factor of the dimensional inputs is evaluated only once
+        and broadcast over leading axes.
+        """
         df_dim = self.df_dim_
-        if len(y_pi) != len(df_dim):
+        y_pi = np.asarray(y_pi)
+        if y_pi.shape[-1] != len(df_dim):
             raise ValueError(f"Dimensioned base dataframe ({len(df_dim)}) "
-                             f"and transformation target ({len(y_pi)} do not have the same length!")
-
-        # Invert pi transformation
-        y_non_log = self.eval_inv_fn(**{
-            PI_Y_expr.name: y_pi,
-            **{
-                v: df_dim[v]
-                for v in self.dim_vars.input_strs
-            }
-        })
-        return pd.Series(y_non_log, index=y_pi.index)
-
-
-def apply_pi_var(df_dim: pd.DataFrame, pi_expr: sp.Expr, dim_vars: DimVarsConfig) -> np.ndarray:
-    """ Numerically evaluate Pi variable on dataframe.
-    This function explicitly makes no use of target/output to avoid data leakage into features/inputs.
-    That means it will fail when Pi_y group is provided! Use transformer instead.
+                             f"and transformation target ({y_pi.shape[-1]} do not have the same length!")
+
+        inputs = {v: df_dim[v].to_numpy() for v in self.dim_vars.input_strs}
+        if self.inv_input_kernel is not None:
+            input_factor = self.inv_input_kernel(inputs)[:, 0]
+            if self.inv_target_kernel is None:
+                return y_pi * input_factor
+            target_factor = self.inv_target_kernel({PI_Y_expr.name: y_pi.ravel()})[:, 0].reshape(y_pi.shape)
+            return target_factor * input_factor
+
+        # Inverse is not separable, so the kernel evaluates one sample axis at a time
+        y_2d = y_pi.reshape(-1, y_pi.shape[-1])
+        y_non_log = np.stack([self.eval_inv_fn(**{PI_Y_expr.name: y_i, **inputs}) for y_i in y_2d])
+        return y_non_log.reshape(y_pi.shape)
+
+
+def apply_pi_set(df_dim: pd.DataFrame, s: PiSet, dim_vars: DimVarsConfig, with_y: bool,
+                 store: PiFeatureStore = None, backend: str = "numpy") -> pd.DataFrame:
+    """ Numerically evaluate Pi set on dataframe.
+    All feature groups are evaluated in a single pass by a ``MonomialEvaluator``.
+    If `store` is provided, features are taken from it without copying instead (`df_dim` has to be its dataset).
+    If `backend` is not "numpy", features and target are evaluated by one fused kernel (see ``piml.pi.kernels``) and
+    `store` is ignored.
     """
-    eval_fn = sp.lambdify(dim_vars.input_strs, pi_expr, "numpy")
-    return eval_fn(**{
-        v: df_dim[v]
-        for v in dim_vars.input_strs
-    })
-
-
-def apply_pi_set(df_dim: pd.DataFrame, s: PiSet, dim_vars: DimVarsConfig, with_y: bool) -> pd.DataFrame:
-    """ Numerically evaluate Pi set on dataframe. """
-    # Evaluate features/inputs
+    if backend != "numpy":
+        return _apply_pi_set_kernel(df_dim, s, dim_vars, with_y, backend)
+
+    # Evaluate features/inputs. Evaluator and store only know inputs, so target cannot leak into features.
+    if store is not None:
+        if len(df_dim) != store.n_samples:
+            raise ValueError(f"Dataframe ({len(df_dim)}) does not match feature store ({store.n_samples}).")
+        X_pi = store.get(s.feature_exprs)
+    else:
+        evaluator = MonomialEvaluator(s.feature_exprs, symbols=dim_vars.input_strs)
+        X_pi = evaluator.evaluate(df_dim, exprs=s.feature_exprs).T
     pi_eval = {
-        f"s-{s.id}_pi-{i:02d}": apply_pi_var(df_dim, pi, dim_vars)
-        for i, pi in enumerate(s.feature_exprs)
+        _feature_name(s, i): X_pi[i]
+        for i in range(len(s.feature_exprs))
     }
 
     # Evaluate target/output
     if with_y:
         pi_eval[s.target_id] = PiTargetTransformer(
             pi_set=s, dim_vars=dim_vars
-        ).fit(df_dim=df_dim).transform(y_non_log=df_dim[dim_vars.output.symbol.name])
+        ).fit(df_dim=df_dim).transform(y_non_log=df_dim[dim_vars.output.symbol.name]).to_numpy()
+
+    # Do not copy columns, so that memory maps of the store are used directly
+    return pd.DataFrame(pi_eval, index=df_dim.index, copy=False)
+
+
+def _feature_name(s: PiSet, i: int) -> str:
+    return f"s-{s.id}_pi-{i:02d}"
 
-    return pd.DataFrame.from_dict(pi_eval)
+
+def _apply_pi_set_kernel(df_dim: pd.DataFrame, s: PiSet, dim_vars: DimVarsConfig, with_y: bool,
+                         backend: str) -> pd.DataFrame:
+    """ Evaluate features (and target) of Pi set with a single fused kernel. """
+    # Features must never be function of the target, even though the kernel has access to it if `with_y` is set
+    dim_target = dim_vars.output.symbol
+    for pi in s.feature_exprs:
+        if dim_target in pi.free_symbols:
+            raise ValueError(f"Feature {pi} of Pi set {s.id} depends on target {dim_target}.")
+
+    if with_y:
+        kernel = get_kernel(s.all_exprs, args=dim_vars.all_strs, backend=backend)
+        names = [_feature_name(s, i) for i in range(len(s.feature_exprs))] + [s.target_id]
+    else:
+        kernel = get_kernel(s.feature_exprs, args=dim_vars.input_strs, backend=backend)
+        names = [_feature_name(s, i) for i in range(len(s.feature_exprs))]
+
+    X_pi = kernel(df_dim)
+    return pd.DataFrame({name: X_pi[:, i] for i, name in enumerate(names)}, index=df_dim.index, copy=False)
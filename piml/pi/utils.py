@@ -1,64 +1,45 @@
-from typing import List
+from typing import List, Dict, Iterable
 
 import sympy as sp
 
 import piml
 import piml.pi
 from piml.config.dim_vars import DimSymbol
+from piml.pi.group import PiGroup
 
 
-def invert_pi_target(pi_expr: sp.Expr, dim_output: DimSymbol) -> sp.Expr:
-    """ Invert provided non-dim target expression so that it can be used to recover dimensional target """
-    pi_inv = sp.solve(pi_expr - piml.pi.PI_Y_expr, dim_output.symbol)
-
-    if len(pi_inv) > 1:
-        raise ValueError(f"Inversion of {pi_expr} resulted in more than one solution. Abort!")
-
-    return pi_inv[0]
+def _symbol_names(exprs: List[sp.Expr]) -> List[str]:
+    """ Sorted names of all free symbols of `exprs` """
+    return sorted({s.name for pi in exprs for s in pi.free_symbols})
 
 
-def make_set_obj(pi_set: List[sp.Expr], set_id: int,
-                 targets: List[sp.Expr], targets_inv: List[sp.Expr], targets_names: List[str]) -> piml.PiSet:
-    """ Split set into features and target """
-    feature_exprs = []
-    target_expr = None
-    target_inv_expr = None
-    target_id = None
-
-    for pi in pi_set:
-        try:
-            target_idx = targets.index(pi)
-            target_expr = pi
-            target_inv_expr = targets_inv[target_idx]
-            target_id = targets_names[target_idx]
-        except ValueError:
-            feature_exprs.append(pi)
-
-    # Sanity check that no pi group was lost from set
-    assert len(feature_exprs) + 1 == len(pi_set)
+def invert_pi_target(pi_expr: sp.Expr, dim_output: DimSymbol) -> sp.Expr:
+    """ Invert provided non-dim target expression so that it can be used to recover dimensional target.
+    Inversion is done in closed form on the exponent vector of the Pi group (see ``PiGroup.invert``).
+    """
+    group = PiGroup.from_sympy(pi_expr, _symbol_names([pi_expr]))
+    return group.invert(dim_output.symbol.name, signed=dim_output.signed).to_sympy()
 
-    # Sort pi groups by number of free symbols
-    feature_exprs = sorted(feature_exprs, key=lambda pi: len(pi.free_symbols))
 
-    # Create actual PiSet object
-    return piml.PiSet(
-        id=set_id,
-        feature_exprs=feature_exprs,
-        target_id=target_id,
-        target_expr=target_expr,
-        target_inv_expr=target_inv_expr
-    )
+def pi_sets_to_latex(pi_sets: Iterable[piml.PiSet], cache: Dict[sp.Expr, str] = None) -> str:
+    """ Return Markdown style document listing sets and their variables as latex expressions.
+    Provide `cache` to convert groups shared between sets only once.
+    """
+    if cache is None:
+        cache = {}
 
+    def to_latex(pi: sp.Expr) -> str:
+        if pi not in cache:
+            cache[pi] = sp.latex(pi)
+        return cache[pi]
 
-def pi_sets_to_latex(pi_sets: List[piml.PiSet]) -> str:
-    """ Return Markdown style document listing sets and their variables as latex expressions """
     latex = ""
 
     for s in pi_sets:
         latex += f"# Set {s.id}\n"
         for i, pi in enumerate(s.feature_exprs):
-            latex += "- $" + r"\pi_{" + f"{i:d}" + r"} = " + sp.latex(pi) + "$\n"
-        latex += r"- $\pi_y = " + sp.latex(s.target_expr) + f"$ ({s.target_id}) \n"
+            latex += "- $" + r"\pi_{" + f"{i:d}" + r"} = " + to_latex(pi) + "$\n"
+        latex += r"- $\pi_y = " + to_latex(s.target_expr) + f"$ ({s.target_id}) \n"
         latex += "\n"
 
     return latex
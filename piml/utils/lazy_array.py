@@ -1,8 +1,10 @@
+import os
 import pathlib
+import re
 import shutil
 import uuid
 import warnings
-from typing import List, Union
+from typing import List, Union, Dict
 
 import joblib
 
@@ -18,22 +20,56 @@ class LazyArray:
             warnings.warn(f"Directory {output_dir} is not empty and on-disk content "
                           f"will be available in this instance.")
 
-            data_files = sorted(self.output_dir.glob("*.joblib"))
-            self._data: List[str] = [f.name for f in data_files]
-            self._uuid = self._data[0].replace(".joblib", "")
+            self._data: List[str] = self._find_items()
+            self._uuid = self._data[0].rsplit("_", 1)[0] if self._data else uuid.uuid4().hex
         else:
             if overwrite:
                 # Delete old array
                 shutil.rmtree(self.output_dir, ignore_errors=True)
 
             # Create new directory and empty array instance
-            self.output_dir.mkdir(parents=True)  # Create parents if needed
+            self.output_dir.mkdir(parents=True, exist_ok=True)  # Create parents if needed. Other processes may race.
             self._data: List[str] = []
             self._uuid = uuid.uuid4().hex
 
         self._i_iter = 0  # internal variable for iterator
         self._compress = compress  # joblib compression level
 
+    def _find_all_items(self) -> Dict[int, str]:
+        """ Names of all on-disk elements `<uuid>_<i>.joblib` by their index `i`. """
+        items = {}
+        for f in self.output_dir.glob("*.joblib"):
+            if m := re.fullmatch(r"(.+)_(\d+)\.joblib", f.name):
+                items[int(m.group(2))] = f.name
+        return items
+
+    def _find_items(self) -> List[str]:
+        """ Names of on-disk elements in order of their index (not lexicographic order).
+        Only the first contiguous elements are kept, so that a missing file never shifts the positions of later ones.
+        """
+        items = self._find_all_items()
+        data = []
+        while len(data) + 1 in items:
+            data.append(items[len(data) + 1])
+        return data
+
+    def refresh(self) -> None:
+        """ Pick up elements written by other processes (see ``.put()``). """
+        self._data = self._find_items()
+
+    def exists(self, i: int) -> bool:
+        """ Whether element at position `i` is on disk, also if it is not part of the array yet because of a gap. """
+        return i + 1 in self._find_all_items()
+
+    def get(self, i: int):
+        """ Read value at position `i` from disk, which may be beyond the end of the array because of a gap. """
+        return joblib.load(self.output_dir / self._find_all_items()[i + 1])
+
+    def missing(self, n: int) -> List[int]:
+        """ Positions below `n` without element on disk. """
+        items = self._find_all_items()
+        return [i for i in range(n) if i + 1 not in items]
+
     def __repr__(self):
         return self._data.__repr__()
 
@@ -76,9 +112,25 @@ class LazyArray:
             raise StopIteration
 
     def append(self, value):
+        """ Write value to disk and append it. Writing is atomic, so an interrupted append never leaves a partial
+        element behind, which would be picked up when the array is reloaded.
+        """
         item_name = f"{self._uuid}_{len(self._data) + 1:d}.joblib"
+        tmp_path = self.output_dir / f".{item_name}.tmp"
+        joblib.dump(value, tmp_path, compress=self._compress)
+        os.replace(tmp_path, self.output_dir / item_name)
         self._data.append(item_name)
-        joblib.dump(value, self.output_dir / item_name, compress=self._compress)
+
+    def put(self, i: int, value):
+        """ Write value at position `i`, which may be beyond the end of the array. Several processes can fill disjoint
+        positions of the same array concurrently. The array only covers the contiguous elements from the start, so
+        gaps are closed once the missing positions are written.
+        """
+        item_name = f"{self._uuid}_{i + 1:d}.joblib"
+        tmp_path = self.output_dir / f".{item_name}.tmp"
+        joblib.dump(value, tmp_path, compress=self._compress)
+        os.replace(tmp_path, self.output_dir / item_name)
+        self.refresh()
 
     def health_check(self):
         """ Raises error if any of the on-disk array elements is missing. """
@@ -0,0 +1,46 @@
+import os
+import pathlib
+import shutil
+import tempfile
+from typing import Union, Optional
+
+import numpy as np
+
+
+def shared_tmp_dir(tmp_dir: Union[str, pathlib.Path, None] = None) -> pathlib.Path:
+    """ Create temporary directory in `tmp_dir`. Defaults to RAM-backed `/dev/shm` if available. """
+    if tmp_dir is None and os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        tmp_dir = "/dev/shm"
+    return pathlib.Path(tempfile.mkdtemp(prefix="piml_", dir=tmp_dir))
+
+
+class MemmapArray:
+    """ Numpy array stored once in a ``.npy`` file and opened as read-only memory map by every process.
+    Pickling only transfers the path, so workers share the data (via the page cache) instead of receiving copies.
+    """
+
+    def __init__(self, path: Union[str, pathlib.Path]):
+        self.path = pathlib.Path(path)
+        self._array: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_array(cls, arr: np.ndarray, path: Union[str, pathlib.Path]) -> "MemmapArray":
+        np.save(path, arr)
+        return cls(path)
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._array is None:
+            self._array = np.load(self.path, mmap_mode="r")
+        return self._array
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._array = None
+
+
+def remove_tmp_dir(path: Union[str, pathlib.Path]) -> None:
+    shutil.rmtree(path, ignore_errors=True)
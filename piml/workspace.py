@@ -23,6 +23,10 @@ class Workspace:
         self._config_path = self.root / "config.yml"
         self._custom_code = None
 
+        # Cache compiled Pi expressions inside workspace
+        from piml.pi.lambdify import use_workspace_cache
+        use_workspace_cache(self.root)
+
         print(f"Using workspace {root}.")
 
     @classmethod
@@ -54,6 +58,9 @@ class Workspace:
         for p in [self.data_raw, self.data_extracted, self.data_processed, self.data_train_test, self.data_trained]:
             p.mkdir(exist_ok=False)
 
+        # Compiled Pi expressions are cached in the workspace (see ``piml.pi.lambdify``), but should not be committed
+        (self.root / ".gitignore").write_text(".cache/\n")
+
         # todo: Create empty config files
 
     @property
@@ -1,7 +1,11 @@
 import piml
-import joblib
 
 from buckinghampy import BuckinghamPi
+from piml.pi.group import PiGroupSet
+from piml.pi.io import PiSetWriter
+
+# Number of sets converted and written at once
+CHUNK_SIZE = 10_000
 
 if __name__ == "__main__":
     # Load workspace from environment variable `PIML_WORKSPACE` or first argument passed to script.
@@ -24,7 +28,14 @@ if __name__ == "__main__":
     print("Generating Pi terms... This may take a while.")
     ot_sl.generate_pi_terms()
 
-    # Save pi terms
-    pi_output = ws.data_raw / "pi_sets_full.joblib"
-    joblib.dump(ot_sl.pi_terms, pi_output)
+    # Save pi terms as chunked exponent arrays. Groups shared between sets are converted only once.
+    pi_output = ws.data_raw / "pi_sets_full"
+    symbols = ws.config.dim_vars.all_strs
+    cache = {}
+    with PiSetWriter(pi_output, symbols=symbols, chunk_size=CHUNK_SIZE) as writer:
+        for i in range(0, len(ot_sl.pi_terms), CHUNK_SIZE):
+            writer.append_sets([
+                PiGroupSet.from_sympy(s, symbols, cache=cache)
+                for s in ot_sl.pi_terms[i:i + CHUNK_SIZE]
+            ])
     print(f"Done! Pi terms saved to {pi_output}.")
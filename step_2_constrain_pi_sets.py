@@ -1,5 +1,5 @@
-import itertools
-from typing import List
+import argparse
+from typing import List, Tuple, Dict, Callable, Iterator
 
 import joblib
 import numpy as np
@@ -7,84 +7,158 @@ import sympy as sp
 
 import piml
 from piml.config.dim_vars import DimVarsConfig
-from piml.pi.utils import invert_pi_target, make_set_obj, pi_sets_to_latex
+from piml.pi.equivalence import is_monotone_invariant, representative_ids, save_equivalence
+from piml.pi.group import PiGroup, PiGroupSet, sign_valid, count_target_groups, complexity
+from piml.pi.io import PiSetReader, PiSetWriter, ConstrainedPiSetReader
+from piml.pi.utils import pi_sets_to_latex
 
 
-def sign_valid(pi: sp.Expr, dim_vars: DimVarsConfig) -> bool:
+def parse_chunk(pi_sets: List[List[sp.Expr]], symbols: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """ Convert chunk of sets to exponent arrays of shape (sets, groups, variables) and (sets, groups). """
+    cache: Dict[sp.Expr, PiGroup] = {}
+    sets = [PiGroupSet.from_sympy(s, symbols, cache=cache) for s in pi_sets]
+    return np.stack([s.num for s in sets]), np.stack([s.den for s in sets])
+
+
+def parse_pi_sets(pi_sets: List[List[sp.Expr]], dim_vars: DimVarsConfig, n_jobs: int = -1, chunk_size: int = 1000,
+                  memory: joblib.Memory = None) -> Tuple[np.ndarray, np.ndarray]:
+    """ Convert all sets to exponent arrays of shape (sets, groups, variables) and (sets, groups).
+    Sets are parsed in chunks on a process pool. If `memory` is provided, parsed chunks are cached on disk, so that
+    reruns (e.g., after changing `signed` flags) skip parsing. Output order always matches input order.
     """
-    Returns False if provided Pi group has an argument which is a **signed** symbol
-    raised to an **even** or **non-integer** power.
+    n_groups = {len(s) for s in pi_sets}
+    if len(n_groups) > 1:
+        raise ValueError(f"All Pi sets need to have the same number of groups but got {n_groups}.")
+
+    parse = memory.cache(parse_chunk) if memory is not None else parse_chunk
+    chunks = [pi_sets[i:i + chunk_size] for i in range(0, len(pi_sets), chunk_size)]
+    results = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(parse)(chunk, dim_vars.all_strs) for chunk in chunks
+    )
+    num = np.concatenate([r[0] for r in results])
+    den = np.concatenate([r[1] for r in results])
+    return num, den
+
 
-    E.g. sqrt(shfx) would cause NaN in unstable conditions
-    and shfx**2 would lose information. Therefore, we avoid these!
+def valid_pi_sets(num: np.ndarray, den: np.ndarray, dim_vars: DimVarsConfig) -> np.ndarray:
+    """ Pi set is valid if
+    - it only contains one target group and
+    - all pi groups have valid signs.
     """
-    for arg in pi.args:
-        if arg.is_Atom:
-            continue
-        elif arg.is_Pow:
-            # Allow all power expressions with uneven integer exponents because that keeps original sign
-            arg: sp.Pow
-            if arg.exp.is_Integer and not arg.exp.is_even:
-                continue
+    signed = np.array([dim_vars[v].signed for v in dim_vars.all_strs])
+    target_idx = dim_vars.all_strs.index(dim_vars.output.symbol.name)
 
-            # Only allow even or non-integer exponents if base is unsigned
-            if dim_vars[arg.base].signed:
-                print(f"Eliminating {pi} because of {arg}.")
-                return False
-        else:
-            raise ValueError(f"Unexpected argument {type(arg)} in Pi group pi")
+    signs_valid = sign_valid(num, den, signed=signed)  # (sets, groups)
+    return signs_valid.all(axis=-1) & (count_target_groups(num, target_idx) == 1)
 
-    return True
 
+def order_groups(num: np.ndarray, den: np.ndarray, target_idx: int) -> Tuple[np.ndarray, np.ndarray]:
+    """ Sort feature groups of each set by number of variables (stable) and move target group to the end. """
+    is_target = num[..., target_idx] != 0
+    key = np.where(is_target, num.shape[-1] + 1, complexity(num))
+    order = np.argsort(key, axis=-1, kind="stable")
+    return np.take_along_axis(num, order[..., np.newaxis], axis=1), np.take_along_axis(den, order, axis=1)
 
-def contains_single_target(pi_set: List[sp.Expr], dim_target: sp.Expr) -> bool:
-    """ True if dimless set contains only one term which is function of target """
-    y_count = [1 for pi in pi_set if dim_target in pi.free_symbols]
-    return sum(y_count) == 1
 
+def target_rows(num: np.ndarray, den: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Unique target groups (last group of ordered sets) as rows (numerators, denominator) and index of each set. """
+    rows = np.concatenate([num[:, -1], den[:, -1, np.newaxis]], axis=1)
+    return np.unique(rows, axis=0, return_inverse=True)
 
-def valid_pi_set(pi_set: List[sp.Expr], dim_vars: DimVarsConfig) -> bool:
-    """ Pi set is valid if
-    - it only contains one target group and
-    - all pi groups have valid signs.
+
+def load_full_chunks(ws: piml.Workspace, dim_vars: DimVarsConfig,
+                     args) -> Callable[[], Iterator[Tuple[np.ndarray, np.ndarray]]]:
+    """ Return function iterating over chunks of all sets from step 1 as exponent arrays.
+    Falls back to parsing the legacy joblib list of sympy expressions if no chunked collection exists.
     """
-    signs_valid = [sign_valid(pi, dim_vars=dim_vars) for pi in pi_set]
-    return np.all(signs_valid) & contains_single_target(pi_set, dim_target=dim_vars.output.symbol)
+    path = ws.data_raw / "pi_sets_full"
+    if PiSetReader.exists(path):
+        reader = PiSetReader(path)
+        if reader.symbols != dim_vars.all_strs:
+            raise ValueError(f"Symbols of {path} ({reader.symbols}) do not match config ({dim_vars.all_strs}). "
+                             f"Re-run step 1.")
+        return lambda: ((c["num"], c["den"]) for c in reader.iter_chunks())
+
+    print(f"Loading legacy {path.with_suffix('.joblib')}.")
+    pi_sets_full = joblib.load(path.with_suffix(".joblib"))
+    memory = None if args.no_cache else joblib.Memory(ws.data_extracted / "cache", verbose=0)
+    num, den = parse_pi_sets(pi_sets_full, dim_vars=dim_vars, n_jobs=args.n_jobs, chunk_size=args.chunk_size,
+                             memory=memory)
+    return lambda: iter([(num, den)])
+
+
+def parse_args():
+    """ Parse command line arguments """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_jobs", type=int, default=-1, help="Number of worker processes to parse Pi sets.")
+    parser.add_argument("--chunk_size", type=int, default=1000, help="Number of Pi sets per worker task.")
+    parser.add_argument("--no_cache", action="store_true", help="Do not use or update on-disk cache.")
+    parser.add_argument("--no_dedup", action="store_true",
+                        help="Train all sets, even if they are equivalent for the configured (tree) estimators.")
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
     # Load workspace from environment variable `PIML_WORKSPACE` or first argument passed to script.
     ws = piml.Workspace.auto()
-
-    # Load full list of pi sets
-    pi_sets_full = joblib.load(ws.data_raw / "pi_sets_full.joblib")
-
-    # Filter full list, get unique Pi targets, and also invert them
+    args = parse_args()
     dim_vars = ws.config.dim_vars
-    pi_sets_full = [s for s in pi_sets_full if valid_pi_set(s, dim_vars=dim_vars)]
-    unique_targets = {
-        pi for pi in itertools.chain.from_iterable(pi_sets_full)
-        if dim_vars.output.symbol in pi.free_symbols
-    }
-    unique_targets = sorted(unique_targets, key=str)  # sort by string expression to make target assignment reproducible
-    unique_targets_inv = [invert_pi_target(pi, dim_output=dim_vars.output) for pi in unique_targets]
+    target_name = dim_vars.output.symbol.name
+    target_idx = dim_vars.all_strs.index(target_name)
+
+    # Full list of pi sets is processed chunk by chunk and never fully loaded
+    iter_chunks = load_full_chunks(ws, dim_vars=dim_vars, args=args)
+
+    # 1st pass: Filter sets and collect unique Pi targets
+    valid_masks = []
+    unique_targets = set()
+    for num, den in iter_chunks():
+        valid_masks.append(valid_pi_sets(num, den, dim_vars=dim_vars))
+        num, den = order_groups(num[valid_masks[-1]], den[valid_masks[-1]], target_idx)
+        unique_targets.update(map(tuple, target_rows(num, den)[0]))
+    n_valid, n_total = sum(m.sum() for m in valid_masks), sum(len(m) for m in valid_masks)
+    print(f"Eliminating {n_total - n_valid} of {n_total} sets because of invalid signs or multiple target groups.")
+
+    # Sort by string expression to make target assignment reproducible
+    unique_targets = [PiGroup(row[:-1], row[-1], dim_vars.all_strs) for row in unique_targets]
+    unique_targets = sorted(unique_targets, key=lambda g: str(g.to_sympy()))
+    unique_targets_idx = {g: i for i, g in enumerate(unique_targets)}
     unique_targets_names = [f"Pi_y_{i}" for i in range(len(unique_targets))]
 
-    # Convert filtered sets to PiSet objects
-    pi_sets: List[piml.PiSet] = [
-        make_set_obj(
-            s,
-            set_id=i,
-            targets=unique_targets,
-            targets_inv=unique_targets_inv,
-            targets_names=unique_targets_names,
-        )
-        for i, s in enumerate(pi_sets_full)
-    ]
-    joblib.dump(pi_sets, ws.data_extracted / "pi_sets_constrained.joblib")
+    # Fail early if a target group cannot be inverted uniquely
+    for g in unique_targets:
+        g.invert(target_name, signed=dim_vars.output.signed)
+
+    # 2nd pass: Write filtered sets with features sorted by complexity and target last
+    output = ws.data_extracted / "pi_sets_constrained"
+    attrs = {"output": target_name, "output_signed": dim_vars.output.signed, "target_names": unique_targets_names}
+    n_sets = 0
+    with PiSetWriter(output, symbols=dim_vars.all_strs, attrs=attrs) as writer:
+        for (num, den), is_valid in zip(iter_chunks(), valid_masks):
+            num, den = order_groups(num[is_valid], den[is_valid], target_idx)
+            rows, inverse = target_rows(num, den)
+            rows_idx = np.array([unique_targets_idx[PiGroup(r[:-1], r[-1], dim_vars.all_strs)] for r in rows])
+            writer.append(num, den, id=np.arange(n_sets, n_sets + len(num)), target=rows_idx[inverse.ravel()])
+            n_sets += len(num)
+    print(f"{n_sets} valid Pi sets saved to {output}.")
+
+    # Sets, which only differ by monotone transforms of features, yield the same tree models. Train only one of them.
+    dedup = not args.no_dedup and is_monotone_invariant(ws.config.flaml.estimator_list)
+    signed = np.array([dim_vars[v].signed for v in dim_vars.all_strs])
+    known = {}
+    ids, rep_ids = [], []
+    for data in PiSetReader(output).iter_chunks():
+        ids.append(data["id"])
+        rep_ids.append(representative_ids(data["num"], data["den"], data["id"], signed, known) if dedup else data["id"])
+    ids, rep_ids = np.concatenate(ids), np.concatenate(rep_ids)
+    save_equivalence(ws.data_extracted / "pi_sets_equivalence.csv", ids, rep_ids)
+    if dedup:
+        print(f"{len(np.unique(rep_ids))} of {n_sets} sets are not equivalent under monotone transforms "
+              f"and need to be trained.")
 
     # Store sets as latex
     md_latex_file = ws.data_extracted / "pi_sets_constrained.md"
-    md_latex_file.write_text(
-        pi_sets_to_latex(pi_sets)
-    )
+    latex_cache = {}
+    with md_latex_file.open("w") as f:
+        for s in ConstrainedPiSetReader(output):
+            f.write(pi_sets_to_latex([s], cache=latex_cache))
@@ -0,0 +1,37 @@
+import argparse
+
+import pandas as pd
+
+import piml
+from piml.ml.screening import screen_pi_sets, screening_path
+from piml.pi.equivalence import load_equivalence
+from piml.pi.io import load_pi_sets
+
+
+def parse_args():
+    """ Parse command line arguments """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frac_days", type=float, default=0.25, help="Fraction of training days used for screening.")
+    parser.add_argument("--n_splits", type=int, default=5, help="Number of day-blocked CV folds.")
+    parser.add_argument("--n_jobs", type=int, default=-1, help="Number of Pi sets screened in parallel.")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    ws = piml.Workspace.auto()
+    args = parse_args()
+
+    # Only sets which are actually trained need to be screened (see step 2)
+    rep_ids = load_equivalence(ws)
+    pi_sets = [s for s in load_pi_sets(ws.data_extracted / "pi_sets_constrained") if rep_ids.get(s.id, s.id) == s.id]
+
+    df_dim_train = pd.read_csv(
+        ws.data_train_test / ws.config.dataset.get_train_name(with_suffix=True),
+        parse_dates=["TIME"],
+    )
+
+    df_screen = screen_pi_sets(ws, pi_sets, df_dim_train, frac_days=args.frac_days, n_splits=args.n_splits,
+                               n_jobs=args.n_jobs)
+    df_screen.to_csv(screening_path(ws), index=False)
+    print(df_screen.head(10).to_string(index=False))
+    print(f"Done! Ranking saved to {screening_path(ws)}.")
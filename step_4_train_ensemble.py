@@ -1,7 +1,9 @@
 import argparse
-import datetime
+import pathlib
+import shutil
+import sys
 import warnings
-from typing import List
+from typing import Sequence, Set, Tuple, List
 
 import joblib
 import pandas as pd
@@ -9,13 +11,26 @@ import pandas as pd
 import piml
 from piml.ml import Experiment
 from piml.ml.ensemble import train_ensemble
+from piml.ml.export import export_ensemble, slim_dir, SlimEnsemble
+from piml.ml.knowledge import HPOKnowledgeBase
+from piml.ml.racing import halving_schedule, select_survivors, member_scores, mark_eliminated, clear_eliminated
+from piml.ml.screening import select_pi_sets, screening_path
+from piml.ml.sharding import shard_from_env, shard_tasks
 from piml.ml.transform import DimToPiTransformer
+from piml.pi.equivalence import load_equivalence
+from piml.pi.io import load_pi_sets
+from piml.pi.kernels import BACKENDS
+from piml.pi.store import PiFeatureStore
 from piml.pi.utils import pi_sets_to_latex
 from piml.utils.lazy_array import LazyArray
 
 
-def train_pi_set(ws: piml.Workspace, s: piml.PiSet, df_dim_train: pd.DataFrame) -> None:
-    """ Prepare dimensional data for training using one PiSet and train ensemble """
+def create_ensemble(ws: piml.Workspace, s: piml.PiSet, df_dim_train: pd.DataFrame,
+                    overwrite: bool = False) -> Tuple[Experiment, LazyArray]:
+    """ Set up base experiment and ensemble directory for PiSet.
+    The directory is keyed by config, PiSet and training data, so members trained by a previous (e.g., interrupted)
+    run are kept and training continues after them. Only with `overwrite`, the directory is emptied.
+    """
     # Set up base experiment from which individual member models will be created
     base_exp = Experiment(
         config=ws.config,
@@ -23,37 +38,306 @@ def train_pi_set(ws: piml.Workspace, s: piml.PiSet, df_dim_train: pd.DataFrame)
         target=s.target_id
     )
 
-    # Set up dimensional data transformer. Specified pre-pi and pre-train transforms will be applied automatically.
-    dim_to_pi_tf = DimToPiTransformer.from_workspace(ws=ws, pi_set=s)
-    df_train = dim_to_pi_tf.fit(df_dim=df_dim_train).transform_X_y()
-
     # Create LazyArray, which will hold pickled version of each trained member
-    ensemble_name = f"{base_exp.get_str()}__{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M')}"
-    la = LazyArray(ws.data_trained / ensemble_name / "ensemble", overwrite=True)
+    path = ensemble_dir(ws, base_exp, df_dim_train)
+    if overwrite:
+        shutil.rmtree(slim_dir(path / "ensemble"), ignore_errors=True)
+    elif not (path / "ensemble").exists() and len(SlimEnsemble(slim_dir(path / "ensemble"))) > 0:
+        raise ValueError(f"Full members of {path} were deleted after export, so training cannot continue. Pass "
+                         f"--overwrite to train the ensemble again.")
+    la = LazyArray(path / "ensemble", overwrite=overwrite)
+    # Ensemble is trained again, so a previous elimination by racing does not apply anymore
+    clear_eliminated(path)
 
     # Write config and latex Pi set to ensemble folder for documentation.
     # Using the yaml() method of the config object ensures that also default values are written.
-    (ws.data_trained / ensemble_name / "config.yml").write_text(ws.config.yaml())
-    (ws.data_trained / ensemble_name / "pi_set.md").write_text(pi_sets_to_latex([s]))
+    (path / "config.yml").write_text(ws.config.yaml())
+    (path / "pi_set.md").write_text(pi_sets_to_latex([s]))
+
+    return base_exp, la
+
+
+def ensemble_dir(ws: piml.Workspace, base_exp: Experiment, df_dim_train: pd.DataFrame) -> pathlib.Path:
+    """ Directory of ensemble, keyed by config, PiSet and training data """
+    return ws.data_trained / f"{base_exp.get_str()}__{base_exp.get_key(joblib.hash(df_dim_train))}"
+
+
+def transform_pi_set(ws: piml.Workspace, s: piml.PiSet, df_dim_train: pd.DataFrame, store: PiFeatureStore = None,
+                     backend: str = "numpy") -> Tuple[DimToPiTransformer, pd.DataFrame]:
+    """ Prepare dimensional data for training using one PiSet """
+    # Set up dimensional data transformer. Specified pre-pi and pre-train transforms will be applied automatically.
+    dim_to_pi_tf = DimToPiTransformer.from_workspace(ws=ws, pi_set=s, store=store, backend=backend)
+    df_train = dim_to_pi_tf.fit(df_dim=df_dim_train).transform_X_y()
+    return dim_to_pi_tf, df_train
+
+
+def train_members(ws: piml.Workspace, s: piml.PiSet, base_exp: Experiment, la: LazyArray,
+                  dim_to_pi_tf: DimToPiTransformer, df_train: pd.DataFrame, df_dim_train: pd.DataFrame,
+                  **kwargs) -> None:
+    """ Train ensemble members (see ``train_ensemble`` for `kwargs`).
+    If the knowledge base is enabled, FLAML starts from the best configurations of the most similar earlier ensembles
+    and the best configurations of the newly trained members are recorded afterwards.
+    """
+    if not ws.config.training.knowledge_base:
+        train_ensemble(base_exp=base_exp, df_train=df_train, features=dim_to_pi_tf.features_, result_array=la,
+                       **kwargs)
+        export_members(ws, la, df_train)
+        return
+
+    kb = HPOKnowledgeBase.from_workspace(ws)
+    fingerprint = joblib.hash(df_dim_train)
+    starting_points = kb.starting_points(ws.config.flaml.estimator_list, s.target_id, len(dim_to_pi_tf.features_),
+                                         fingerprint)
+    if starting_points:
+        print(f"Starting search of Pi set {s.id} from {sum(len(c) for c in starting_points.values())} "
+              f"configurations of the knowledge base.")
+    trained = train_ensemble(base_exp=base_exp, df_train=df_train, features=dim_to_pi_tf.features_, result_array=la,
+                             starting_points=starting_points or None, **kwargs)
+
+    # Only members trained now are recorded. Members of previous runs are already in the knowledge base (or pruned).
+    for i in trained:
+        kb.add_experiment(la.get(i - 1), member=i, data_fingerprint=fingerprint)
+    export_members(ws, la, df_train)
+
+
+def export_members(ws: piml.Workspace, la: LazyArray, df_train: pd.DataFrame) -> None:
+    """ Export members not exported yet in slim format (see ``piml.ml.export``), if enabled """
+    if ws.config.training.export_slim:
+        n_exported = export_ensemble(la, days=df_train["DAY_YEAR"].to_numpy())
+        if n_exported:
+            print(f"Exported {n_exported} members to {slim_dir(la.output_dir)}.")
+
+
+def train_pi_set(ws: piml.Workspace, s: piml.PiSet, df_dim_train: pd.DataFrame,
+                 store: PiFeatureStore = None, backend: str = "numpy", overwrite: bool = False) -> None:
+    """ Prepare dimensional data for training using one PiSet and train ensemble """
+    dim_to_pi_tf, df_train = transform_pi_set(ws, s, df_dim_train, store=store, backend=backend)
+    base_exp, la = create_ensemble(ws, s, df_dim_train, overwrite=overwrite)
+    if len(la) >= ws.config.n_members:
+        la.health_check()
+        print(f"Ensemble of Pi set {s.id} is already complete. Skipping.")
+        return
+    if len(la) > 0:
+        print(f"Resuming ensemble of Pi set {s.id} after {len(la)} members.")
 
     # Start training
-    train_ensemble(base_exp=base_exp, df_train=df_train, features=dim_to_pi_tf.features_, result_array=la)
+    train_members(ws, s, base_exp, la, dim_to_pi_tf, df_train, df_dim_train)
+
+
+def filter_pi_sets(ws: piml.Workspace, pi_sets: Sequence[piml.PiSet],
+                   selected_ids: Set[int] = None) -> List[piml.PiSet]:
+    """ Remove sets equivalent to other sets (see step 2) and sets not in `selected_ids` (if provided) """
+    rep_ids = load_equivalence(ws)
+    pi_sets = [s for s in pi_sets if rep_ids.get(s.id, s.id) == s.id]
+    if selected_ids is not None:
+        pi_sets = [s for s in pi_sets if s.id in selected_ids]
+    return pi_sets
+
+
+def train_all_pi_sets(ws: piml.Workspace, pi_sets: Sequence[piml.PiSet], df_dim_train: pd.DataFrame,
+                      store: PiFeatureStore = None, backend: str = "numpy", selected_ids: Set[int] = None,
+                      overwrite: bool = False) -> None:
+    """ Train all available Pi sets or only those in `selected_ids` """
+    pi_sets = filter_pi_sets(ws, pi_sets, selected_ids)
 
+    # Evaluate each unique Pi group of all sets only once
+    if store is not None and backend == "numpy":
+        store.prefetch(pi for s in pi_sets for pi in s.feature_exprs)
 
-def train_all_pi_sets(ws: piml.Workspace, pi_sets: List[piml.PiSet], df_dim_train: pd.DataFrame) -> None:
-    """ Train all available Pi sets """
     for s in pi_sets:
         try:
-            train_pi_set(ws, s, df_dim_train)
+            train_pi_set(ws, s, df_dim_train, store=store, backend=backend, overwrite=overwrite)
         except ValueError as e:
             warnings.warn(str(e))
             continue
 
 
+def race_pi_sets(ws: piml.Workspace, pi_sets: Sequence[piml.PiSet], df_dim_train: pd.DataFrame,
+                 store: PiFeatureStore = None, backend: str = "numpy", selected_ids: Set[int] = None,
+                 eta: int = 2, min_members: int = 2, overwrite: bool = False) -> None:
+    """ Train Pi sets by successive halving (see ``piml.ml.racing``).
+    Ensembles of surviving sets grow from round to round, so members of earlier rounds are reused. Ensembles of
+    eliminated sets keep the members trained so far, but are marked as eliminated, so that step 5 skips these partial
+    ensembles. All rounds are logged to `5_trained/racing_log.csv`.
+    """
+    pi_sets = filter_pi_sets(ws, pi_sets, selected_ids)
+    if store is not None and backend == "numpy":
+        store.prefetch(pi for s in pi_sets for pi in s.feature_exprs)
+
+    schedule = halving_schedule(ws.config.n_members, ws.config.flaml.time_budget, eta=eta, min_members=min_members)
+    ensembles = {}
+    log = []
+    for i_round, (n_members, time_budget) in enumerate(schedule):
+        print(f"Racing round {i_round + 1} of {len(schedule)}: {len(pi_sets)} Pi sets, {n_members} members, "
+              f"{time_budget} s budget.")
+
+        scores = {}
+        for s in pi_sets:
+            try:
+                dim_to_pi_tf, df_train = transform_pi_set(ws, s, df_dim_train, store=store, backend=backend)
+            except ValueError as e:
+                warnings.warn(str(e))
+                continue
+            if s.id not in ensembles:
+                ensembles[s.id] = create_ensemble(ws, s, df_dim_train, overwrite=overwrite)
+            base_exp, la = ensembles[s.id]
+
+            train_members(ws, s, base_exp, la, dim_to_pi_tf, df_train, df_dim_train, n_members=n_members,
+                          time_budget=time_budget)
+            scores[s.id] = member_scores(la[:n_members], dim_to_pi_tf, df_train).mean()
+
+        # All sets which reach the last round are trained completely
+        is_last = i_round == len(schedule) - 1
+        survivors = set(scores) if is_last else set(select_survivors(scores, eta=eta))
+        log += [
+            {"round": i_round + 1, "id": set_id, "n_members": n_members, "time_budget": time_budget,
+             "rmse": score, "survived": set_id in survivors}
+            for set_id, score in sorted(scores.items(), key=lambda item: item[1])
+        ]
+        pd.DataFrame(log).to_csv(ws.data_trained / "racing_log.csv", index=False)
+        for set_id in set(scores) - survivors:
+            mark_eliminated(ensembles[set_id][1].output_dir.parent, i_round + 1, float(scores[set_id]))
+        pi_sets = [s for s in pi_sets if s.id in survivors]
+
+    print(f"Racing done! Pi sets {sorted(s.id for s in pi_sets)} are trained completely.")
+
+
+def train_shard(ws: piml.Workspace, pi_sets: Sequence[piml.PiSet], df_dim_train: pd.DataFrame, shard: int,
+                num_shards: int, store: PiFeatureStore = None, backend: str = "numpy",
+                selected_ids: Set[int] = None) -> None:
+    """ Train the members of all Pi sets assigned to `shard` (see ``piml.ml.sharding``).
+    Shards write into the same ensemble directories, each member to its own position. Members already trained (e.g.,
+    by an earlier attempt of this shard) are skipped.
+    """
+    pi_sets = filter_pi_sets(ws, pi_sets, selected_ids)
+    members = shard_tasks(pi_sets, ws.config.n_members, ws.config.flaml.time_budget, shard, num_shards)
+    pi_sets = [s for s in pi_sets if s.id in members]
+    print(f"Shard {shard} of {num_shards}: {sum(len(m) for m in members.values())} members of {len(pi_sets)} Pi sets.")
+
+    # Warm-started members need the pilot of their set. Fail before training anything, if another shard owns it.
+    if ws.config.training.warm_start:
+        missing = [s.id for s in pi_sets if 1 not in members[s.id] and not has_pilot(ws, s, df_dim_train)]
+        if missing:
+            raise ValueError(f"Warm start requires the first member (pilot) of Pi sets {missing}, which are assigned to "
+                             f"other shards. Train the pilots first (step 4 with --pilots).")
+
+    if store is not None and backend == "numpy":
+        store.prefetch(pi for s in pi_sets for pi in s.feature_exprs)
+
+    for s in pi_sets:
+        try:
+            dim_to_pi_tf, df_train = transform_pi_set(ws, s, df_dim_train, store=store, backend=backend)
+        except ValueError as e:
+            warnings.warn(str(e))
+            continue
+        base_exp, la = create_ensemble(ws, s, df_dim_train)
+        train_members(ws, s, base_exp, la, dim_to_pi_tf, df_train, df_dim_train, members=members[s.id])
+
+
+def has_pilot(ws: piml.Workspace, s: piml.PiSet, df_dim_train: pd.DataFrame) -> bool:
+    """ Whether the first member (pilot for warm start) of the ensemble of `s` is trained """
+    path = ensemble_dir(ws, Experiment(config=ws.config, pi_set=s, target=s.target_id), df_dim_train) / "ensemble"
+    return path.exists() and LazyArray(path, overwrite=False).exists(0)
+
+
+def train_pilots(ws: piml.Workspace, pi_sets: Sequence[piml.PiSet], df_dim_train: pd.DataFrame,
+                 store: PiFeatureStore = None, backend: str = "numpy", selected_ids: Set[int] = None) -> None:
+    """ Train only the first member of all Pi sets, e.g., before shards warm-start the other members from it """
+    for s in filter_pi_sets(ws, pi_sets, selected_ids):
+        if has_pilot(ws, s, df_dim_train):
+            print(f"Pilot of Pi set {s.id} is already trained. Skipping.")
+            continue
+        try:
+            dim_to_pi_tf, df_train = transform_pi_set(ws, s, df_dim_train, store=store, backend=backend)
+        except ValueError as e:
+            warnings.warn(str(e))
+            continue
+        base_exp, la = create_ensemble(ws, s, df_dim_train)
+        train_members(ws, s, base_exp, la, dim_to_pi_tf, df_train, df_dim_train, members=[1])
+
+
+def verify_ensembles(ws: piml.Workspace, pi_sets: Sequence[piml.PiSet], df_dim_train: pd.DataFrame,
+                     selected_ids: Set[int] = None) -> bool:
+    """ Check that ensembles of all Pi sets are complete, e.g., after all shards finished. Missing members are listed.
+    """
+    complete = True
+    for s in filter_pi_sets(ws, pi_sets, selected_ids):
+        path = ensemble_dir(ws, Experiment(config=ws.config, pi_set=s, target=s.target_id), df_dim_train) / "ensemble"
+        if not path.exists():
+            print(f"Pi set {s.id}: missing ensemble {path}.")
+            complete = False
+            continue
+
+        la = LazyArray(path, overwrite=False)
+        la.health_check()
+        missing = la.missing(ws.config.n_members)
+        if missing:
+            print(f"Pi set {s.id}: missing members {[i + 1 for i in missing]}.")
+            complete = False
+
+    print("All ensembles are complete." if complete else "Some ensembles are incomplete.")
+    return complete
+
+
+def export_pi_sets(ws: piml.Workspace, pi_sets: Sequence[piml.PiSet], df_dim_train: pd.DataFrame,
+                   store: PiFeatureStore = None, backend: str = "numpy", selected_ids: Set[int] = None,
+                   drop_full: bool = False) -> None:
+    """ Export existing ensembles of all Pi sets in slim format, e.g., ensembles trained before export was enabled.
+    With `drop_full`, the full members are deleted afterwards to save space. Their training can then not be resumed.
+    """
+    for s in filter_pi_sets(ws, pi_sets, selected_ids):
+        path = ensemble_dir(ws, Experiment(config=ws.config, pi_set=s, target=s.target_id), df_dim_train) / "ensemble"
+        if not path.exists():
+            print(f"Pi set {s.id}: no ensemble to export.")
+            continue
+
+        # Days of the training samples are needed to record validation days of members
+        _, df_train = transform_pi_set(ws, s, df_dim_train, store=store, backend=backend)
+        la = LazyArray(path, overwrite=False)
+        n_exported = export_ensemble(la, days=df_train["DAY_YEAR"].to_numpy())
+        print(f"Pi set {s.id}: exported {n_exported} of {len(la)} members to {slim_dir(path)}.")
+        if drop_full:
+            shutil.rmtree(path)
+
+
 def parse_args():
     """ Parse command line arguments """
     parser = argparse.ArgumentParser()
     parser.add_argument("--pi_set", type=int, default=None)
+    parser.add_argument("--backend", type=str, default="numpy", choices=BACKENDS,
+                        help="Backend to evaluate Pi groups (identical results). 'numpy' uses the shared feature "
+                             "store, 'numexpr' and 'numba' fuse the evaluation of each set.")
+    parser.add_argument("--top_k", type=int, default=None,
+                        help="Only train the k best sets according to screening (step 3b).")
+    parser.add_argument("--tolerance", type=float, default=None,
+                        help="Only train sets with screening RMSE within this relative tolerance of the best one.")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--overwrite", action="store_true",
+                       help="Delete existing ensembles (also exported members) and train them again. By default, "
+                            "members of previous (interrupted) runs are kept and complete ensembles are skipped.")
+    group.add_argument("--resume", action="store_true", help="Default, only kept for compatibility.")
+    parser.add_argument("--shard", type=int, default=None,
+                        help="Only train members assigned to this shard (0, ..., num_shards - 1). "
+                             "Defaults to PIML_SHARD environment variable.")
+    parser.add_argument("--num_shards", "--num-shards", type=int, default=None,
+                        help="Number of shards. Defaults to PIML_NUM_SHARDS environment variable.")
+    parser.add_argument("--pilots", action="store_true",
+                        help="Only train the first member of each set, which the others warm-start from (see "
+                             "training.warm_start). Run before the shards of a job array.")
+    parser.add_argument("--prune_kb", type=int, default=None, metavar="MAX",
+                        help="Do not train but keep only the MAX best configurations per estimator, target, number "
+                             "of features and data in the knowledge base (see training.knowledge_base).")
+    parser.add_argument("--verify", action="store_true",
+                        help="Do not train but check that all ensembles are complete (e.g., after all shards ran).")
+    parser.add_argument("--export", action="store_true",
+                        help="Do not train but export existing ensembles in slim format for evaluation.")
+    parser.add_argument("--drop_full", action="store_true",
+                        help="Export: delete full members after export. Training can then not be resumed.")
+    parser.add_argument("--racing", action="store_true",
+                        help="Successively drop worst sets while growing ensembles and budget (successive halving).")
+    parser.add_argument("--eta", type=int, default=2,
+                        help="Racing: keep 1/eta of sets per round and grow members and budget by factor eta.")
+    parser.add_argument("--min_members", type=int, default=2, help="Racing: number of members in first round.")
     return parser.parse_args()
 
 
@@ -61,22 +345,73 @@ def main():
     ws = piml.Workspace.auto()
 
     # Load Pi sets and dimensional data
-    pi_sets: List[piml.PiSet] = joblib.load(ws.data_extracted / "pi_sets_constrained.joblib")
+    # Sets are read lazily, so a single job of a job array only loads the chunk containing its set
+    pi_sets: Sequence[piml.PiSet] = load_pi_sets(ws.data_extracted / "pi_sets_constrained")
     df_dim_train = pd.read_csv(
         ws.data_train_test / ws.config.dataset.get_train_name(with_suffix=True),
         parse_dates=["TIME"],
     )
 
+    # Pi features are shared between sets and runs (also between jobs of a job array)
+    store = PiFeatureStore.from_workspace(ws, df_dim_train, name=ws.config.dataset.get_train_name(with_suffix=False))
+
     # Parse cmd arguments to decide between training all pi sets or just a specific one
     args = parse_args()
-    if args.pi_set is None:
+
+    # Optionally, restrict training to the most promising sets according to screening
+    selected_ids = None
+    if args.top_k is not None or args.tolerance is not None:
+        if not screening_path(ws).exists():
+            raise FileNotFoundError(f"{screening_path(ws)} not found. Run step_3b_screen_pi_sets.py first.")
+        selected_ids = select_pi_sets(pd.read_csv(screening_path(ws)), top_k=args.top_k, tolerance=args.tolerance)
+        print(f"Training {len(selected_ids)} Pi sets selected by screening.")
+
+    shard, num_shards = shard_from_env()
+    if args.shard is not None or args.num_shards is not None:
+        shard, num_shards = args.shard, args.num_shards
+    if (shard is None) != (num_shards is None):
+        raise ValueError("Sharding requires both --shard and --num_shards.")
+
+    if args.prune_kb is not None:
+        kb = HPOKnowledgeBase.from_workspace(ws)
+        n_removed = kb.prune(max_per_key=args.prune_kb)
+        print(f"Removed {n_removed} configurations from the knowledge base, {len(kb)} are left.")
+    elif args.verify:
+        if not verify_ensembles(ws, pi_sets, df_dim_train, selected_ids=selected_ids):
+            sys.exit(1)
+    elif args.export:
+        export_pi_sets(ws, pi_sets, df_dim_train, store=store, backend=args.backend, selected_ids=selected_ids,
+                       drop_full=args.drop_full)
+    elif args.pilots:
+        train_pilots(ws, pi_sets, df_dim_train, store=store, backend=args.backend, selected_ids=selected_ids)
+    elif shard is not None:
+        if args.racing or args.pi_set is not None:
+            raise ValueError("Sharding cannot be combined with --racing or --pi_set.")
+        train_shard(ws, pi_sets, df_dim_train, shard=shard, num_shards=num_shards, store=store,
+                    backend=args.backend, selected_ids=selected_ids)
+    elif args.racing:
+        if args.pi_set is not None:
+            raise ValueError("Racing compares all Pi sets and cannot be combined with --pi_set.")
+        print("Racing all Pi sets.")
+        race_pi_sets(ws, pi_sets, df_dim_train, store=store, backend=args.backend, selected_ids=selected_ids,
+                     eta=args.eta, min_members=args.min_members, overwrite=args.overwrite)
+    elif args.pi_set is None:
         # Train all Pi sets
         print("Training all Pi sets.")
-        train_all_pi_sets(ws, pi_sets, df_dim_train)
+        train_all_pi_sets(ws, pi_sets, df_dim_train, store=store, backend=args.backend, selected_ids=selected_ids,
+                          overwrite=args.overwrite)
     else:
         # Train only specific Pi set
+        s = pi_sets[args.pi_set]
+        rep_id = load_equivalence(ws).get(s.id, s.id)
+        if rep_id != s.id:
+            print(f"Pi set {s.id} is equivalent to Pi set {rep_id} for the configured estimators. Skipping.")
+            return
+        if selected_ids is not None and s.id not in selected_ids:
+            print(f"Pi set {s.id} was not selected by screening. Skipping.")
+            return
         print(f"Training Pi set {args.pi_set}.")
-        train_pi_set(ws, pi_sets[args.pi_set], df_dim_train)
+        train_pi_set(ws, s, df_dim_train, store=store, backend=args.backend, overwrite=args.overwrite)
 
 
 if __name__ == '__main__':
@@ -1,108 +1,83 @@
-from typing import List
+import argparse
 
 import matplotlib.pyplot as plt
-import numpy as np
 import pandas as pd
-import seaborn as sns
-from sklearn.metrics import r2_score, mean_squared_error
 
 import piml
-from piml.ml import Experiment
-from piml.ml.transform import DimToPiTransformer
-from piml.utils.lazy_array import LazyArray
+from piml.ml.evaluation import find_ensembles
+from piml.ml.report import report_ensembles, plot_overview
+from piml.pi.equivalence import load_equivalence
+from piml.pi.io import load_pi_sets
+
+
+def parse_args():
+    """ Parse command line arguments """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stream", action="store_true",
+                        help="Evaluate with bounded memory: members one at a time, test data in row chunks.")
+    parser.add_argument("--max_memory", type=float, default=1024,
+                        help="Memory ceiling in MB that sets the chunk size of streaming evaluation.")
+    parser.add_argument("--n_jobs", type=int, default=-1, help="Number of ensembles evaluated in parallel.")
+    parser.add_argument("--include_eliminated", action="store_true",
+                        help="Also evaluate partial ensembles of sets eliminated by racing (see step 4 --racing).")
+    parser.add_argument("--headless", action="store_true",
+                        help="Only write figures to files, do not show the overview (e.g., on compute nodes).")
+    return parser.parse_args()
+
 
 if __name__ == '__main__':
     ws = piml.Workspace.auto()
-
-    # Load ensembles
-    ensembles = ws.data_trained.glob("*/ensemble")
-    ensembles = [ens_path for ens_path in ensembles if ens_path.is_dir()]
-    ensembles = sorted(ensembles)
-
-    # Dimensional test data
-    df_dim_test = pd.read_csv(
-        ws.data_train_test / ws.config.dataset.get_test_name(with_suffix=True),
-        parse_dates=["TIME"],
+    args = parse_args()
+    if args.headless:
+        plt.switch_backend("Agg")
+
+    # Load ensembles. Full members may have been deleted after slim export.
+    ensembles = find_ensembles(ws, include_eliminated=args.include_eliminated)
+
+    # Evaluate ensembles in parallel or take results from cache, if members, test data and transformers are unchanged.
+    # Scores and figures of each ensemble are written to `report` next to the ensemble.
+    results = report_ensembles(
+        ws, ensembles, ws.data_train_test / ws.config.dataset.get_test_name(with_suffix=True),
+        n_jobs=args.n_jobs, stream=args.stream, max_memory_mb=args.max_memory,
     )
 
     # Store ensemble scores
     ens_scores = []
     pi_sets = []
+    summary = []
 
-    for ens_path in ensembles:
-        # Load ensemble
-        ens: List[Experiment] = LazyArray(ens_path, overwrite=False).gather_to_mem()
-        features = np.array(ens[0].features)  # ensure np array
-        pi_set = ens[0].pi_set
+    for result in results:
+        pi_set, scores = result["pi_set"], result["scores"]
         pi_sets.append(pi_set)
 
-        # Transform dimensional data to Pi space
-        pi_tf = DimToPiTransformer.from_workspace(ws=ws, pi_set=pi_set)
-        pi_tf.fit(df_dim=df_dim_test)
-        df_pi_test = pi_tf.transform_X_y()
-
-        # Make predictions using ensemble
-        X_pi_test = df_pi_test[features].to_numpy()
-        y_pi_pred_ens = np.array([
-            m.model.predict(X_pi_test) for m in ens
-        ])
-
-        # Inverse transform predictions to dimensional space
-        y_dim_pred_ens = np.array([
-            pi_tf.inverse_transform_y(y_pi=y_pi_pred)
-            for y_pi_pred in y_pi_pred_ens
-        ])
-
-        # Compute scores
-        dim_target = pi_tf.dim_target_tf  # DimToPiTransformer takes care of setting correct target name
-        log_y_dim_test = np.log10(df_dim_test[dim_target].to_numpy())
-        scores = np.array([
-            [
-                r2_score(log_y_dim_test, log_y_i),
-                np.sqrt(mean_squared_error(log_y_dim_test, log_y_i))
-            ]
-            for log_y_i in np.log10(y_dim_pred_ens)
-        ])
+        print(f"Set {pi_set.id}{' (cached)' if result['is_cached'] else ''}:")
         print(f"R2: {scores[:, 0].mean():.3f} +/- {scores[:, 0].std():.3f}")
         print(f"RMSE: {scores[:, 1].mean():.3f} +/- {scores[:, 1].std():.3f}")
         ens_scores.append(scores)
-
-        # Plot predictions
-        fig, ax = plt.subplots()
-        ax.plot(df_dim_test["TIME"], y_dim_pred_ens.T, color="gray", alpha=0.5)
-        ax.plot(df_dim_test["TIME"], df_dim_test[dim_target], color="red", linewidth=.75)
-        ax.set_ylabel(dim_target)
-        ax.set_yscale("log")
-        fig.show()
-
-        # Plot feature importance
-        perm_fi_ens = np.array([
-            m.perm_fi
-            for m in ens
-        ])
-        perm_fi_df = pd.DataFrame(data=perm_fi_ens, columns=features).melt(var_name="feature", value_name="perm_fi")
-
-        fig, ax = plt.subplots()
-        sns.boxplot(perm_fi_df, x="feature", y="perm_fi", ax=ax)
-        fig.show()
+        summary.append({
+            "id": pi_set.id, "target_id": pi_set.target_id, "n_members": len(scores),
+            "r2_mean": scores[:, 0].mean(), "r2_std": scores[:, 0].std(),
+            "rmse_mean": scores[:, 1].mean(), "rmse_std": scores[:, 1].std(),
+        })
+
+    # Table of all ensemble scores
+    pd.DataFrame(summary).to_csv(ws.data_trained / "evaluation_summary.csv", index=False)
+
+    # %% Sets skipped in training because they are equivalent to a trained set share its scores
+    rep_ids = load_equivalence(ws)
+    if rep_ids:
+        all_pi_sets = load_pi_sets(ws.data_extracted / "pi_sets_constrained")
+        scores_by_id = {s.id: scores for s, scores in zip(pi_sets, ens_scores)}
+        pi_sets, ens_scores = [], []
+        for set_id, rep_id in sorted(rep_ids.items()):
+            if rep_id in scores_by_id:
+                pi_sets.append(all_pi_sets[set_id])
+                ens_scores.append(scores_by_id[rep_id])
+                if rep_id != set_id:
+                    print(f"Set {set_id}: equivalent to set {rep_id}.")
 
     # %% Plot ensemble score overview and complexity
-    ens_scores = np.array(ens_scores)
-    df_ens_scores = pd.DataFrame(
-        data=ens_scores[:, :, 1].T,  # RMSE
-        columns=[f"Set {s.id}" for s in pi_sets]
-    )
-
-    # Compute complexity
-    complexity = np.array([
-        [len(pi.free_symbols) for pi in s.all_exprs]
-        for s in pi_sets
-    ])
-
-    fig, (ax_box, ax_complexity) = plt.subplots(ncols=2, figsize=(10, 5), sharey="row")
-    sns.boxplot(
-        data=df_ens_scores.melt(var_name="Set", value_name="RMSE"),
-        x="RMSE", y="Set",
-        ax=ax_box
-    )
-    sns.heatmap(complexity, ax=ax_complexity)
\ No newline at end of file
+    fig = plot_overview(ws, pi_sets, ens_scores, fig=None if args.headless else plt.figure(figsize=(10, 5)))
+    fig.savefig(ws.data_trained / "evaluation_overview.png", dpi=150)
+    if not args.headless:
+        plt.show()
@@ -0,0 +1,31 @@
+import numpy as np
+import sympy as sp
+
+import piml
+from piml.ml.evaluation import EnsembleEvaluation, PRED_FILE
+
+
+def make_evaluation(y_dim_pred: np.ndarray) -> EnsembleEvaluation:
+    x, y = sp.symbols("x y")
+    pi_set = piml.PiSet(id=0, feature_exprs=[x / y], target_id="pi_0", target_expr=y, target_inv_expr=y)
+    return EnsembleEvaluation(pi_set=pi_set, features=np.array(["pi_1"]), scores=np.ones((2, 2)),
+                              y_dim_pred=y_dim_pred, perm_fi=np.ones((2, 1)), dim_target="y", key="key")
+
+
+def test_save_memory_mapped_predictions_relative_path(tmp_path, monkeypatch):
+    """ Saving an evaluation loaded from a relative path (e.g., relative workspace) must not truncate the memory-mapped
+    predictions it is saved to
+    """
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "ws" / "5_trained" / "set_0" / "evaluation.npz"
+    path.parent.mkdir(parents=True)
+    y_dim_pred = np.random.default_rng(0).uniform(size=(2, 30_000))
+    make_evaluation(y_dim_pred).save(path)
+
+    rel_path = path.relative_to(tmp_path)
+    evaluation = EnsembleEvaluation.load(rel_path)
+    assert isinstance(evaluation.y_dim_pred, np.memmap)
+    evaluation.save(rel_path)
+
+    np.testing.assert_array_equal(np.load(path.with_name(PRED_FILE)), y_dim_pred)
+    np.testing.assert_array_equal(EnsembleEvaluation.load(rel_path).y_dim_pred, y_dim_pred)
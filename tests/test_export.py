@@ -0,0 +1,80 @@
+import pathlib
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import sympy as sp
+
+import piml
+from piml.ml.export import export_member, load_slim_ensemble
+from piml.ml.inference import EnsemblePredictor, predict_ensemble
+
+REPO_ROOT = pathlib.Path(__file__).parents[1]
+
+
+def test_slim_path_does_not_import_flaml():
+    code = "import sys, piml.ml.export, piml.ml.inference; sys.exit('flaml' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT).returncode == 0
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.uniform(size=(500, 2))
+    return X, X[:, 0] + 2 * X[:, 1] ** 2
+
+
+@pytest.fixture
+def estimators(data):
+    """ XGBoost and LightGBM estimators as wrapped by FLAML """
+    xgb = pytest.importorskip("xgboost")
+    lgb = pytest.importorskip("lightgbm")
+    X, y = data
+    return [
+        ("xgboost", xgb.XGBRegressor(n_estimators=10, n_jobs=2).fit(X, y)),
+        ("lgbm", lgb.LGBMRegressor(n_estimators=10, verbose=-1).fit(X, y)),
+    ]
+
+
+def make_member(name: str, estimator) -> SimpleNamespace:
+    """ Stand-in for a trained ``Experiment`` with the attributes used by the export """
+    x, y = sp.symbols("x y")
+    pi_set = piml.PiSet(id=3, feature_exprs=[x, x / y], target_id="pi_0", target_expr=y, target_inv_expr=y)
+    return SimpleNamespace(
+        model=SimpleNamespace(model=SimpleNamespace(estimator=estimator), best_estimator=name, best_config={}),
+        target="pi_0", features=np.array(["pi_1", "pi_2"]), pi_set=pi_set, train_score=0.1, val_score=0.9,
+        algo_fi=np.ones(2), perm_fi=np.ones(2), val_idx=None, config=SimpleNamespace(flaml=SimpleNamespace(seed=1)),
+    )
+
+
+def test_load_slim_ensemble_round_trip(tmp_path, data, estimators):
+    X, _ = data
+    for i, (name, est) in enumerate(estimators):
+        export_member(make_member(name, est), tmp_path, i + 1)
+
+    members = load_slim_ensemble(tmp_path)
+    assert [m.member for m in members] == [1, 2]
+    assert [m.estimator for m in members] == [name for name, _ in estimators]
+    assert members[0].pi_set == make_member(*estimators[0]).pi_set
+    np.testing.assert_array_equal(members[0].features, ["pi_1", "pi_2"])
+
+    y_pred = EnsemblePredictor.from_members(members).predict(X)
+    for y_pred_i, (_, est) in zip(y_pred, estimators):
+        np.testing.assert_allclose(y_pred_i, est.predict(X), rtol=1e-6)
+
+
+def test_predict_ensemble_matches_predictor(data, estimators):
+    X, _ = data
+    members = [make_member(name, est) for name, est in estimators]
+    xgb_params = estimators[0][1].get_booster().save_config()
+
+    # Chunks smaller than the data, so that several (member, chunk) pairs are predicted in parallel
+    y_pred = predict_ensemble(members, X, chunk_size=128, n_jobs=2)
+    np.testing.assert_array_equal(y_pred, EnsemblePredictor.from_members(members, n_jobs=1).predict(X))
+    for y_pred_i, (_, est) in zip(y_pred, estimators):
+        np.testing.assert_allclose(y_pred_i, est.predict(X), rtol=1e-6)
+
+    # Thread settings of the members' boosters are unchanged
+    assert estimators[0][1].get_booster().save_config() == xgb_params
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+import sympy as sp
+
+from piml.pi.kernels import PiKernel
+from piml.pi.monomial import MonomialEvaluator
+
+x, y, z = sp.symbols("x y z")
+ARGS = ["x", "y", "z"]
+EXPRS = [
+    x * y / z,  # integer exponents
+    x * sp.sqrt(y) / z ** 2,  # half-integer exponents
+    2 * x ** sp.Rational(-3, 2) * y,  # coefficient
+    x ** sp.Rational(1, 3) * y,  # log-space
+    x ** 5 / z,  # log-space (large exponent)
+    sp.log(x) + y,  # not a monomial
+]
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    n = 10_000
+    data = {v: rng.uniform(0.01, 50, n) * rng.choice([1, 1, -1], n) for v in ARGS}
+    data["x"][:3] = 0.
+    return data
+
+
+@pytest.mark.parametrize("backend", ["numexpr", "numba"])
+def test_backends_identical_to_reference(data, backend):
+    pytest.importorskip(backend)
+    ref = PiKernel(EXPRS, ARGS, backend="numpy")(data)
+    out = PiKernel(EXPRS, ARGS, backend=backend)(data)
+    # Bit-identical, not just close
+    np.testing.assert_array_equal(out, ref)
+
+
+def test_reference_is_monomial_evaluator(data):
+    monomials = EXPRS[:5]
+    ref = MonomialEvaluator(monomials, symbols=ARGS).evaluate(data)
+    np.testing.assert_array_equal(PiKernel(monomials, ARGS)(data), ref)
@@ -0,0 +1,15 @@
+from piml.config.training import TrainingConfig, MEMBER_DATA_COPIES
+
+
+def test_parallel_members_limited_by_memory():
+    data_bytes = 100 * 1024 ** 2
+    config = TrainingConfig(n_parallel_members=8, n_cpus=8)
+    assert config.parallel_members(data_bytes) == 8
+
+    config = TrainingConfig(n_parallel_members=8, n_cpus=8, max_memory=2 * MEMBER_DATA_COPIES * 100)
+    assert config.parallel_members(data_bytes) == 2
+    assert config.member_n_jobs(1, n_parallel=2) == 4
+
+    # At least one member is trained, even if it exceeds the budget
+    config = TrainingConfig(n_parallel_members=8, max_memory=1)
+    assert config.parallel_members(data_bytes) == 1
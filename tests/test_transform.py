@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+import sympy as sp
+
+import piml
+from piml.config.dim_vars import DimVarsConfig
+from piml.pi.base import PI_Y_expr
+from piml.pi.transform import PiTargetTransformer
+
+u, S, z, y = sp.symbols("u S z y")
+DIM_VARS = DimVarsConfig(
+    inputs=[{"symbol": "u", "signed": False, "dimensions": "m * s^(-1)"},
+            {"symbol": "S", "signed": False, "dimensions": "s^(-1)"},
+            {"symbol": "z", "signed": False, "dimensions": "m"}],
+    output={"symbol": "y", "signed": False, "dimensions": "m"},
+)
+TARGETS = [
+    (y * S / u, PI_Y_expr * u / S),  # Pi_y factor is Pi_y itself
+    (y ** 2 * S / u, sp.sqrt(PI_Y_expr * u / S)),  # Pi_y factor has to be evaluated
+    (y / z - u / (S * z), PI_Y_expr * z + u / S),  # not separable
+]
+
+
+@pytest.mark.parametrize("backend", ["numpy", "numexpr", "numba"])
+@pytest.mark.parametrize("target_expr, target_inv_expr", TARGETS)
+def test_inverse_transform_array_matches_members(target_expr, target_inv_expr, backend):
+    pytest.importorskip(backend)
+    pi_set = piml.PiSet(id=0, feature_exprs=[u / (S * z)], target_id="pi_0", target_expr=target_expr,
+                        target_inv_expr=target_inv_expr)
+    rng = np.random.default_rng(0)
+    df_dim = pd.DataFrame({v: rng.uniform(0.5, 2., 1000) for v in DIM_VARS.all_strs})
+    tf = PiTargetTransformer(pi_set, DIM_VARS, backend=backend).fit(df_dim=df_dim)
+
+    y_pi = tf.transform(y_non_log=df_dim["y"]).to_numpy() * rng.uniform(0.9, 1.1, (5, 1000))
+    y_dim = tf.inverse_transform_array(y_pi=y_pi)
+
+    assert y_dim.shape == y_pi.shape
+    for y_pi_i, y_dim_i in zip(y_pi, y_dim):
+        np.testing.assert_array_equal(tf.inverse_transform_array(y_pi=y_pi_i), y_dim_i)
+        np.testing.assert_allclose(y_dim_i, tf.eval_inv_fn(PI_Y=y_pi_i, **df_dim), rtol=1e-12)